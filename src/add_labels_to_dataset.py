@@ -1,15 +1,64 @@
 from __future__ import annotations
 
-import json
+import argparse
+import itertools
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, Tuple, TypeVar
 import re
 
-from .labeler import label_tweet
+from .batch_labeler import (
+    LABEL_BATCH_BASE_URL,
+    LABEL_BATCH_TRANSPORT,
+    BatchTransport,
+    make_batch_transport,
+    run_batch,
+)
+from .checkpoint import StageJournal, journal_path_for
+from .concurrency import (
+    TokenBucketLimiter,
+    backoff_delay,
+    is_rate_limit_error,
+    ordered_map,
+    retry_after_seconds,
+)
+from .label_cache import LabelCache, cached_label_tweet
+from .labeler import (
+    estimate_packed_tokens,
+    estimate_request_tokens,
+    label_tweet,
+    label_tweets_packed,
+    plan_packs,
+)
+from .records import count_records, read_records, tap_records, write_records
+from .text_preprocessing import row_texts
+
+INPUT_PATH = Path("health_tweets_with_ocr.jsonl")
+OUTPUT_PATH = Path("health_tweets_labeled.jsonl")
 
-INPUT_PATH = Path("health_tweets_with_ocr.json")
-OUTPUT_PATH = Path("health_tweets_labeled.json")
+# Concurrent labeling settings (override via .env / environment).
+LABEL_CONCURRENCY = int(os.getenv("LABEL_CONCURRENCY", "1"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "200000"))
+LABEL_MAX_RETRIES = int(os.getenv("LABEL_MAX_RETRIES", "6"))
+LABEL_BACKEND = os.getenv("LABEL_BACKEND", "sync")
+# Packed labeling: several tweets per request, capped by an estimated token budget.
+LABEL_PACK_SIZE = int(os.getenv("LABEL_PACK_SIZE", "1"))
+LABEL_PACK_TOKEN_BUDGET = int(os.getenv("LABEL_PACK_TOKEN_BUDGET", "8000"))
+
+T = TypeVar("T")
+
+# Fields this stage adds to a row; they are what the progress journal keeps.
+LABEL_FIELDS = (
+    "has_claim_pattern",
+    "is_strong_claim",
+    "label",
+    "label_justification",
+    "label_sources",
+)
 
 
 CLAIM_PATTERN = re.compile(
@@ -32,91 +81,480 @@ def already_labeled(row: Dict[str, Any]) -> bool:
     return bool(label)
 
 
-def add_labels_to_dataset(
-    input_path: Path = INPUT_PATH,
-    output_path: Path = OUTPUT_PATH,
-    max_items: Optional[int] = None,
-    sleep_seconds: float = 0.0,
-    skip_already_labeled: bool = False,
-) -> int:
-    """
-    Read tweets with OCR from input_path, label them with the LLM,
-    and write the updated dataset to output_path.
+def _mark_claim_patterns(row: Dict[str, Any]) -> None:
+    tweet_text = row.get("text") or ""
+    ocr_text = row.get("ocr_text_combined") or ""
+    full_text = (tweet_text or "") + "\n" + (ocr_text or "")
+    row["has_claim_pattern"] = looks_like_claim(full_text)
+    row["is_strong_claim"] = bool(CLAIM_PATTERN.search(ocr_text or ""))
 
-    IMPORTANT: The LLM is called for *every* tweet (up to max_items),
-    regardless of whether a clear claim is detected or not.
 
-    - max_items: if set, limit the number of LLM calls in this run.
-                 The file is NOT truncated; all rows are written back.
-    - sleep_seconds: optional pause between API calls.
-    - skip_already_labeled: if True, rows that already have a 'label' are left as-is.
+def _error_label_info(e: Exception) -> Dict[str, Any]:
+    return {
+        "label": "unverified",
+        "justification": f"Labeling error: {e}",
+        "sources": [],
+    }
 
-    Returns: number of tweets that were (re)labeled in this run.
+
+def _apply_label_info(row: Dict[str, Any], label_info: Dict[str, Any]) -> None:
+    row["label"] = label_info.get("label", "unverified")
+    row["label_justification"] = label_info.get(
+        "justification",
+        "No justification provided by labeling step.",
+    )
+    row["label_sources"] = label_info.get("sources", [])
+
+
+def _call_with_backoff(
+    call: Callable[[], T],
+    tokens: int,
+    limiter: TokenBucketLimiter,
+    what: str,
+    max_retries: int = LABEL_MAX_RETRIES,
+) -> T:
+    """
+    Run an API call under the shared limiter, retrying 429s with backoff.
+    Any other error (or a 429 after max_retries) is raised to the caller.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        try:
+            result = call()
+            limiter.on_success()
+            return result
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= max_retries:
+                raise
+            attempt += 1
+            retry_after = retry_after_seconds(e)
+            limiter.on_rate_limited(retry_after)
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            print(
+                f"  - Rate limited on {what} "
+                f"(attempt {attempt}/{max_retries}); retrying in {delay:.1f}s, "
+                f"rate now {limiter.rate_fraction:.0%} of budget"
+            )
+            time.sleep(delay)
+
+
+def _label_with_backoff(
+    row: Dict[str, Any],
+    limiter: TokenBucketLimiter,
+    cache: Optional[LabelCache] = None,
+) -> Dict[str, Any]:
+    """
+    Label one row for the concurrent path. Cache hits skip the limiter
+    entirely; errors are turned into an 'unverified' label, as in the
+    sequential path, and are never cached.
     """
-    if not input_path.exists():
-        raise FileNotFoundError(f"Input file not found: {input_path}")
+    tweet_id = row.get("tweet_id")
+    tweet_text, ocr_text = row_texts(row)
+
+    def compute() -> Dict[str, Any]:
+        return _call_with_backoff(
+            lambda: label_tweet(tweet_text, ocr_text),
+            estimate_request_tokens(tweet_text, ocr_text),
+            limiter,
+            f"tweet_id={tweet_id}",
+        )
 
-    data: List[Dict[str, Any]] = json.loads(input_path.read_text(encoding="utf-8"))
-    total = len(data)
-    print(f"Loaded {total} tweets from {input_path}")
+    try:
+        if cache is None:
+            return compute()
+        key = cache.make_key(tweet_text, ocr_text)
+        return cache.get_or_compute(key, compute)
+    except Exception as e:
+        print(f"  - Error labeling tweet_id={tweet_id}: {e}")
+        return _error_label_info(e)
 
-    labeled_count = 0
 
-    for idx, row in enumerate(data, start=1):
+# (row index, row, whether this run should label it)
+Job = Tuple[int, Dict[str, Any], bool]
+
+
+def _iter_jobs(
+    records: Iterable[Dict[str, Any]],
+    total: Any,
+    max_items: Optional[int],
+    skip_already_labeled: bool,
+    journal: Optional[StageJournal] = None,
+) -> Iterator[Job]:
+    """
+    Decide row by row whether to label, keeping every row in the stream.
+    Rows finished by an interrupted earlier run are restored from the
+    journal and not labeled again (nor counted against max_items).
+    """
+    n_jobs = 0
+    limit_reached = False
+
+    for idx, row in enumerate(records, start=1):
         tweet_id = row.get("tweet_id")
-        tweet_text = row.get("text") or ""
-        ocr_text = row.get("ocr_text_combined") or ""
 
-        if max_items is not None and labeled_count >= max_items:
+        if journal is not None and journal.restore(row):
+            yield idx, row, False
+            continue
+
+        if not limit_reached and max_items is not None and n_jobs >= max_items:
             print(
                 f"Reached max_items={max_items} LLM calls; "
                 f"stopping further labeling but keeping all existing data."
             )
-            break
+            limit_reached = True
+
+        if limit_reached:
+            yield idx, row, False
+            continue
 
         if skip_already_labeled and already_labeled(row):
             print(f"[{idx}/{total}] Skipping tweet_id={tweet_id}: already labeled.")
+            yield idx, row, False
             continue
 
-        full_text = (tweet_text or "") + "\n" + (ocr_text or "")
-        row["has_claim_pattern"] = looks_like_claim(full_text)
-        row["is_strong_claim"] = bool(CLAIM_PATTERN.search(ocr_text or ""))
+        _mark_claim_patterns(row)
+        n_jobs += 1
+        yield idx, row, True
+
+
+def _label_sequentially(
+    jobs: Iterable[Job],
+    sleep_seconds: float,
+    cache: Optional[LabelCache] = None,
+) -> Iterator[Job]:
+    for idx, row, todo in jobs:
+        if todo:
+            tweet_id = row.get("tweet_id")
+            hits_before = cache.hits if cache else 0
+            try:
+                label_info = cached_label_tweet(*row_texts(row), cache=cache)
+            except Exception as e:
+                print(f"  - Error labeling tweet_id={tweet_id}: {e}")
+                label_info = _error_label_info(e)
+            _apply_label_info(row, label_info)
+
+            called_api = cache is None or cache.hits == hits_before
+            if sleep_seconds > 0 and called_api:
+                time.sleep(sleep_seconds)
 
-        print(f"[{idx}/{total}] Labeling tweet_id={tweet_id}")
+        yield idx, row, todo
 
+
+def _label_concurrently(
+    jobs: Iterable[Job],
+    concurrency: int,
+    limiter: TokenBucketLimiter,
+    cache: Optional[LabelCache] = None,
+) -> Iterator[Job]:
+    """
+    Label jobs on a thread pool. Rows come back in input order, so the
+    written file is identical in layout to a sequential run.
+    """
+    def work(job: Job) -> Job:
+        idx, row, todo = job
+        if todo:
+            _apply_label_info(row, _label_with_backoff(row, limiter, cache))
+        return job
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        yield from ordered_map(pool, work, jobs, max_in_flight=concurrency * 4)
+
+
+def _label_pack_window(
+    todo: List[Tuple[int, Dict[str, Any]]],
+    pack_size: int,
+    token_budget: int,
+    pool: ThreadPoolExecutor,
+    limiter: TokenBucketLimiter,
+    cache: Optional[LabelCache] = None,
+) -> int:
+    """
+    Label the rows in `todo` N tweets per request. Every item of a packed
+    answer is validated on its own; items that are missing or malformed fall
+    back to a regular single-tweet call. Returns the number of fallbacks.
+    """
+    pending: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
+    used_ids = set()
+
+    for idx, row in todo:
+        if cache is not None:
+            key = cache.make_key(*row_texts(row))
+            cached = cache.lookup(key)
+            if cached is not None:
+                _apply_label_info(row, cached)
+                continue
+
+        # The id only has to be unique inside this window; it is how answers are matched.
+        pack_id = str(row.get("tweet_id") or f"row-{idx}")
+        if pack_id in used_ids:
+            pack_id = f"{pack_id}#{idx}"
+        used_ids.add(pack_id)
+
+        tweet_text, ocr_text = row_texts(row)
+        item = {
+            "tweet_id": pack_id,
+            "text": tweet_text,
+            "ocr_text": ocr_text,
+        }
+        pending.append((idx, row, item))
+
+    by_id = {item["tweet_id"]: row for _, row, item in pending}
+    packs = plan_packs([item for _, _, item in pending], pack_size, token_budget)
+
+    def work(pack: List[Dict[str, Any]]) -> int:
         try:
-            label_info = label_tweet(tweet_text, ocr_text)
+            results = _call_with_backoff(
+                lambda: label_tweets_packed(pack),
+                estimate_packed_tokens(pack),
+                limiter,
+                f"pack of {len(pack)}",
+            )
         except Exception as e:
-            print(f"  - Error labeling tweet_id={tweet_id}: {e}")
-            label_info = {
-                "label": "unverified",
-                "justification": f"Labeling error: {e}",
-                "sources": [],
-            }
-
-        row["label"] = label_info.get("label", "unverified")
-        row["label_justification"] = label_info.get(
-            "justification",
-            "No justification provided by labeling step.",
+            print(f"  - Error labeling pack of {len(pack)}: {e}")
+            results = {}
+
+        fallbacks = 0
+        for item in pack:
+            row = by_id[item["tweet_id"]]
+            label_info = results.get(item["tweet_id"])
+            if label_info is None:
+                fallbacks += 1
+                label_info = _label_with_backoff(row, limiter, cache)
+            elif cache is not None:
+                cache.record(cache.make_key(item["text"], item["ocr_text"]), label_info)
+            _apply_label_info(row, label_info)
+        return fallbacks
+
+    return sum(pool.map(work, packs))
+
+
+def _label_packed(
+    jobs: Iterable[Job],
+    pack_size: int,
+    token_budget: int,
+    concurrency: int,
+    limiter: TokenBucketLimiter,
+    cache: Optional[LabelCache] = None,
+) -> Iterator[Job]:
+    """
+    Packed labeling over a stream: rows are buffered in windows of a few
+    packs per worker, labeled, and released in input order.
+    """
+    workers = max(1, concurrency)
+    window_size = pack_size * workers * 2
+    fallbacks = 0
+    n_packed = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        window: List[Job] = []
+        for job in itertools.chain(jobs, [None]):
+            if job is not None:
+                window.append(job)
+            if window and (job is None or len(window) >= window_size):
+                todo = [(idx, row) for idx, row, flag in window if flag]
+                n_packed += len(todo)
+                fallbacks += _label_pack_window(todo, pack_size, token_budget, pool, limiter, cache)
+                yield from window
+                window = []
+
+    print(
+        f"Packed labeling of {n_packed} tweets (pack_size={pack_size}, "
+        f"token_budget={token_budget}): {fallbacks} item(s) fell back to single-tweet calls."
+    )
+
+
+def _label_via_batch(
+    make_jobs: Callable[[], Iterator[Job]],
+    cache: Optional[LabelCache] = None,
+    transport: Optional[BatchTransport] = None,
+) -> Iterator[Job]:
+    """
+    Label through the batch API in two passes over the input: the first
+    writes the batch file (cached rows are resolved locally and left out),
+    the second merges results back by tweet_id while streaming rows out.
+    """
+    transport = transport or make_batch_transport()
+
+    def cache_key(row: Dict[str, Any]) -> str:
+        return cache.make_key(*row_texts(row))
+
+    def uncached_rows() -> Iterator[Dict[str, Any]]:
+        for _, row, todo in make_jobs():
+            if todo and (cache is None or cache.get(cache_key(row)) is None):
+                yield row
+
+    results = run_batch(uncached_rows(), transport=transport)
+
+    for idx, row, todo in make_jobs():
+        if todo:
+            label_info = cache.lookup(cache_key(row)) if cache is not None else None
+            if label_info is None:
+                label_info = results.get(str(row.get("tweet_id")))
+                if label_info is None:
+                    label_info = _error_label_info(RuntimeError("no result returned by batch"))
+                elif (cache is not None and transport.cacheable
+                      and not label_info["justification"].startswith("Labeling error")):
+                    cache.record(cache_key(row), label_info)
+            _apply_label_info(row, label_info)
+        yield idx, row, todo
+
+
+def add_labels_to_dataset(
+    input_path: Path = INPUT_PATH,
+    output_path: Path = OUTPUT_PATH,
+    max_items: Optional[int] = None,
+    sleep_seconds: float = 0.0,
+    skip_already_labeled: bool = False,
+    concurrency: int = 1,
+    requests_per_minute: Optional[float] = OPENAI_RPM,
+    tokens_per_minute: Optional[float] = OPENAI_TPM,
+    use_cache: bool = True,
+    backend: str = "sync",
+    batch_transport: Optional[BatchTransport] = None,
+    pack_size: int = 1,
+    pack_token_budget: int = LABEL_PACK_TOKEN_BUDGET,
+    resume: bool = True,
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> int:
+    """
+    Stream tweets with OCR from input_path, label them with the LLM,
+    and write the updated dataset to output_path (.jsonl, or .json for the
+    legacy array format). Only a bounded window of rows is held in memory.
+
+    IMPORTANT: The LLM is called for *every* tweet (up to max_items),
+    regardless of whether a clear claim is detected or not.
+
+    - max_items: if set, limit the number of LLM calls in this run.
+                 The file is NOT truncated; all rows are written back.
+    - sleep_seconds: optional pause between API calls (sequential mode only).
+    - skip_already_labeled: if True, rows that already have a 'label' are left as-is.
+    - concurrency: number of parallel LLM calls. Values > 1 switch to a
+                   thread pool paced by a token-bucket limiter built from
+                   requests_per_minute / tokens_per_minute, which backs off
+                   adaptively on HTTP 429 responses.
+    - use_cache: if True, results are looked up in / stored to the persistent
+                 LabelCache, so identical inputs are only sent to the API once.
+    - backend: "sync" calls the chat API directly; "batch" submits one
+               offline batch job (cheaper, high latency) and merges the
+               results back by tweet_id.
+    - batch_transport: BatchTransport used by the "batch" backend; defaults
+                       to the one named by LABEL_BATCH_TRANSPORT (OpenAI, at
+                       LABEL_BATCH_BASE_URL if set, or the offline mock).
+    - pack_size: with the "sync" backend, values > 1 send up to pack_size
+                 tweets per request (at most pack_token_budget estimated
+                 tokens), so SYSTEM_PROMPT is paid once per pack.
+    - resume: every labeled row is appended to <output_path>.journal as it
+              finishes. If a previous run was interrupted, rows found in
+              the journal are merged back by tweet_id instead of being
+              labeled again. Pass False to discard the journal and start over.
+    - records: optional stream of rows to use instead of reading input_path
+               (e.g. handed over by a running OCR stage). The batch backend
+               needs two passes, so it drains such a stream (its producer
+               writes input_path as it goes) and then reads input_path.
+    - on_record: optional callback receiving each output row once written.
+
+    Returns: number of tweets that were (re)labeled in this run.
+    """
+    if backend not in ("sync", "batch"):
+        raise ValueError(f"Unknown labeling backend: {backend!r} (expected 'sync' or 'batch')")
+    if records is not None and backend == "batch":
+        for _ in records:
+            pass
+        records = None
+    if records is None:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        total: Any = count_records(input_path)
+        print(f"Streaming {total} tweets from {input_path}")
+    else:
+        total = "?"
+        print("Streaming tweets from upstream stage")
+
+    journal = StageJournal(journal_path_for(output_path), LABEL_FIELDS, resume=resume)
+
+    def make_jobs() -> Iterator[Job]:
+        source = read_records(input_path) if records is None else records
+        return _iter_jobs(source, total, max_items, skip_already_labeled, journal)
+
+    cache = LabelCache() if use_cache else None
+    limiter = TokenBucketLimiter(requests_per_minute, tokens_per_minute)
+
+    if backend == "batch":
+        results = _label_via_batch(make_jobs, cache, batch_transport)
+    elif pack_size > 1:
+        results = _label_packed(
+            make_jobs(), pack_size, pack_token_budget, concurrency, limiter, cache
         )
-        row["label_sources"] = label_info.get("sources", [])
+    elif concurrency > 1:
+        print(
+            f"Labeling with concurrency={concurrency} "
+            f"(rpm={requests_per_minute}, tpm={tokens_per_minute})"
+        )
+        results = _label_concurrently(make_jobs(), concurrency, limiter, cache)
+    else:
+        results = _label_sequentially(make_jobs(), sleep_seconds, cache)
 
-        labeled_count += 1
+    labeled_count = 0
 
-        if sleep_seconds > 0:
-            time.sleep(sleep_seconds)
+    def rows() -> Iterator[Dict[str, Any]]:
+        nonlocal labeled_count
+        for idx, row, labeled in results:
+            if labeled:
+                labeled_count += 1
+                print(f"[{idx}/{total}] Labeled tweet_id={row.get('tweet_id')}: {row['label']}")
+                # Failed calls are not journaled, so a resumed run retries them.
+                if not str(row.get("label_justification") or "").startswith("Labeling error"):
+                    journal.record(row)
+            yield row
 
-    output_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"Saved {total} tweets (with {labeled_count} newly labeled) to {output_path}")
+    try:
+        n_saved = write_records(output_path, tap_records(rows(), on_record))
+    finally:
+        journal.close()
+    journal.finish()
+    print(f"Saved {n_saved} tweets (with {labeled_count} newly labeled) to {output_path}")
+    if journal.restored:
+        print(f"Restored {journal.restored} tweets labeled by an interrupted run.")
+    if cache is not None:
+        stats = cache.stats()
+        print(
+            f"Label cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries, "
+            f"{stats['bytes']} bytes"
+        )
+        cache.close()
     return labeled_count
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Label the OCR dataset with the LLM.")
+    parser.add_argument("--backend", choices=["sync", "batch"], default=LABEL_BACKEND)
+    parser.add_argument(
+        "--batch-transport",
+        choices=["openai", "mock"],
+        default=LABEL_BATCH_TRANSPORT,
+        help="batch API to use with --backend batch; 'mock' labels offline",
+    )
+    parser.add_argument(
+        "--batch-base-url",
+        default=LABEL_BATCH_BASE_URL,
+        help="OpenAI-compatible base URL for the 'openai' batch transport",
+    )
+    args = parser.parse_args(argv or [])
+
     add_labels_to_dataset(
         max_items=None,
         sleep_seconds=0.5,
         skip_already_labeled=False,
+        concurrency=LABEL_CONCURRENCY,
+        backend=args.backend,
+        batch_transport=(
+            make_batch_transport(args.batch_transport, args.batch_base_url)
+            if args.backend == "batch" else None
+        ),
+        pack_size=LABEL_PACK_SIZE,
     )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1:])
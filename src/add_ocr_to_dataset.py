@@ -1,61 +1,343 @@
 from __future__ import annotations
 
-import json
+import argparse
+import io
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Callable, Iterable, List, Dict, Any, Iterator, Optional, Tuple
 
-from src.ocr_step import ocr_image_url
+from src.checkpoint import StageJournal, journal_path_for
+from src.concurrency import ordered_map
+from PIL import Image
+
+from src.ocr_cache import content_hash
+from src.ocr_step import (
+    DEFAULT_PREPROCESS,
+    OCR_TEXT_FILTER,
+    OCR_TEXT_FILTER_AUDIT,
+    fetch_image_bytes,
+    get_ocr_backend,
+    ocr_image_bytes_cached,
+    ocr_image_screened,
+    warm_up_ocr,
+)
 from src.ocr_cleaning import clean_ocr_text
+from src.records import count_records, read_records, tap_records, write_records
+
+
+INPUT_PATH = Path("health_tweets_with_images.jsonl")
+OUTPUT_PATH = Path("health_tweets_with_ocr.jsonl")
+
+# Number of OCR processes; 1 keeps the original in-process behaviour.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+
+# Print each image's step timings; by default only the per-run summary.
+OCR_VERBOSE = os.getenv("OCR_VERBOSE", "false").lower() == "true"
+
+# Fields this stage adds to a row; they are what the progress journal keeps.
+OCR_FIELDS = ("ocr_texts", "ocr_text_combined")
+
+# Per-image work steps timed by the OCR workers, in pipeline order.
+TIMED_STEPS = ("decode", "screen", "preprocess", "ocr")
+
+# (ocr_texts, cache sources, per-image timings) of one row
+RowResult = Tuple[List[str], List[str], List[Dict[str, float]]]
 
 
-INPUT_PATH = Path("health_tweets_with_images.json")
-OUTPUT_PATH = Path("health_tweets_with_ocr.json")
+def _clean(raw_txt: str) -> str:
+    return clean_ocr_text(raw_txt, keep_english=False, keep_digits=True)
+
+
+def ocr_bytes_worker(data: bytes, use_cache: bool = True) -> Tuple[str, str, Dict[str, float]]:
+    """
+    Process-pool entry point, shared with the scoring service: decode,
+    screen, preprocess, OCR and clean one image. Returns (cleaned_text, source, timings) with source "exact",
+    "near", "miss" or "skipped" (no text per the text filter), or, for an
+    image the filter ruled out but the audit OCR'd anyway, "audit-text"
+    (a false skip) or "audit-empty"; timings are the seconds spent per
+    step (see TIMED_STEPS).
+    """
+    timings: Dict[str, float] = {}
+    if use_cache:
+        raw_txt, source = ocr_image_bytes_cached(data, timings=timings)
+    else:
+        started = time.perf_counter()
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        timings["decode"] = time.perf_counter() - started
+        raw_txt, source = ocr_image_screened(img, content_hash(data), timings=timings)
+    cleaned = _clean(raw_txt)
+    if source == "audit":
+        source = "audit-text" if cleaned else "audit-empty"
+    return cleaned, source, timings
+
+
+def _ocr_row_sequential(row: Dict[str, Any], use_cache: bool) -> RowResult:
+    ocr_texts: List[str] = []
+    sources: List[str] = []
+    timings: List[Dict[str, float]] = []
+    for url in row.get("image_urls") or []:
+        try:
+            cleaned, source, spent = ocr_bytes_worker(fetch_image_bytes(url), use_cache)
+            sources.append(source)
+            timings.append(spent)
+            if cleaned:
+                ocr_texts.append(cleaned)
+        except Exception as e:
+            print(f"  - Error OCRing {url}: {e}")
+    return ocr_texts, sources, timings
+
+
+def _ocr_row_parallel(
+    row: Dict[str, Any],
+    ocr_pool: ProcessPoolExecutor,
+    use_cache: bool,
+) -> RowResult:
+    """
+    Fetch this row's images one by one and hand each to the process pool as
+    soon as it arrives, so downloads overlap with OCR. Texts are gathered
+    in image order; a failing image only loses its own text.
+    """
+    pending: List[Tuple[str, Future]] = []
+    for url in row.get("image_urls") or []:
+        try:
+            data = fetch_image_bytes(url)
+        except Exception as e:
+            print(f"  - Error OCRing {url}: {e}")
+            continue
+        pending.append((url, ocr_pool.submit(ocr_bytes_worker, data, use_cache)))
+
+    ocr_texts: List[str] = []
+    sources: List[str] = []
+    timings: List[Dict[str, float]] = []
+    for url, fut in pending:
+        try:
+            cleaned, source, spent = fut.result()
+            sources.append(source)
+            timings.append(spent)
+            if cleaned:
+                ocr_texts.append(cleaned)
+        except Exception as e:
+            print(f"  - Error OCRing {url}: {e}")
+    return ocr_texts, sources, timings
+
+
+def _format_timings(spent: Dict[str, float]) -> str:
+    return ", ".join(f"{step} {spent[step] * 1e3:.0f} ms" for step in TIMED_STEPS if step in spent)
+
+
+def _timing_summary(samples: Dict[str, List[float]]) -> List[str]:
+    """One line per timed step: image count, mean, p50 and p95 in milliseconds."""
+    lines = []
+    for step in TIMED_STEPS:
+        values = sorted(samples.get(step) or [])
+        if not values:
+            continue
+        mean = sum(values) / len(values)
+        p50 = values[len(values) // 2]
+        p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+        lines.append(
+            f"  {step:<10} {len(values):6d} image(s)  mean {mean * 1e3:7.1f} ms  "
+            f"p50 {p50 * 1e3:7.1f} ms  p95 {p95 * 1e3:7.1f} ms  total {sum(values):7.1f}s"
+        )
+    return lines
 
 
 def add_ocr_to_dataset(
     input_path: Path = INPUT_PATH,
     output_path: Path = OUTPUT_PATH,
+    workers: int = OCR_WORKERS,
+    fetch_threads: Optional[int] = None,
+    use_cache: bool = True,
+    resume: bool = True,
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    verbose: bool = OCR_VERBOSE,
 ) -> int:
     """
-    Read tweets with images from input_path, run OCR on each image URL,
-    and write a new JSON file with OCR text attached.
+    Stream tweets with images from input_path, run OCR on each image URL,
+    and write them with OCR text attached to output_path (.jsonl, or .json
+    for the legacy array format). Only a bounded window of tweets is held
+    in memory at any time.
+
+    - workers: number of OCR processes. With workers > 1, images are fetched
+               by `fetch_threads` threads (default 2 * workers) and OCR'd on
+               a process pool; per-tweet ordering of 'ocr_texts' is kept.
+    - use_cache: reuse OCR text of identical / near-duplicate images from
+                 the persistent OcrCache instead of running Tesseract again.
+    - resume: finished rows are appended to <output_path>.journal; after an
+              interrupted run, journaled rows are merged back by tweet_id
+              instead of being OCR'd again. Rows with an image that could
+              not be fetched or OCR'd are not journaled, so they are retried.
+              False discards the journal.
+    - records: optional stream of rows to use instead of reading input_path
+               (e.g. handed over by a running upstream stage).
+    - on_record: optional callback receiving each output row once written.
+    - verbose: also print the step timings of every image, not just the
+               per-run summary.
 
     Returns number of tweets processed.
     """
-    if not input_path.exists():
-        raise FileNotFoundError(f"Input file not found: {input_path}")
+    if records is None:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        total: Any = count_records(input_path)
+        print(f"Streaming {total} tweets from {input_path}")
+        records = read_records(input_path)
+    else:
+        total = "?"
+        print("Streaming tweets from upstream stage")
 
-    data: List[Dict[str, Any]] = json.loads(input_path.read_text(encoding="utf-8"))
-    print(f"Loaded {len(data)} tweets from {input_path}")
+    journal = StageJournal(journal_path_for(output_path), OCR_FIELDS, resume=resume)
 
-    for idx, row in enumerate(data, start=1):
-        image_urls: List[str] = row.get("image_urls") or []
-        ocr_texts: List[str] = []
+    started = time.monotonic()
+    n_images = 0
+    cache_sources: Counter = Counter()
+    step_seconds: Dict[str, List[float]] = {step: [] for step in TIMED_STEPS}
 
-        print(f"[{idx}/{len(data)}] OCR for tweet_id={row.get('tweet_id')} with {len(image_urls)} image(s)")
-
-        for url in image_urls:
-            try:
-                raw_txt = ocr_image_url(url)
-                cleaned = clean_ocr_text(raw_txt, keep_english=False, keep_digits=True)
-                if cleaned:
-                    ocr_texts.append(cleaned)
-            except Exception as e:
-                print(f"  - Error OCRing {url}: {e}")
+    def attach(
+        idx: int,
+        row: Dict[str, Any],
+        result: Optional[RowResult],
+    ) -> Dict[str, Any]:
+        nonlocal n_images
+        if result is None:
+            # Already OCR'd by an interrupted run and restored from the journal.
+            return row
 
+        image_urls = row.get("image_urls") or []
+        n_images += len(image_urls)
+        print(f"[{idx}/{total}] OCR for tweet_id={row.get('tweet_id')} with {len(image_urls)} image(s)")
 
+        ocr_texts, sources, timings = result
+        cache_sources.update(sources)
+        for n, spent in enumerate(timings, start=1):
+            for step, seconds in spent.items():
+                step_seconds[step].append(seconds)
+            if verbose and "ocr" in spent:
+                print(f"  - image {n}: {_format_timings(spent)}")
+        for n, source in enumerate(sources, start=1):
+            if source == "audit-text":
+                print(f"  - image {n}: text filter false skip (audit OCR found text)")
         row["ocr_texts"] = ocr_texts
         row["ocr_text_combined"] = "\n\n".join(ocr_texts)
+        # Only successfully OCR'd images report a source. Rows with a failed
+        # image are not journaled, so a resumed run retries them.
+        if len(sources) == len(image_urls):
+            journal.record(row)
+        return row
+
+    def sequential_rows() -> Iterator[Dict[str, Any]]:
+        for idx, row in enumerate(records, start=1):
+            if journal.restore(row):
+                yield attach(idx, row, None)
+            else:
+                yield attach(idx, row, _ocr_row_sequential(row, use_cache))
+
+    def parallel_rows(fetch_threads: int) -> Iterator[Dict[str, Any]]:
+        print(f"Running OCR with {workers} processes and {fetch_threads} fetch threads")
+        # Each worker loads the OCR engine once, up front.
+        with ProcessPoolExecutor(max_workers=workers, initializer=warm_up_ocr) as ocr_pool, \
+                ThreadPoolExecutor(max_workers=fetch_threads) as fetch_pool:
+            def work(row: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[RowResult]]:
+                if journal.restore(row):
+                    return row, None
+                return row, _ocr_row_parallel(row, ocr_pool, use_cache)
+
+            results = ordered_map(
+                fetch_pool, work, records, max_in_flight=fetch_threads * 2
+            )
+            for idx, (row, result) in enumerate(results, start=1):
+                yield attach(idx, row, result)
+
+    if workers > 1:
+        rows = parallel_rows(fetch_threads or workers * 2)
+    else:
+        rows = sequential_rows()
+
+    try:
+        n_saved = write_records(output_path, tap_records(rows, on_record))
+    finally:
+        journal.close()
+    journal.finish()
+
+    elapsed = time.monotonic() - started
+    print(f"OCR'd {n_images} image(s) in {elapsed:.1f}s "
+          f"({n_images / elapsed if elapsed else 0:.2f} images/s)")
+    if use_cache:
+        looked_up = sum(cache_sources.values())
+        hits = cache_sources["exact"] + cache_sources["near"]
+        print(
+            f"OCR cache: {hits}/{looked_up} hits "
+            f"({hits / looked_up if looked_up else 0:.1%}; "
+            f"exact={cache_sources['exact']}, near-duplicate={cache_sources['near']})"
+        )
+    screened = sum(cache_sources[k] for k in ("miss", "skipped", "audit-text", "audit-empty"))
+    if OCR_TEXT_FILTER and screened:
+        ruled_out = cache_sources["skipped"] + cache_sources["audit-text"] + cache_sources["audit-empty"]
+        audited = cache_sources["audit-text"] + cache_sources["audit-empty"]
+        print(
+            f"Text filter: {ruled_out}/{screened} screened image(s) had no text-like regions "
+            f"({ruled_out / screened:.1%}); {cache_sources['skipped']} skipped OCR"
+        )
+        if audited:
+            false_skips = cache_sources["audit-text"]
+            print(
+                f"Text filter audit: {audited} ruled-out image(s) OCR'd anyway "
+                f"({OCR_TEXT_FILTER_AUDIT:.0%} sample), {false_skips} had text "
+                f"(false-skip rate ~{false_skips / audited:.1%})"
+            )
+        else:
+            print("Text filter audit: no ruled-out image was sampled")
+    timing_lines = _timing_summary(step_seconds)
+    if timing_lines:
+        print(f"Per-image timing (backend: {get_ocr_backend().name}, "
+              f"preprocessing: {','.join(DEFAULT_PREPROCESS) or 'none'}):")
+        for line in timing_lines:
+            print(line)
 
-    output_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"Saved {len(data)} tweets with OCR to {output_path}")
+    print(f"Saved {n_saved} tweets with OCR to {output_path}")
+    if journal.restored:
+        print(f"Restored {journal.restored} tweets OCR'd by an interrupted run.")
 
-    return len(data)
+    return n_saved
 
 
-def main():
-    add_ocr_to_dataset()
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Attach OCR text to the image tweet dataset.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=OCR_WORKERS,
+        help="number of OCR processes (default: $OCR_WORKERS or 1)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run Tesseract, ignoring the OCR cache",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="discard the progress journal of an interrupted run and start over",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        default=OCR_VERBOSE,
+        help="print the step timings of every image (default: $OCR_VERBOSE)",
+    )
+    args = parser.parse_args(argv or [])
+    add_ocr_to_dataset(
+        workers=args.workers,
+        use_cache=not args.no_cache,
+        resume=not args.no_resume,
+        verbose=args.verbose,
+    )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1:])
@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, Dict, Any, Optional
+
+from openai import OpenAI
+
+from .config import OPENAI_API_KEY
+from .labeler import DEFAULT_MODEL, build_chat_request, parse_label_response
+from .text_preprocessing import row_texts
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_INPUT_PATH = Path("label_batch_requests.jsonl")
+BATCH_STATE_PATH = Path("label_batch_state.json")
+BATCH_POLL_SECONDS = float(os.getenv("LABEL_BATCH_POLL_SECONDS", "60"))
+# "openai" (optionally at LABEL_BATCH_BASE_URL, any OpenAI-compatible server)
+# or "mock" for the offline MockBatchTransport.
+LABEL_BATCH_TRANSPORT = os.getenv("LABEL_BATCH_TRANSPORT", "openai").lower()
+LABEL_BATCH_BASE_URL = os.getenv("LABEL_BATCH_BASE_URL") or None
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchTransport(ABC):
+    """
+    Minimal interface to a batch API. OpenAIBatchTransport talks to OpenAI
+    (or any compatible server); MockBatchTransport answers locally.
+
+    `cacheable` says whether its labels may be stored in the LabelCache;
+    `name` identifies where its batches live (a saved batch is only resumed
+    through a transport of the same name).
+    """
+
+    cacheable = True
+    name = "openai"
+
+    @abstractmethod
+    def upload(self, path: Path) -> str:
+        """Upload a JSONL request file and return its file id."""
+
+    @abstractmethod
+    def create(self, input_file_id: str) -> str:
+        """Create a batch for an uploaded file and return the batch id."""
+
+    @abstractmethod
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        """Return at least {'status', 'output_file_id', 'error_file_id'}."""
+
+    @abstractmethod
+    def download(self, file_id: str) -> str:
+        """Return the text content of a result file."""
+
+
+class OpenAIBatchTransport(BatchTransport):
+    """
+    Batch transport over the OpenAI SDK. Pass base_url to point it at any
+    OpenAI-compatible server, such as a local fake batch server.
+    """
+
+    def __init__(
+        self,
+        client: Optional[OpenAI] = None,
+        base_url: Optional[str] = None,
+    ) -> None:
+        self.client = client or OpenAI(api_key=OPENAI_API_KEY, base_url=base_url)
+        if base_url:
+            self.name = f"openai@{base_url}"
+
+    def upload(self, path: Path) -> str:
+        with Path(path).open("rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, input_file_id: str) -> str:
+        batch = self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "request_counts": getattr(batch, "request_counts", None),
+        }
+
+    def download(self, file_id: str) -> str:
+        return self.client.files.content(file_id).text
+
+
+class MockBatchTransport(BatchTransport):
+    """
+    In-process, deterministic stand-in for the batch API, for running the
+    batch backend without network or API key. A batch completes as soon as
+    it is created; each request gets one of LABELS chosen from a hash of
+    its custom_id, and every `fail_every`-th request (0 = never) fails.
+    Its labels are not real, so they are never written to the LabelCache.
+    """
+
+    LABELS = ("true", "false", "misleading")
+    cacheable = False
+    name = "mock"
+
+    def __init__(self, fail_every: int = 0) -> None:
+        self.fail_every = fail_every
+        self._files: Dict[str, str] = {}
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-mock-{next(self._ids)}"
+
+    def _answer(self, n: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        custom_id = request["custom_id"]
+        if self.fail_every and n % self.fail_every == 0:
+            return {"custom_id": custom_id, "response": None,
+                    "error": {"code": "mock_error", "message": "mock failure"}}
+        digest = hashlib.sha256(custom_id.encode("utf-8")).digest()
+        content = json.dumps({
+            "label": self.LABELS[digest[0] % len(self.LABELS)],
+            "justification": "Mock batch label.",
+            "sources": [],
+        })
+        return {"custom_id": custom_id, "error": None, "response": {
+            "status_code": 200,
+            "body": {"choices": [{"message": {"role": "assistant", "content": content}}]},
+        }}
+
+    def upload(self, path: Path) -> str:
+        file_id = self._new_id("file")
+        self._files[file_id] = Path(path).read_text(encoding="utf-8")
+        return file_id
+
+    def create(self, input_file_id: str) -> str:
+        requests = [json.loads(line) for line in self._files[input_file_id].splitlines() if line.strip()]
+        answers = [self._answer(n, req) for n, req in enumerate(requests, start=1)]
+        ok = [a for a in answers if a["error"] is None]
+        failed = [a for a in answers if a["error"] is not None]
+
+        info: Dict[str, Any] = {"status": "completed", "output_file_id": None, "error_file_id": None,
+                                "request_counts": {"total": len(answers), "completed": len(ok),
+                                                   "failed": len(failed)}}
+        for key, items in (("output_file_id", ok), ("error_file_id", failed)):
+            if items:
+                file_id = self._new_id("file")
+                self._files[file_id] = "".join(json.dumps(a) + "\n" for a in items)
+                info[key] = file_id
+
+        batch_id = self._new_id("batch")
+        self._batches[batch_id] = info
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        # Batches do not outlive the process; one recorded by an earlier run is gone.
+        default = {"status": "expired", "output_file_id": None, "error_file_id": None}
+        return dict(self._batches.get(batch_id, default))
+
+    def download(self, file_id: str) -> str:
+        return self._files[file_id]
+
+
+def make_batch_transport(
+    kind: str = LABEL_BATCH_TRANSPORT,
+    base_url: Optional[str] = LABEL_BATCH_BASE_URL,
+) -> BatchTransport:
+    """Batch transport by name: "openai" (at base_url if given) or "mock"."""
+    if kind == "openai":
+        return OpenAIBatchTransport(base_url=base_url)
+    if kind == "mock":
+        return MockBatchTransport()
+    raise ValueError(f"Unknown batch transport: {kind!r} (expected 'openai' or 'mock')")
+
+
+def build_batch_file(
+    rows: Iterable[Dict[str, Any]],
+    batch_path: Path = BATCH_INPUT_PATH,
+    model: str = DEFAULT_MODEL,
+) -> int:
+    """
+    Write one chat-completion request per distinct tweet_id to batch_path
+    (JSONL, OpenAI batch format). custom_id is the tweet_id.
+
+    Returns the number of requests written.
+    """
+    seen = set()
+    written = 0
+
+    with Path(batch_path).open("w", encoding="utf-8") as f:
+        for row in rows:
+            tweet_id = row.get("tweet_id")
+            if tweet_id is None:
+                print("  - Skipping row without tweet_id; it cannot be merged back.")
+                continue
+            custom_id = str(tweet_id)
+            if custom_id in seen:
+                continue
+            seen.add(custom_id)
+
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": build_chat_request(*row_texts(row), model=model),
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            written += 1
+
+    print(f"Wrote {written} batch requests to {batch_path}")
+    return written
+
+
+def submit_batch(batch_path: Path, transport: BatchTransport) -> str:
+    """Upload batch_path and start a batch job. Returns the batch id."""
+    file_id = transport.upload(batch_path)
+    batch_id = transport.create(file_id)
+    print(f"Submitted batch {batch_id} (input file {file_id})")
+    return batch_id
+
+
+def wait_for_batch(
+    batch_id: str,
+    transport: BatchTransport,
+    poll_seconds: float = BATCH_POLL_SECONDS,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Poll until the batch reaches a terminal status and return its info."""
+    started = time.monotonic()
+    while True:
+        info = transport.retrieve(batch_id)
+        status = info.get("status")
+        print(f"Batch {batch_id}: status={status} counts={info.get('request_counts')}")
+        if status in TERMINAL_STATUSES:
+            return info
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} not finished after {timeout}s (status={status})")
+        time.sleep(poll_seconds)
+
+
+def parse_batch_output(content: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse a batch output/error file into {custom_id: label_info}, applying
+    the same defaults as label_tweet. Failed requests become 'unverified'.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item.get("custom_id")
+        if custom_id is None:
+            continue
+
+        response = item.get("response") or {}
+        error = item.get("error")
+        if error or response.get("status_code") != 200:
+            detail = error or (response.get("body") or {}).get("error") or response.get("status_code")
+            results[custom_id] = {
+                "label": "unverified",
+                "justification": f"Labeling error: batch request failed ({detail})",
+                "sources": [],
+            }
+            continue
+
+        try:
+            message_content = response["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            message_content = None
+        results[custom_id] = parse_label_response(message_content)
+
+    return results
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _saved_batch_id(state_path: Path, input_sha256: str, transport: BatchTransport) -> Optional[str]:
+    """The batch recorded in state_path, if it was built from the same input on the same transport."""
+    if not state_path.exists():
+        return None
+    try:
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        state = {}
+    batch_id = state.get("batch_id")
+    if not batch_id:
+        return None
+    if state.get("input_sha256") != input_sha256 or state.get("transport") != transport.name:
+        print(f"Ignoring batch {batch_id} in {state_path}: it was built from other input "
+              f"or on another transport")
+        return None
+    print(f"Resuming batch {batch_id} from {state_path}")
+    return batch_id
+
+
+def run_batch(
+    rows: Iterable[Dict[str, Any]],
+    transport: Optional[BatchTransport] = None,
+    batch_path: Path = BATCH_INPUT_PATH,
+    state_path: Path = BATCH_STATE_PATH,
+    model: str = DEFAULT_MODEL,
+    poll_seconds: float = BATCH_POLL_SECONDS,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Build, submit and poll a batch for `rows`, returning {tweet_id: label_info}.
+
+    The batch id is recorded in state_path together with the SHA-256 of the
+    request file and the transport name, so a run that is interrupted while
+    polling resumes the same batch instead of paying for a second one. A
+    saved batch built from other input, on another transport, or that ended
+    without completing (expired, failed, cancelled) is replaced by a new one.
+    Raises RuntimeError if the new batch ends without completing and
+    without any results.
+    """
+    transport = transport or make_batch_transport()
+
+    if build_batch_file(rows, batch_path, model=model) == 0:
+        state_path.unlink(missing_ok=True)
+        return {}
+    input_sha256 = _file_sha256(batch_path)
+
+    info = None
+    batch_id = _saved_batch_id(state_path, input_sha256, transport)
+    if batch_id:
+        info = wait_for_batch(batch_id, transport, poll_seconds=poll_seconds)
+        if info.get("status") != "completed":
+            print(f"Saved batch {batch_id} ended with status={info.get('status')}; resubmitting")
+            info = None
+
+    if info is None:
+        batch_id = submit_batch(batch_path, transport)
+        state_path.write_text(
+            json.dumps({"batch_id": batch_id, "input_sha256": input_sha256, "transport": transport.name}),
+            encoding="utf-8",
+        )
+        info = wait_for_batch(batch_id, transport, poll_seconds=poll_seconds)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for key in ("error_file_id", "output_file_id"):
+        file_id = info.get(key)
+        if file_id:
+            results.update(parse_batch_output(transport.download(file_id)))
+
+    state_path.unlink(missing_ok=True)
+    if info.get("status") != "completed":
+        if not results:
+            raise RuntimeError(f"Batch {batch_id} ended with status={info.get('status')} and no results")
+        print(f"Batch {batch_id} ended with status={info.get('status')}; "
+              f"{len(results)} results available.")
+    return results
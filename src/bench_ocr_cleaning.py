@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+from itertools import product
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from src.ocr_cleaning import clean_many, clean_ocr_text
+from src.records import read_records
+
+
+# ---------------------------------------------------------------------------
+# Reference: clean_ocr_text as it was before the precompiled rewrite, kept
+# verbatim so the new implementation can be checked byte for byte.
+# ---------------------------------------------------------------------------
+
+_REF_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u06D6-\u06ED]")
+_REF_CONTROL = re.compile(r"[\u200c-\u200f\u202a-\u202e\u2066-\u2069]")
+
+
+def _reference_normalize_letters(text: str) -> str:
+    text = re.sub(r"[أإآٱ]", "ا", text)
+    text = re.sub(r"[ى]", "ي", text)
+    text = text.replace("ة", "ه")
+    return text
+
+
+def reference_clean_ocr_text(text: str, keep_english: bool = False, keep_digits: bool = True) -> str:
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    text = _REF_CONTROL.sub("", text)
+    text = _REF_DIACRITICS.sub("", text)
+    text = text.replace("ـ", "")
+    text = _reference_normalize_letters(text)
+    if keep_english:
+        allowed_pattern = r"[^0-9A-Za-z\u0600-\u06FF\s\.\,\:\;\-\(\)\[\]\!\؟\!\"\'،]"
+    else:
+        allowed_pattern = r"[^0-9\u0600-\u06FF\s\.\,\:\;\-\(\)\[\]\!\؟\!\"\'،]"
+    text = re.sub(allowed_pattern, " ", text)
+    if not keep_digits:
+        text = re.sub(r"[0-9]", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+# ---------------------------------------------------------------------------
+# Fixture corpus
+# ---------------------------------------------------------------------------
+
+# Weighted pools of the characters OCR output is made of, including every
+# class the cleaner treats specially.
+_POOLS = [
+    (40, [chr(c) for c in range(0x0621, 0x064B)]),            # Arabic letters
+    (6, list("أإآٱىةـ")),                                      # normalized forms
+    (6, [chr(c) for c in range(0x064B, 0x0660)]
+        + [chr(c) for c in range(0x0610, 0x061B)]
+        + [chr(c) for c in range(0x06D6, 0x06EE)]),            # diacritics, Quranic marks
+    (15, list(" " * 6 + "\n\t\r\u00a0\u2003\u3000\x0b\x0c")),      # whitespace
+    (6, list("0123456789٠١٢٣٤٥٦٧٨٩۰۱۲۳")),                   # ASCII / Arabic-Indic digits
+    (8, list("abcXYZqwertyABC")),                              # Latin
+    (6, list(".,:;-()[]!؟\"'،%/#@*&_+=<>|~«»…")),             # punctuation
+    (3, list("\u200c\u200d\u200e\u200f\u202a\u202b\u202c\u202d\u202e"
+             "\u2066\u2067\u2068\u2069\ufeff")),                    # direction / zero-width marks
+    (3, [chr(c) for c in range(0xFE70, 0xFEFD)]
+        + [chr(c) for c in range(0xFB50, 0xFBB2)]),            # presentation forms (NFKC)
+    (2, list("①²ﬁ™½ＡＢ１２")),                                 # other NFKC compatibility chars
+    (2, list("😀🙂👍🏽❤️✅⚕️💊")),                                   # emoji
+    (3, None),                                                 # any code point
+]
+
+
+def _random_char(rng: random.Random) -> str:
+    weights = [w for w, _ in _POOLS]
+    pool = rng.choices(_POOLS, weights=weights)[0][1]
+    if pool is None:
+        return chr(rng.randrange(0x110000))
+    return rng.choice(pool)
+
+
+def fixture_corpus(n: int = 5000, seed: int = 13) -> List[str]:
+    """Deterministic synthetic OCR-like texts (plus a few edge cases)."""
+    rng = random.Random(seed)
+    texts = ["", " ", "\n\n", "ـــ", "\u200f", "أإآٱ ى ة", "١٢٣ abc 123", "؟!،"]
+    for _ in range(n):
+        length = int(rng.expovariate(1 / 120)) + 1
+        texts.append("".join(_random_char(rng) for _ in range(length)))
+    return texts
+
+
+_WORDS = (
+    "الصحة فيروس لقاح كورونا مرض علاج الأطباء المستشفى الإصابة الوقاية الجرعة "
+    "الأعراض فيتامين مناعة السكري الضغط دواء تحذير عاجل وزارة إلى على التي هذه"
+).split()
+_NOISE = ["،", "؟", ".", ":", "-", "(", ")", "2024", "١٢", "ـ", "ً", "ّ", "|", "*",
+          "©", "•", "\u200f", "a", "COVID", "%", "\n"]
+
+
+def ocr_like_corpus(n: int = 20000, seed: int = 7) -> List[str]:
+    """Mostly-clean Arabic texts with sparse OCR noise, closer to real output."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(_WORDS) if rng.random() < 0.85 else rng.choice(_NOISE)
+                 for _ in range(rng.randint(5, 60)))
+        for _ in range(n)
+    ]
+
+
+def dataset_texts(path: Path) -> List[str]:
+    """Tweet and OCR texts of a pipeline dataset, for checking real data."""
+    texts: List[str] = []
+    for row in read_records(path):
+        if row.get("text"):
+            texts.append(row["text"])
+        texts.extend(t for t in row.get("ocr_texts") or [] if t)
+    return texts
+
+
+# ---------------------------------------------------------------------------
+# Checks and timings
+# ---------------------------------------------------------------------------
+
+FLAG_COMBOS = list(product((False, True), repeat=2))
+
+
+def differential_check(texts: List[str], every_codepoint: bool = True) -> int:
+    """
+    Assert clean_ocr_text == reference for each text and flag combination
+    (and for every single code point). Returns the number of comparisons.
+    """
+    singles = [chr(c) for c in range(0x110000)] if every_codepoint else []
+    checked = 0
+    for keep_english, keep_digits in FLAG_COMBOS:
+        for text in texts + singles:
+            got = clean_ocr_text(text, keep_english, keep_digits)
+            want = reference_clean_ocr_text(text, keep_english, keep_digits)
+            if got.encode("utf-8", "surrogatepass") != want.encode("utf-8", "surrogatepass"):
+                raise AssertionError(
+                    f"Mismatch (keep_english={keep_english}, keep_digits={keep_digits}) "
+                    f"for {text!r}: {got!r} != {want!r}"
+                )
+            checked += 1
+    return checked
+
+
+def _timeit(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Check clean_ocr_text against the original implementation and time both."
+    )
+    parser.add_argument("--dataset", type=Path, help="also use texts from this .jsonl/.json dataset")
+    parser.add_argument("--n", type=int, default=5000, help="synthetic texts in the fixture corpus")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions (best is reported)")
+    parser.add_argument("--workers", type=int, default=4, help="processes for the clean_many timing")
+    parser.add_argument("--quick", action="store_true", help="skip the every-code-point check")
+    args = parser.parse_args(argv or [])
+
+    texts = fixture_corpus(args.n) + ocr_like_corpus(args.n)
+    if args.dataset:
+        texts += dataset_texts(args.dataset)
+    print(f"Corpus: {len(texts)} texts, {sum(len(t) for t in texts)} characters")
+
+    started = time.perf_counter()
+    checked = differential_check(texts, every_codepoint=not args.quick)
+    print(f"Differential check: {checked} outputs byte-identical "
+          f"({time.perf_counter() - started:.1f}s)")
+
+    corpora = [("noisy fixture", fixture_corpus(args.n)), ("OCR-like", ocr_like_corpus(args.n))]
+    if args.dataset:
+        corpora.append((str(args.dataset), dataset_texts(args.dataset)))
+    for name, corpus in corpora:
+        chars = sum(len(t) for t in corpus)
+        ref = _timeit(lambda: [reference_clean_ocr_text(t) for t in corpus], args.repeat)
+        new = _timeit(lambda: [clean_ocr_text(t) for t in corpus], args.repeat)
+        print(f"{name}: {len(corpus)} texts, {chars} chars")
+        print(f"  reference clean_ocr_text: {ref * 1e3:8.1f} ms  ({chars / ref / 1e6:5.1f} M chars/s)")
+        print(f"  clean_ocr_text          : {new * 1e3:8.1f} ms  ({chars / new / 1e6:5.1f} M chars/s)"
+              f"  x{ref / new:.1f}")
+
+    big = ocr_like_corpus(200_000)
+    one = _timeit(lambda: clean_many(big, workers=1), 1)
+    many = _timeit(lambda: clean_many(big, workers=args.workers), 1)
+    print(f"clean_many, {len(big)} texts: 1 process {one:.2f}s, "
+          f"{args.workers} processes {many:.2f}s  x{one / many:.1f} ({os.cpu_count()} CPUs)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
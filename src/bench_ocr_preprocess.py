@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import sys
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from src.ocr_cleaning import clean_ocr_text
+from src.ocr_step import OCR_LANG, fetch_image_bytes, get_ocr_backend, ocr_image_timed, parse_preprocess_steps
+from src.records import read_records
+
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+
+# Compared against OCR of the untouched image when no --steps are given.
+DEFAULT_CONFIGS = ["gray,rescale", "gray,rescale,threshold", "gray,rescale,threshold,deskew,crop"]
+
+
+def local_images(paths: Sequence[Path]) -> List[Tuple[str, Image.Image, Optional[str]]]:
+    """
+    (name, image, ground truth) for image files and the images inside
+    directories. A sidecar <image>.txt, if present, is the ground truth.
+    """
+    files: List[Path] = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES))
+        else:
+            files.append(path)
+
+    images = []
+    for f in files:
+        truth_path = f.with_suffix(".txt")
+        truth = truth_path.read_text(encoding="utf-8") if truth_path.exists() else None
+        images.append((str(f), Image.open(f).convert("RGB"), truth))
+    return images
+
+
+def dataset_images(path: Path, limit: int) -> List[Tuple[str, Image.Image, Optional[str]]]:
+    """The first `limit` images of a pipeline dataset, through the shared image store."""
+    images: List[Tuple[str, Image.Image, Optional[str]]] = []
+    for row in read_records(path):
+        for url in row.get("image_urls") or []:
+            if len(images) >= limit:
+                return images
+            try:
+                data = fetch_image_bytes(url)
+            except Exception as e:
+                print(f"  - skipping {url}: {e}")
+                continue
+            images.append((url, Image.open(io.BytesIO(data)).convert("RGB"), None))
+    return images
+
+
+def agreement(a: str, b: str) -> float:
+    """Character agreement of two texts in [0, 1] (difflib ratio)."""
+    if not a and not b:
+        return 1.0
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def run_benchmark(
+    images: List[Tuple[str, Image.Image, Optional[str]]],
+    configs: List[Tuple[str, ...]],
+    lang: str,
+) -> List[Dict[str, Any]]:
+    """
+    OCR every image once per config (the first config should be the
+    baseline); returns one result dict per (image, config).
+    """
+    results: List[Dict[str, Any]] = []
+    for name, img, truth in images:
+        baseline_text: Optional[str] = None
+        for steps in configs:
+            text, spent = ocr_image_timed(img, lang=lang, steps=steps)
+            text = clean_ocr_text(text, keep_english=False, keep_digits=True)
+            if baseline_text is None:
+                baseline_text = text
+            results.append({
+                "image": name,
+                "config": ",".join(steps) or "none",
+                "preprocess_ms": spent["preprocess"] * 1e3,
+                "ocr_ms": spent["ocr"] * 1e3,
+                "chars": len(text),
+                "agreement_vs_none": agreement(text, baseline_text),
+                "agreement_vs_truth": (
+                    agreement(text, clean_ocr_text(truth, keep_english=False, keep_digits=True))
+                    if truth is not None else None
+                ),
+            })
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], configs: List[Tuple[str, ...]]) -> None:
+    baseline = [r for r in results if r["config"] == "none"]
+    base_wall = sum(r["preprocess_ms"] + r["ocr_ms"] for r in baseline)
+
+    print(f"\n{'config':<38} {'wall/img':>9} {'p95':>8} {'prep':>7} {'chars':>7} "
+          f"{'non-empty':>9} {'vs none':>8} {'vs truth':>8}")
+    for steps in configs:
+        label = ",".join(steps) or "none"
+        rows = [r for r in results if r["config"] == label]
+        if not rows:
+            continue
+        wall = [r["preprocess_ms"] + r["ocr_ms"] for r in rows]
+        truths = [r["agreement_vs_truth"] for r in rows if r["agreement_vs_truth"] is not None]
+        speed = f" x{base_wall / sum(wall):.2f}" if baseline and sum(wall) else ""
+        print(
+            f"{label:<38} {sum(wall) / len(wall):7.0f}ms {_percentile(wall, 0.95):6.0f}ms "
+            f"{sum(r['preprocess_ms'] for r in rows) / len(rows):5.0f}ms "
+            f"{sum(r['chars'] for r in rows) / len(rows):7.1f} "
+            f"{sum(1 for r in rows if r['chars']):5d}/{len(rows):<3d} "
+            f"{sum(r['agreement_vs_none'] for r in rows) / len(rows):8.3f} "
+            f"{(f'{sum(truths) / len(truths):8.3f}' if truths else '       -')}{speed}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare OCR time and output with and without image preprocessing."
+    )
+    parser.add_argument("images", nargs="*", type=Path,
+                        help="image files or directories (a sidecar .txt is used as ground truth)")
+    parser.add_argument("--dataset", type=Path, help="take images from this .jsonl/.json dataset")
+    parser.add_argument("--limit", type=int, default=50, help="images taken from --dataset")
+    parser.add_argument("--steps", action="append",
+                        help="preprocessing config to compare, e.g. gray,rescale,threshold "
+                             "(repeatable; default: a few standard configs)")
+    parser.add_argument("--lang", default=OCR_LANG, help="Tesseract language (default: $OCR_LANG)")
+    parser.add_argument("--csv", type=Path, help="also write per-image results to this CSV file")
+    args = parser.parse_args(argv or [])
+
+    images = local_images(args.images)
+    if args.dataset:
+        images += dataset_images(args.dataset, args.limit)
+    if not images:
+        parser.error("no images given (pass image paths or --dataset)")
+
+    configs = [()] + [parse_preprocess_steps(spec) for spec in (args.steps or DEFAULT_CONFIGS)]
+    configs = list(dict.fromkeys(configs))
+    print(f"Benchmarking {len(images)} image(s) x {len(configs)} config(s), "
+          f"lang={args.lang}, backend={get_ocr_backend().name}")
+
+    results = run_benchmark(images, configs, args.lang)
+    summarize(results, configs)
+
+    if args.csv:
+        with args.csv.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"\nPer-image results written to {args.csv}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,76 +1,116 @@
 from __future__ import annotations
 
-import json
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Callable, Dict, Any, Iterable, Iterator, Optional
 
 from .filter_media import extract_image_urls
+from .raw_store import RAW_REF_FIELD, RAW_STORE_PATH, RawTweetStore
+from .records import read_records, tap_records, write_records
+from .seen_index import SeenIdIndex
+
+
+def _to_row(tw: Dict[str, Any], store: Optional[RawTweetStore] = None) -> Optional[Dict[str, Any]]:
+    """
+    Selected fields of one raw tweet, or None if it carries no image. With
+    a store the raw tweet is saved there and the row only references it.
+    """
+    image_urls = extract_image_urls(tw)
+
+    if not image_urls:
+        return None
+
+    user = tw.get("user") or {}
+    if not isinstance(user, dict):
+        user = {}
+
+    row = {
+        "tweet_id": tw.get("id"),
+        "author_id": user.get("id"),
+        "author_screen_name": user.get("screen_name"),
+        "text": tw.get("full_text") or tw.get("text"),
+        "created_at": tw.get("created_at"),
+        "lang": tw.get("lang"),
+        "image_urls": image_urls,
+    }
+    if store is not None and row["tweet_id"] is not None:
+        store.put(row["tweet_id"], tw)
+        row[RAW_REF_FIELD] = str(store.path)
+    else:
+        row["raw"] = tw
+    return row
 
 
 def build_image_tweet_dataset(
-    input_path: str = "raw_health_tweets.json",
-    output_path: str = "health_tweets_with_images.json",
+    input_path: str = "raw_health_tweets.jsonl",
+    output_path: str = "health_tweets_with_images.jsonl",
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    raw_store_path: Optional[Path] = RAW_STORE_PATH,
 ) -> int:
     """
-    Read a raw tweets JSON file (list of tweet objects), keep only those
+    Read raw tweets (JSON Lines, or a legacy JSON list), keep only those
     that have at least one image URL, and save a cleaned dataset to output_path.
 
-    - input_path: JSON produced by the collector (e.g. raw_health_tweets.json)
-    - output_path: JSON with only tweets that contain images, with selected fields
+    - input_path: file produced by the collector (e.g. raw_health_tweets.jsonl)
+    - output_path: tweets that contain images, with selected fields
+                   (.jsonl, or .json for the legacy array format)
+    - records: optional stream of raw tweets to use instead of reading
+               input_path (e.g. handed over by a running collector)
+    - on_record: optional callback receiving each saved row once written
+    - raw_store_path: RawTweetStore receiving the full raw tweets; rows only
+                      reference it (load with raw_store.raw_payload). None
+                      embeds the raw tweet in every row under "raw".
+
+    Tweets are streamed one at a time and repeated tweet IDs are dropped
+    through a compact SeenIdIndex (~9 bytes per ID), so memory stays small
+    even for a large corpus.
 
     Returns the number of tweets saved.
     """
     in_path = Path(input_path)
-    if not in_path.exists():
-        raise FileNotFoundError(f"Input file not found: {in_path}")
-
-    print(f"Loading raw tweets from {in_path}...")
-    raw_text = in_path.read_text(encoding="utf-8")
-    try:
-        tweets: List[Dict[str, Any]] = json.loads(raw_text)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Failed to parse JSON from {in_path}: {e}") from e
-
-    print(f"Loaded {len(tweets)} raw tweets.")
-
-    rows: List[Dict[str, Any]] = []
-
-    for tw in tweets:
-        image_urls = extract_image_urls(tw)
-
-
-        if not image_urls:
-            continue
-
-        user = tw.get("user") or {}
-        if not isinstance(user, dict):
-            user = {}
-
-        row = {
-            "tweet_id": tw.get("id"),
-            "author_id": user.get("id"),
-            "author_screen_name": user.get("screen_name"),
-            "text": tw.get("full_text") or tw.get("text"),
-            "created_at": tw.get("created_at"),
-            "lang": tw.get("lang"),
-            "image_urls": image_urls,
-            "raw": tw,
-        }
-        rows.append(row)
+    if records is None:
+        if not in_path.exists():
+            raise FileNotFoundError(f"Input file not found: {in_path}")
+        print(f"Streaming raw tweets from {in_path}...")
+        records = read_records(in_path)
+    else:
+        print("Streaming raw tweets from upstream stage...")
+    n_raw = n_dup = 0
+    seen = SeenIdIndex()
+    store = RawTweetStore(raw_store_path) if raw_store_path is not None else None
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        nonlocal n_raw, n_dup
+        for tw in records:
+            n_raw += 1
+            if not extract_image_urls(tw):
+                continue
+            tid = str(tw.get("id") or "")
+            if tid.isdigit() and not seen.add(int(tid)):
+                n_dup += 1
+                continue
+            row = _to_row(tw, store)
+            if row is not None:
+                yield row
 
     out_path = Path(output_path)
-    out_path.write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"Saved {len(rows)} tweets with images to {out_path}")
+    try:
+        n_saved = write_records(out_path, tap_records(rows(), on_record))
+    finally:
+        if store is not None:
+            store.close()
+    print(f"Read {n_raw} raw tweets ({n_dup} duplicate IDs dropped).")
+    print(f"Saved {n_saved} tweets with images to {out_path}")
 
-    return len(rows)
+    return n_saved
 
 
 def main():
     build_image_tweet_dataset(
-        input_path="raw_health_tweets.json",
-        output_path="health_tweets_with_images.json",
+        input_path="raw_health_tweets.jsonl",
+        output_path="health_tweets_with_images.jsonl",
     )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Any, Iterable, Optional, Set, Tuple
+
+from .records import repair_jsonl_tail
+
+
+# A crash loses at most this much finished work: the journal is flushed to
+# the OS after every record and fsync'ed every N records or T seconds.
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "100"))
+CHECKPOINT_SECONDS = float(os.getenv("CHECKPOINT_SECONDS", "30"))
+
+JOURNAL_SUFFIX = ".journal"
+
+
+def journal_path_for(output_path: Path) -> Path:
+    """Journal file that sits next to a stage's output (e.g. out.jsonl.journal)."""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + JOURNAL_SUFFIX)
+
+
+class StageJournal:
+    """
+    Append-only progress journal for one pipeline stage.
+
+    Each finished record is appended as one JSON line holding its tweet_id
+    and the fields the stage produced. When a stage is restarted after a
+    crash, `restore(row)` merges those fields back onto the input row by
+    tweet_id, so the stage only redoes work that was never journaled.
+
+    Once the stage has written its output, `finish()` removes the journal.
+    Rows without a tweet_id cannot be matched and are never journaled.
+
+    Only keys are kept in memory (plus, for entries of an earlier run, their
+    offset in the journal file); restore() reads an entry back when needed.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fields: Iterable[str],
+        resume: bool = True,
+        fsync_every: int = CHECKPOINT_EVERY,
+        fsync_seconds: float = CHECKPOINT_SECONDS,
+    ) -> None:
+        self.path = Path(path)
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_seconds = fsync_seconds
+
+        self._lock = threading.Lock()
+        self._done: Set[str] = set()
+        self._offsets: Dict[str, int] = {}
+        self._reader: Optional[BinaryIO] = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._restored: Set[str] = set()
+        self.recorded = 0
+
+        if resume:
+            # Drop a line torn by a crash, so the next record starts on a line of its own.
+            repair_jsonl_tail(self.path)
+            self._load()
+        else:
+            self.path.unlink(missing_ok=True)
+
+        if self._done:
+            print(f"Resuming from {self.path}: {len(self._done)} record(s) already done.")
+
+        self._file = self.path.open("a", encoding="utf-8")
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as f:
+            offset = 0
+            for line in f:
+                start, offset = offset, offset + len(line)
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A mangled line; that record is simply redone.
+                    continue
+                key = entry.get("tweet_id")
+                if key is not None:
+                    # A later line for the same tweet wins, as it was written last.
+                    self._offsets[str(key)] = start
+        self._done.update(self._offsets)
+
+    def _read_entry(self, offset: int) -> Dict[str, Any]:
+        if self._reader is None:
+            self._reader = self.path.open("rb")
+        self._reader.seek(offset)
+        entry = json.loads(self._reader.readline())
+        entry.pop("tweet_id", None)
+        return entry
+
+    @staticmethod
+    def _key(row: Dict[str, Any]) -> Optional[str]:
+        tweet_id = row.get("tweet_id")
+        return None if tweet_id is None else str(tweet_id)
+
+    @property
+    def restored(self) -> int:
+        """Distinct rows restored from the journal so far."""
+        return len(self._restored)
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def __contains__(self, row: Dict[str, Any]) -> bool:
+        key = self._key(row)
+        return key is not None and key in self._done
+
+    def restore(self, row: Dict[str, Any]) -> bool:
+        """
+        If row was finished by an earlier run, merge the journaled fields
+        into it and return True; otherwise leave it alone and return False.
+        """
+        key = self._key(row)
+        if key is None:
+            return False
+        with self._lock:
+            offset = self._offsets.get(key)
+            if offset is None:
+                return False
+            entry = self._read_entry(offset)
+            self._restored.add(key)
+        row.update(entry)
+        return True
+
+    def record(self, row: Dict[str, Any]) -> None:
+        """Append a finished row's output fields to the journal."""
+        key = self._key(row)
+        if key is None:
+            return
+        entry = {"tweet_id": row.get("tweet_id")}
+        entry.update({name: row.get(name) for name in self.fields if name in row})
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._done.add(key)
+            self.recorded += 1
+            self._unsynced += 1
+            now = time.monotonic()
+            if self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_seconds:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+                self._last_sync = now
+
+    def close(self) -> None:
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def finish(self) -> None:
+        """The stage output is safely written: the journal is no longer needed."""
+        self.close()
+        self.path.unlink(missing_ok=True)
@@ -1,15 +1,34 @@
 from __future__ import annotations
 
+import argparse
+import datetime as dt
 import os
+import sys
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Dict, Any, Optional, Tuple
 import requests
 import json
 
 from .config import TWITTERAPI_KEY, BRIGHT_DATA_AUTH
+from .concurrency import (
+    TokenBucketLimiter,
+    backoff_delay,
+    is_rate_limit_error,
+    retry_after_seconds,
+)
 from .cookies_utils import get_twitter_cookies
+from .collector_state import CollectorState
+from .records import is_jsonl, read_records, repair_jsonl_tail
+from .seen_index import SeenIdIndex
 
-BASE_URL = "https://api.twitterapi.io/twitter/tweet/advanced_search"
+# Point this at a local mock server (see src/mock_twitterapi.py) for tests.
+BASE_URL = os.getenv(
+    "TWITTERAPI_BASE_URL", "https://api.twitterapi.io/twitter/tweet/advanced_search"
+)
+RAW_TWEETS_PATH = Path("raw_health_tweets.jsonl")
 USE_BRIGHT_DATA_FOR_TWITTERAPI = os.getenv("USE_BRIGHT_DATA_FOR_TWITTERAPI", "false").lower() == "true"
 
 PROXIES = {
@@ -17,146 +36,586 @@ PROXIES = {
     "https": f"http://{BRIGHT_DATA_AUTH}@brd.superproxy.io:22225",
 }
 
+# Sharded collection settings (override via .env / environment).
+COLLECT_WORKERS = int(os.getenv("COLLECT_WORKERS", "4"))
+COLLECT_TERM_GROUPS = int(os.getenv("COLLECT_TERM_GROUPS", "1"))
+COLLECT_WINDOW_DAYS = int(os.getenv("COLLECT_WINDOW_DAYS", "0"))
+COLLECT_SINCE = os.getenv("COLLECT_SINCE") or None
+COLLECT_UNTIL = os.getenv("COLLECT_UNTIL") or None
+TWITTERAPI_RPM = float(os.getenv("TWITTERAPI_RPM", "60"))
+# Incremental mode: only fetch tweets newer than the last completed crawl
+# of each query ("Latest" instead of "Top" results) and append them to the
+# raw store (see CollectorState). Off by default: each run re-crawls.
+COLLECT_INCREMENTAL = os.getenv("COLLECT_INCREMENTAL", "false").lower() == "true"
+MAX_RATE_LIMIT_RETRIES = 8
+
 
-AR_HEALTH_QUERY = (
-    '('
-    '(صحة OR "الصحة" OR "صحة الأطفال" OR "وزارة الصحة" OR سكري OR "ضغط الدم" OR سمنة '
-    'OR لقاح OR تطعيم OR "طب بديل" OR "وصفات طبيعية" OR خلطات OR "خل التفاح" '
-    'OR "الحبة السوداء" OR الكركم OR "المكملات الغذائية" OR "الطب النبوي") '
+HEALTH_TOPIC_TERMS = [
+    'صحة', '"الصحة"', '"صحة الأطفال"', '"وزارة الصحة"', 'سكري', '"ضغط الدم"', 'سمنة',
+    'لقاح', 'تطعيم', '"طب بديل"', '"وصفات طبيعية"', 'خلطات', '"خل التفاح"',
+    '"الحبة السوداء"', 'الكركم', '"المكملات الغذائية"', '"الطب النبوي"',
+]
+
+CLAIM_CLAUSE = (
     '(يشفي OR يعالج OR "يقضي على" OR "بدون دواء" OR "بدون أدوية" OR "بدون دكتور" '
     'OR "بدون طبيب" OR "بدون آثار جانبية" OR "طبيعي 100%" OR "مضمون 100%" '
     'OR "معجزة" OR "خلطة سحرية" OR "سر لا يريدونك أن تعرفه" '
     'OR "الحقيقة التي لا تخبرك بها وزارة الصحة" OR "خداع شركات الأدوية" '
     'OR "لقاح" NEAR "خطر" OR "سرطان" NEAR "لقاح")'
-    ') lang:ar has:images -is:retweet -is:reply -is:quote -has:videos'
 )
 
+QUERY_FILTERS = "lang:ar has:images -is:retweet -is:reply -is:quote -has:videos"
+
+
+def build_query(
+    topic_terms: Iterable[str],
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> str:
+    """
+    Health-claim search query restricted to `topic_terms`, optionally to the
+    [since, until) date window (YYYY-MM-DD).
+    """
+    query = "((" + " OR ".join(topic_terms) + ") " + CLAIM_CLAUSE + ") " + QUERY_FILTERS
+    if since:
+        query += f" since:{since}"
+    if until:
+        query += f" until:{until}"
+    return query
+
+
+AR_HEALTH_QUERY = build_query(HEALTH_TOPIC_TERMS)
+
+
+class Shard:
+    """One independently paginated slice of the collection (a query + its name)."""
+
+    def __init__(self, name: str, query: str) -> None:
+        self.name = name
+        self.query = query
+
+    def __repr__(self) -> str:
+        return f"Shard({self.name!r})"
+
+
+def date_windows(since: str, until: Optional[str], days: int) -> List[Tuple[str, str]]:
+    """Split [since, until) into consecutive windows of `days` days."""
+    start = dt.date.fromisoformat(since)
+    end = dt.date.fromisoformat(until) if until else dt.datetime.now(dt.timezone.utc).date() + dt.timedelta(days=1)
+    windows: List[Tuple[str, str]] = []
+    while start < end:
+        stop = min(start + dt.timedelta(days=days), end)
+        windows.append((start.isoformat(), stop.isoformat()))
+        start = stop
+    return windows
+
+
+def plan_shards(
+    topic_terms: List[str] = HEALTH_TOPIC_TERMS,
+    term_groups: int = COLLECT_TERM_GROUPS,
+    since: Optional[str] = COLLECT_SINCE,
+    until: Optional[str] = COLLECT_UNTIL,
+    window_days: int = COLLECT_WINDOW_DAYS,
+) -> List[Shard]:
+    """
+    Split the health query into shards: topic terms are divided into
+    `term_groups` groups, and with window_days > 0 the [since, until) range
+    is cut into windows of that many days. One shard per (group, window).
+    With the defaults this is a single shard equal to AR_HEALTH_QUERY.
+    """
+    n_groups = max(1, min(term_groups, len(topic_terms)))
+    size, extra = divmod(len(topic_terms), n_groups)
+    groups: List[List[str]] = []
+    start = 0
+    for i in range(n_groups):
+        stop = start + size + (1 if i < extra else 0)
+        groups.append(topic_terms[start:stop])
+        start = stop
+
+    if window_days > 0:
+        if not since:
+            raise ValueError("Time-window sharding needs a start date (COLLECT_SINCE=YYYY-MM-DD)")
+        windows: List[Tuple[Optional[str], Optional[str]]] = list(date_windows(since, until, window_days))
+    else:
+        windows = [(since, until)]
+
+    shards: List[Shard] = []
+    for g, terms in enumerate(groups):
+        for w_since, w_until in windows:
+            name = f"terms{g + 1}/{n_groups}"
+            if w_since or w_until:
+                name += f"@{w_since or ''}..{w_until or ''}"
+            shards.append(Shard(name, build_query(terms, w_since, w_until)))
+    return shards
+
+
+def _tweet_id(tw: Dict[str, Any]) -> Optional[str]:
+    tid = tw.get("id") or tw.get("tweet_id") or tw.get("rest_id")
+    return str(tid) if tid else None
+
+
+def _int_id(tid: Optional[str]) -> Optional[int]:
+    """Numeric tweet ID (IDs grow over time), or None if it is not numeric."""
+    return int(tid) if tid and tid.isdigit() else None
+
+
+def _parse_page(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+    """Return (tweets, next_cursor, has_next) for one advanced_search response."""
+    tweets = (
+        data.get("tweets")
+        or data.get("data")
+        or data.get("results")
+        or data.get("statuses")
+        or []
+    )
+
+    has_next = bool(
+        data.get("has_next_page")
+        or data.get("has_next")
+        or data.get("next_cursor")
+        or data.get("next_token")
+        or data.get("next")
+    )
+
+    cursor = (
+        data.get("next_cursor")
+        or data.get("next_token")
+        or data.get("next")
+    )
+    return tweets, cursor, has_next
+
+
+def fetch_page(
+    query: str,
+    cursor: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    limiter: Optional[TokenBucketLimiter] = None,
+    base_url: Optional[str] = None,
+    max_retries: int = 3,
+    query_type: str = "Top",
+) -> Dict[str, Any]:
+    """
+    GET one page of search results. Requests are paced by `limiter`; a 429
+    slows the shared limiter down, and any error is retried up to
+    max_retries times with exponential backoff before being raised.
+    """
+    headers = {"x-api-key": TWITTERAPI_KEY}
+    params = {"query": query, "queryType": query_type}
+    if cursor:
+        params["cursor"] = cursor
+    http = session or requests
+
+    retry = 0
+    rate_limited = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            resp = http.get(
+                base_url or BASE_URL,
+                headers=headers,
+                params=params,
+                proxies=PROXIES if USE_BRIGHT_DATA_FOR_TWITTERAPI else None,
+                timeout=30,
+            )
+
+            if resp.status_code != 200:
+                print(f"HTTP {resp.status_code} from twitterapi.io")
+                try:
+                    print("Response body:", resp.text[:1000])
+                except Exception:
+                    pass
+                resp.raise_for_status()
+
+            if limiter is not None:
+                limiter.on_success()
+            return resp.json()
+
+        except requests.exceptions.RequestException as e:
+            print(f"Request error, attempt {retry + 1}: {e}")
+
+            if hasattr(e, "response") and e.response is not None:
+                try:
+                    print("Error response body:", e.response.text[:1000])
+                except Exception:
+                    pass
+
+            delay = retry_after_seconds(e)
+            if is_rate_limit_error(e) and rate_limited < MAX_RATE_LIMIT_RETRIES:
+                # Rate limits are expected when shards share a budget; slow
+                # everyone down instead of spending this request's retries.
+                rate_limited += 1
+                if limiter is not None:
+                    limiter.on_rate_limited(delay)
+                time.sleep(delay if delay is not None else backoff_delay(rate_limited))
+                continue
+
+            retry += 1
+            if retry >= max_retries:
+                raise
+            time.sleep(delay if delay is not None else 2 ** retry)
+
+
 def fetch_all_tweets(
     query: str,
     target_n: int = 1000,
     max_pages: int = 50,
 ) -> List[Dict[str, Any]]:
-    headers = {"x-api-key": TWITTERAPI_KEY}
+    """Walk a single query's cursor and return the distinct tweets, in memory."""
     all_tweets: List[Dict[str, Any]] = []
-    seen_ids = set()
+    seen_ids = SeenIdIndex()
     cursor = None
     page_count = 0
-    max_retries = 3
 
     twitter_cookies = get_twitter_cookies()
     if twitter_cookies:
         print(f"Loaded {len(twitter_cookies)} Twitter cookies (not used by twitterapi.io).")
 
     while len(all_tweets) < target_n and page_count < max_pages:
-        params = {"query": query, "queryType": "Top"}
-        if cursor:
-            params["cursor"] = cursor
-
-        retry = 0
-        while retry < max_retries:
-            try:
-                resp = requests.get(
-                    BASE_URL,
-                    headers=headers,
-                    params=params,
-                    proxies=PROXIES if USE_BRIGHT_DATA_FOR_TWITTERAPI else None,
-                    timeout=30,
-                )
-
-                if resp.status_code != 200:
-                    print(f"HTTP {resp.status_code} from twitterapi.io")
-                    try:
-                        print("Response body:", resp.text[:1000])
-                    except Exception:
-                        pass
-                    resp.raise_for_status()
-
-                data = resp.json()
-
-                # printing first page just to verify schema
-                if page_count == 0:
-                    print("--- Raw response (page 1) ---")
-                    print(json.dumps(data, ensure_ascii=False, indent=2))
-
-
-                tweets = (
-                    data.get("tweets")
-                    or data.get("data")
-                    or data.get("results")
-                    or data.get("statuses")
-                    or []
-                )
-
-                has_next = bool(
-                    data.get("has_next_page")
-                    or data.get("has_next")
-                    or data.get("next_cursor")
-                    or data.get("next_token")
-                    or data.get("next")
-                )
-
-                cursor = (
-                    data.get("next_cursor")
-                    or data.get("next_token")
-                    or data.get("next")
-                )
-
-                new_count = 0
-                for tw in tweets:
-                    tid = tw.get("id") or tw.get("tweet_id") or tw.get("rest_id")
-                    if tid and tid not in seen_ids:
-                        seen_ids.add(tid)
-                        all_tweets.append(tw)
-                        new_count += 1
-
-                page_count += 1
-                print(
-                    f"Page {page_count}: raw={len(tweets)}, new={new_count}, "
-                    f"total={len(all_tweets)}"
-                )
-
-                if not has_next or not tweets:
-                    if not has_next:
-                        print("No more pages (no next cursor / flag).")
-                    if not tweets:
-                        print("This page contained 0 tweets.")
-                    return all_tweets
-
-                break
-
-            except requests.exceptions.RequestException as e:
-                print(f"Request error on page {page_count + 1}, attempt {retry + 1}: {e}")
-
-                if hasattr(e, "response") and e.response is not None:
-                    try:
-                        print("Error response body:", e.response.text[:1000])
-                    except Exception:
-                        pass
-                retry += 1
-                time.sleep(2 ** retry)
-
-        if retry == max_retries:
+        try:
+            data = fetch_page(query, cursor)
+        except requests.exceptions.RequestException:
             print("Max retries reached, stopping collection.")
             break
 
+        # printing first page just to verify schema
+        if page_count == 0:
+            print("--- Raw response (page 1) ---")
+            print(json.dumps(data, ensure_ascii=False, indent=2))
+
+        tweets, cursor, has_next = _parse_page(data)
+
+        new_count = 0
+        for tw in tweets:
+            tid = _int_id(_tweet_id(tw))
+            if tid is not None and seen_ids.add(tid):
+                all_tweets.append(tw)
+                new_count += 1
+
+        page_count += 1
+        print(
+            f"Page {page_count}: raw={len(tweets)}, new={new_count}, "
+            f"total={len(all_tweets)}"
+        )
+
+        if not has_next or not tweets:
+            if not has_next:
+                print("No more pages (no next cursor / flag).")
+            if not tweets:
+                print("This page contained 0 tweets.")
+            break
+
     return all_tweets
 
 
-def main():
+class TweetSink:
+    """
+    Thread-safe destination shared by all shards: drops tweet IDs already
+    seen by any shard and appends new tweets to a JSON Lines file as soon as
+    they arrive, so a crash keeps everything fetched so far on disk.
+
+    A fresh file is written as <path>.part and moved into place by close();
+    with append=True new tweets are appended to the existing raw store and
+    `seen` should hold the IDs it already contains. `seen` is updated in
+    place; tweets without a numeric ID are dropped.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        target_n: Optional[int] = None,
+        on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+        append: bool = False,
+        seen: Optional[SeenIdIndex] = None,
+    ) -> None:
+        self.path = Path(path)
+        if not is_jsonl(self.path):
+            raise ValueError(f"Sharded collection writes JSON Lines; got {self.path}")
+        self.target_n = target_n
+        self.on_record = on_record
+        self.count = 0
+
+        self._lock = threading.Lock()
+        self._seen = seen if seen is not None else SeenIdIndex()
+        if append:
+            if repair_jsonl_tail(self.path):
+                print(f"Dropped a torn last line from {self.path}")
+            self._tmp = None
+            self._file = self.path.open("a", encoding="utf-8")
+        else:
+            self._tmp = self.path.with_name(self.path.name + ".part")
+            self._file = self._tmp.open("w", encoding="utf-8")
+
+    @property
+    def full(self) -> bool:
+        return self.target_n is not None and self.count >= self.target_n
+
+    def add(self, tweets: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Write the tweets not seen before, up to target_n. Returns them and
+        whether the whole page was consumed (False if target_n cut it short).
+        """
+        new: List[Dict[str, Any]] = []
+        complete = True
+        with self._lock:
+            for tw in tweets:
+                if self.full:
+                    complete = False
+                    break
+                tid = _int_id(_tweet_id(tw))
+                if tid is None or not self._seen.add(tid):
+                    continue
+                self._file.write(json.dumps(tw, ensure_ascii=False) + "\n")
+                self.count += 1
+                new.append(tw)
+            self._file.flush()
+
+        if self.on_record is not None:
+            for tw in new:
+                self.on_record(tw)
+        return new, complete
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            if self._tmp is not None:
+                os.replace(self._tmp, self.path)
+
+
+def _collect_shard(
+    shard: Shard,
+    sink: TweetSink,
+    session: requests.Session,
+    limiter: TokenBucketLimiter,
+    max_pages: int,
+    base_url: Optional[str] = None,
+    state: Optional[CollectorState] = None,
+) -> int:
+    """
+    Walk one shard's cursor into the sink. Returns the number of pages fetched.
+
+    With a CollectorState the walk is incremental: newest first ("Latest"),
+    restricted to tweets above the shard's high-water mark via since_id:,
+    and checkpointed after every page so an interrupted crawl resumes from
+    its cursor on the next run. A page cut short by target_n is not
+    checkpointed: the next run fetches it again and keeps the rest of it.
+    """
+    query, cursor, query_type = shard.query, None, "Top"
+    high_water = crawl_max = crawl_max_date = None
+
+    if state is not None:
+        query_type = "Latest"
+        st = state.get(shard.query)
+        high_water = st["high_water_id"]
+        if st["crawl_cursor"] and st["crawl_query"]:
+            query, cursor = st["crawl_query"], st["crawl_cursor"]
+            crawl_max, crawl_max_date = st["crawl_max_id"], st["crawl_max_date"]
+            print(f"[{shard.name}] resuming interrupted crawl")
+        elif high_water:
+            query = f"{shard.query} since_id:{high_water}"
+            print(f"[{shard.name}] fetching tweets newer than {high_water} ({st['high_water_date']})")
+
+    pages = 0
+    while pages < max_pages and not sink.full:
+        try:
+            data = fetch_page(
+                query, cursor, session=session, limiter=limiter,
+                base_url=base_url, query_type=query_type,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"[{shard.name}] giving up after repeated errors: {e}")
+            break
+
+        tweets, cursor, has_next = _parse_page(data)
+        new, complete = sink.add(tweets)
+        pages += 1
+        print(
+            f"[{shard.name}] page {pages}: raw={len(tweets)}, new={len(new)}, "
+            f"total={sink.count}"
+        )
+        if not complete:
+            # The crawl position stays before this page; the tweets already
+            # written are skipped as seen when it is fetched again.
+            break
+
+        done = not has_next or not tweets
+        if state is not None:
+            ids = []
+            for tw in tweets:
+                tid = _int_id(_tweet_id(tw))
+                if tid is not None:
+                    ids.append((tid, tw))
+            if ids:
+                newest_id, newest = max(ids, key=lambda p: p[0])
+                if crawl_max is None or newest_id > crawl_max:
+                    crawl_max, crawl_max_date = newest_id, newest.get("created_at")
+                # Safety net if the server ignores since_id: stop at the old mark.
+                if high_water is not None and min(i for i, _ in ids) <= high_water:
+                    done = True
+            state.save_progress(
+                shard.query, query, None if done else cursor, crawl_max, crawl_max_date
+            )
+            if done:
+                state.finish_crawl(shard.query)
+
+        if done:
+            break
+    return pages
+
+
+def collect_sharded(
+    shards: List[Shard],
+    output_path: Path = RAW_TWEETS_PATH,
+    target_n: Optional[int] = None,
+    max_pages: int = 20,
+    workers: int = COLLECT_WORKERS,
+    requests_per_minute: Optional[float] = TWITTERAPI_RPM,
+    base_url: Optional[str] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    state: Optional[CollectorState] = None,
+    append: bool = False,
+) -> int:
+    """
+    Collect several shards concurrently into one JSON Lines file.
+
+    - max_pages: page cap per shard.
+    - target_n: stop all shards once this many distinct tweets were saved.
+    - workers: shards walked at the same time; all of them share one
+               requests-per-minute limiter, which backs off on HTTP 429.
+    - base_url: search endpoint override (e.g. a local mock server).
+    - state: CollectorState for incremental crawls (see _collect_shard).
+    - append: append to output_path instead of replacing it; IDs in
+              `state.seen` are treated as already saved.
+
+    Returns the number of distinct tweets saved.
+    """
+    limiter = TokenBucketLimiter(requests_per_minute=requests_per_minute)
+    seen = state.seen if state is not None else None
+    sink = TweetSink(output_path, target_n=target_n, on_record=on_record, append=append, seen=seen)
+    session = requests.Session()
+
+    started = time.monotonic()
+    print(f"Collecting {len(shards)} shard(s) with {workers} worker(s), "
+          f"{requests_per_minute} requests/min")
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pages = sum(pool.map(
+                lambda shard: _collect_shard(
+                    shard, sink, session, limiter, max_pages, base_url, state
+                ),
+                shards,
+            ))
+    finally:
+        sink.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Fetched {pages} page(s) in {elapsed:.1f}s; "
+          f"saved {sink.count} distinct tweets to {output_path}")
+    return sink.count
+
+
+def collect_tweets(
+    output_path: Path = RAW_TWEETS_PATH,
+    query: Optional[str] = None,
+    target_n: int = 100,
+    max_pages: int = 20,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    shards: Optional[List[Shard]] = None,
+    workers: int = COLLECT_WORKERS,
+    base_url: Optional[str] = None,
+    incremental: bool = COLLECT_INCREMENTAL,
+    full: bool = False,
+) -> int:
+    """
+    Collect tweets and save them to output_path as they arrive.
+
+    By default the health query is sharded as configured by COLLECT_* (see
+    plan_shards); pass `query` to collect one custom query instead, or
+    `shards` for an explicit shard list.
+
+    - incremental: keep per-query progress in CollectorState, fetch only
+                   tweets newer than each query's high-water mark and append
+                   them to output_path. target_n then caps *new* tweets.
+    - full: with incremental, forget the saved progress and re-crawl into
+            a fresh output_path (also done when output_path does not exist).
+    - on_record: receives every tweet of the resulting raw store once
+                 written (in append mode, the existing ones first).
+
+    Returns the number of tweets saved by this run.
+    """
     print("Starting twitterapi.io collector...")
-    
-    tweets = fetch_all_tweets(AR_HEALTH_QUERY, max_pages=20, target_n=100)
-    print(f"Total tweets collected: {len(tweets)}")
 
-    if tweets:
-        print("--- Sample tweet ---")
-        print(json.dumps(tweets[0], ensure_ascii=False, indent=2))
+    twitter_cookies = get_twitter_cookies()
+    if twitter_cookies:
+        print(f"Loaded {len(twitter_cookies)} Twitter cookies (not used by twitterapi.io).")
+
+    if shards is None:
+        shards = [Shard("query", query)] if query else plan_shards()
+
+    state = None
+    append = False
+    if incremental:
+        state = CollectorState()
+        append = not full and Path(output_path).exists()
+        if not append:
+            # Progress is only meaningful together with the raw store it built.
+            state.reset()
+        if append:
+            repair_jsonl_tail(output_path)
+            # The saved index covers the raw store up to indexed_bytes; only
+            # tweets written after that (a crash before the index was saved,
+            # or a store from before incremental mode) are read and adopted.
+            # on_record needs the whole store, so then it is all read.
+            start = 0 if on_record is not None else state.indexed_bytes(output_path)
+            adopted = 0
+            for tw in read_records(output_path, start=start):
+                tid = _int_id(_tweet_id(tw))
+                if tid is not None and state.seen.add(tid):
+                    adopted += 1
+                if on_record is not None:
+                    on_record(tw)
+            print(f"Incremental collection: {len(state.seen)} tweets already in {output_path}"
+                  + (f" ({adopted} IDs added to the seen index)" if adopted else ""))
+
+    try:
+        return collect_sharded(
+            shards,
+            output_path,
+            target_n=target_n,
+            max_pages=max_pages,
+            workers=workers,
+            base_url=base_url,
+            on_record=on_record,
+            state=state,
+            append=append,
+        )
+    finally:
+        if state is not None:
+            state.close(output_path)
+
 
-    out_path = "raw_health_tweets.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(tweets, f, ensure_ascii=False, indent=2)
-    print(f"Saved {len(tweets)} tweets to {out_path}")
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Collect Arabic health tweets.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=COLLECT_INCREMENTAL,
+        help="only fetch tweets newer than the last run and append them (default: $COLLECT_INCREMENTAL)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="forget incremental progress and re-crawl into a fresh raw store",
+    )
+    args = parser.parse_args(argv or [])
+    collect_tweets(
+        RAW_TWEETS_PATH, target_n=100, max_pages=20, incremental=args.incremental, full=args.full
+    )
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
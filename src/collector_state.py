@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from .seen_index import SeenIdIndex
+
+
+COLLECTOR_STATE_PATH = Path(os.getenv("COLLECTOR_STATE_PATH", "collector_state.sqlite"))
+COLLECTOR_SEEN_PATH = Path(os.getenv("COLLECTOR_SEEN_PATH", "collector_seen_ids.idx"))
+
+
+def query_key(query: str) -> str:
+    """Stable key for a search query (its exact text decides its state)."""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()[:16]
+
+
+class CollectorState:
+    """
+    Persistent progress of incremental collection.
+
+    Per query it keeps the high-water mark (newest tweet ID and date of the
+    last *completed* crawl) and, while a crawl is in progress, its cursor,
+    query text and newest ID so far, so an interrupted crawl resumes where
+    it stopped. The high-water mark only moves once a crawl has walked all
+    the way down to it, so no window of tweets is ever skipped.
+
+    `seen` is a SeenIdIndex of every tweet already in the raw store, shared
+    by all queries, so new pages are deduplicated against earlier runs. It
+    is saved by close(), which also records how many bytes of the raw store
+    it covers; after a crash the collector only re-reads the tweets written
+    past that offset.
+    """
+
+    def __init__(self, path: Path = COLLECTOR_STATE_PATH, seen_path: Path = COLLECTOR_SEEN_PATH) -> None:
+        self.path = Path(path)
+        self.seen = SeenIdIndex(seen_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_state (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                high_water_id INTEGER,
+                high_water_date TEXT,
+                crawl_query TEXT,
+                crawl_cursor TEXT,
+                crawl_max_id INTEGER,
+                crawl_max_date TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS raw_store (
+                path TEXT PRIMARY KEY,
+                indexed_bytes INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def indexed_bytes(self, raw_path: Path) -> int:
+        """
+        Bytes at the start of raw_path whose tweet IDs are all in the saved
+        `seen` index; 0 if unknown or if the file no longer matches.
+        """
+        raw_path = Path(raw_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT indexed_bytes FROM raw_store WHERE path = ?", (str(raw_path.resolve()),)
+            ).fetchone()
+        if not row or not raw_path.exists():
+            return 0
+        offset = row[0]
+        if offset <= 0 or offset > raw_path.stat().st_size:
+            return 0
+        with raw_path.open("rb") as f:
+            f.seek(offset - 1)
+            # The recorded offset must still end a line of the same file.
+            return offset if f.read(1) == b"\n" else 0
+
+    def get(self, query: str) -> Dict[str, Any]:
+        """State of `query`; all fields are None for a query never crawled."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT high_water_id, high_water_date, crawl_query, crawl_cursor, "
+                "crawl_max_id, crawl_max_date FROM query_state WHERE key = ?",
+                (query_key(query),),
+            ).fetchone()
+        names = ("high_water_id", "high_water_date", "crawl_query", "crawl_cursor",
+                 "crawl_max_id", "crawl_max_date")
+        return dict(zip(names, row or (None,) * len(names)))
+
+    def save_progress(
+        self,
+        query: str,
+        crawl_query: str,
+        cursor: Optional[str],
+        crawl_max_id: Optional[int],
+        crawl_max_date: Optional[str],
+    ) -> None:
+        """Record a fetched page: the crawl's cursor and newest tweet so far."""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO query_state (key, query, crawl_query, crawl_cursor,
+                                         crawl_max_id, crawl_max_date, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    crawl_query = excluded.crawl_query,
+                    crawl_cursor = excluded.crawl_cursor,
+                    crawl_max_id = excluded.crawl_max_id,
+                    crawl_max_date = excluded.crawl_max_date,
+                    updated_at = excluded.updated_at
+                """,
+                (query_key(query), query, crawl_query, cursor,
+                 crawl_max_id, crawl_max_date, time.time()),
+            )
+            self._conn.commit()
+
+    def finish_crawl(self, query: str) -> None:
+        """The crawl reached the old high-water mark: advance it and drop the cursor."""
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE query_state SET
+                    high_water_id = MAX(COALESCE(high_water_id, 0), COALESCE(crawl_max_id, 0)),
+                    high_water_date = CASE
+                        WHEN COALESCE(crawl_max_id, 0) > COALESCE(high_water_id, 0)
+                        THEN crawl_max_date ELSE high_water_date END,
+                    crawl_query = NULL,
+                    crawl_cursor = NULL,
+                    crawl_max_id = NULL,
+                    crawl_max_date = NULL,
+                    updated_at = ?
+                WHERE key = ?
+                """,
+                (time.time(), query_key(query)),
+            )
+            self._conn.commit()
+
+    def reset(self) -> None:
+        """Forget all progress (used for a full re-crawl)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM query_state")
+            self._conn.execute("DELETE FROM raw_store")
+            self._conn.commit()
+            self.seen.clear()
+
+    def close(self, raw_path: Optional[Path] = None) -> None:
+        """
+        Save the seen index; with raw_path (the raw store it was built from,
+        fully written), record that the index covers all of it.
+        """
+        with self._lock:
+            self.seen.close()
+            if raw_path is not None and Path(raw_path).exists():
+                raw_path = Path(raw_path)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO raw_store (path, indexed_bytes) VALUES (?, ?)",
+                    (str(raw_path.resolve()), raw_path.stat().st_size),
+                )
+                self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBucketLimiter:
+    """
+    Thread-safe limiter enforcing requests-per-minute and tokens-per-minute budgets.
+
+    Both budgets are modelled as token buckets that refill continuously.
+    On rate-limit responses (HTTP 429) the effective rate is cut in half and
+    all callers pause until the cool-down has passed; successful calls then
+    slowly restore the rate towards the configured budget (AIMD).
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        min_rate_fraction: float = 0.1,
+        recovery_step: float = 0.05,
+    ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_rate_fraction = min_rate_fraction
+        self.recovery_step = recovery_step
+
+        self._lock = threading.Lock()
+        self._rate_fraction = 1.0
+        self._request_level = float(requests_per_minute or 0)
+        self._token_level = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._cooldown_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            rate = self.requests_per_minute * self._rate_fraction / 60.0
+            self._request_level = min(
+                float(self.requests_per_minute), self._request_level + elapsed * rate
+            )
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute * self._rate_fraction / 60.0
+            self._token_level = min(
+                float(self.tokens_per_minute), self._token_level + elapsed * rate
+            )
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until one request carrying `tokens` tokens fits both budgets."""
+        if self.tokens_per_minute:
+            # A single oversized request must still be able to go through eventually.
+            tokens = min(tokens, int(self.tokens_per_minute))
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                wait = self._cooldown_until - now
+                if wait <= 0:
+                    need_req = 1.0 - self._request_level if self.requests_per_minute else 0.0
+                    need_tok = tokens - self._token_level if self.tokens_per_minute else 0.0
+
+                    if need_req <= 0 and need_tok <= 0:
+                        if self.requests_per_minute:
+                            self._request_level -= 1.0
+                        if self.tokens_per_minute:
+                            self._token_level -= tokens
+                        return
+
+                    wait = 0.0
+                    if need_req > 0:
+                        rate = self.requests_per_minute * self._rate_fraction / 60.0
+                        wait = max(wait, need_req / rate)
+                    if need_tok > 0:
+                        rate = self.tokens_per_minute * self._rate_fraction / 60.0
+                        wait = max(wait, need_tok / rate)
+
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """Halve the effective rate and pause every caller for a cool-down."""
+        with self._lock:
+            self._rate_fraction = max(self.min_rate_fraction, self._rate_fraction / 2.0)
+            pause = retry_after if retry_after is not None else 1.0
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + pause)
+            # Drop whatever burst capacity was left; the server disagreed with it.
+            self._request_level = min(self._request_level, 0.0)
+            self._token_level = min(self._token_level, 0.0)
+
+    def on_success(self) -> None:
+        """Additively restore the rate after a successful call."""
+        with self._lock:
+            self._rate_fraction = min(1.0, self._rate_fraction + self.recovery_step)
+
+    @property
+    def rate_fraction(self) -> float:
+        return self._rate_fraction
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Recognise HTTP 429s from both the OpenAI SDK and requests."""
+    if type(exc).__name__ == "RateLimitError":
+        return True
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Return the server-provided Retry-After delay of an HTTP error, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def ordered_map(
+    executor: Executor,
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_in_flight: int,
+) -> Iterator[R]:
+    """
+    Like executor.map, but pulls `items` lazily and keeps at most
+    `max_in_flight` calls pending. Results are yielded in input order.
+    """
+    pending: Deque[Future] = deque()
+    it = iter(items)
+
+    for item in it:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            break
+
+    while pending:
+        result: Any = pending.popleft().result()
+        for item in it:
+            pending.append(executor.submit(fn, item))
+            break
+        yield result
+
+
+class PipelineAborted(RuntimeError):
+    """Raised in a stage thread when another stage of the same run failed."""
+
+
+class RecordChannel:
+    """
+    Bounded hand-off of records from one stage thread to the next.
+
+    The producer calls put() for each record and close() when done (passing
+    the exception if it failed); the consumer simply iterates. Both sides
+    give up with PipelineAborted once `abort` is set, so a failing stage
+    cannot leave its neighbours blocked forever.
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize: int = 1000, abort: Optional[threading.Event] = None) -> None:
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self._abort = abort or threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _put(self, item: Any) -> None:
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted("pipeline aborted")
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, item: Any) -> None:
+        self._put(item)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        self._error = error
+        try:
+            self._put(self._END)
+        except PipelineAborted:
+            pass
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted("pipeline aborted")
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is self._END:
+                if self._error is not None:
+                    raise PipelineAborted("upstream stage failed") from self._error
+                return
+            yield item
@@ -1,41 +1,37 @@
 from __future__ import annotations
 
-import json
+import itertools
 import os
 import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from urllib.parse import urlparse, parse_qs
+from typing import Callable, Iterable, List, Dict, Any, Iterator, Optional, Tuple
 
-import requests
+from .concurrency import ordered_map
+from .image_store import ImageStore, get_image_store, guess_extension_from_url
+from .records import count_records, merge_records, read_records, tap_records, write_records
 
 
-DEFAULT_INPUT_PATH = Path("health_tweets_labeled.json")
-DEFAULT_OUTPUT_PATH = Path("health_tweets_with_local_images.json")
+DEFAULT_INPUT_PATH = Path("health_tweets_labeled.jsonl")
+DEFAULT_OUTPUT_PATH = Path("health_tweets_with_local_images.jsonl")
 DEFAULT_IMAGE_DIR = Path("tweet_images")
 DEFAULT_INDEX_CSV = Path("images_index.csv")
+# Fields the download step adds to a row.
+IMAGE_FIELDS = ("image_paths", "image_sha256s")
+INDEX_HEADER = "tweet_id,image_idx,image_path,label,text,ocr_text\n"
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "16"))
 
 
-def _guess_extension_from_url(url: str) -> str:
-    url_lower = url.lower()
-
-    parsed = urlparse(url_lower)
-    qs = parse_qs(parsed.query)
-    if "format" in qs and qs["format"]:
-        fmt = qs["format"][0]
-        if re.match(r"^[a-z0-9]{3,4}$", fmt):
-            return f".{fmt}"
-
-    if ".png" in parsed.path:
-        return ".png"
-    if ".jpeg" in parsed.path:
-        return ".jpeg"
-    if ".jpg" in parsed.path:
-        return ".jpg"
-    if ".webp" in parsed.path:
-        return ".webp"
-
-    return ".jpg"
+def _materialize(src: Path, dest: Path) -> None:
+    """Expose a store object at dest, hard-linking when possible (no extra disk)."""
+    tmp = dest.with_name(dest.name + ".part")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
 
 
 def _safe_tweet_id(raw_id: Any) -> str:
@@ -45,114 +41,264 @@ def _safe_tweet_id(raw_id: Any) -> str:
     return re.sub(r"[^0-9A-Za-z_-]", "_", str(raw_id))
 
 
+def _csv_field(value: Any) -> str:
+    return (value or "").replace("\n", " ").replace('"', "'")
+
+
+def _index_lines(row: Dict[str, Any], image_dir: Path) -> List[str]:
+    """Image index CSV lines for a row whose 'image_paths' are already set."""
+    tweet_id_safe = _safe_tweet_id(row.get("tweet_id"))
+    image_urls = row.get("image_urls") or []
+    local = set(row.get("image_paths") or [])
+    if not isinstance(image_urls, list) or not local:
+        return []
+
+    label = _csv_field(row.get("label"))
+    text = _csv_field(row.get("text"))
+    ocr_text = _csv_field(row.get("ocr_text_combined"))
+
+    lines: List[str] = []
+    for j, url in enumerate(image_urls):
+        if not isinstance(url, str) or not url.strip():
+            continue
+        fpath = image_dir / f"{tweet_id_safe}_{j}{guess_extension_from_url(url)}"
+        if str(fpath) in local:
+            lines.append(f'{tweet_id_safe},{j},"{fpath}","{label}","{text}","{ocr_text}"\n')
+    return lines
+
+
+class _IndexWriter:
+    """Image index CSV written line by line and moved into place when complete."""
+
+    def __init__(self, path: Optional[Path]) -> None:
+        self.path = path
+        self.count = 0
+        self._tmp = None if path is None else path.with_name(path.name + ".part")
+        self._file = None
+        if self._tmp is not None:
+            self._file = self._tmp.open("w", encoding="utf-8")
+            self._file.write(INDEX_HEADER)
+
+    def write(self, lines: List[str]) -> None:
+        if self._file is not None:
+            self._file.writelines(lines)
+            self.count += len(lines)
+
+    def commit(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            os.replace(self._tmp, self.path)
+
+    def discard(self) -> None:
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+            self._tmp.unlink(missing_ok=True)
+
+
 def download_images_for_dataset(
     input_path: Path = DEFAULT_INPUT_PATH,
     output_path: Path = DEFAULT_OUTPUT_PATH,
     image_dir: Path = DEFAULT_IMAGE_DIR,
-    index_csv_path: Path = DEFAULT_INDEX_CSV,
+    index_csv_path: Optional[Path] = DEFAULT_INDEX_CSV,
     max_tweets: Optional[int] = None,
     timeout: int = 20,
+    store: Optional[ImageStore] = None,
+    workers: int = DOWNLOAD_WORKERS,
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
 ) -> None:
     """
-    Read a tweet dataset JSON (list of dicts) containing 'image_urls',
-    download all images to a local directory, attach 'image_paths'
-    to each tweet, and write:
-      - an updated JSON with local paths
+    Stream a tweet dataset (.jsonl, or a legacy .json list) containing
+    'image_urls', download all images to a local directory, attach
+    'image_paths' to each tweet, and write:
+      - an updated dataset with local paths (same format rules)
       - a flat CSV index (one row per image) to facilitate training.
 
     Parameters
     ----------
     input_path : Path
-        JSON file with tweets (e.g. health_tweets_labeled.json).
+        Dataset with tweets (e.g. health_tweets_labeled.jsonl).
     output_path : Path
-        JSON file to write updated tweets with 'image_paths'.
+        Dataset to write updated tweets with 'image_paths'.
     image_dir : Path
         Directory where images will be saved.
-    index_csv_path : Path
+    index_csv_path : Optional[Path]
         CSV file with (tweet_id, image_idx, image_path, label, text, ocr_text).
+        None skips the index (see attach_local_images).
     max_tweets : Optional[int]
         If set, only process the first N tweets (useful for testing).
     timeout : int
         HTTP timeout in seconds for image downloads.
+    store : Optional[ImageStore]
+        Shared content store; images already fetched by the OCR stage (or a
+        previous run) are linked from it instead of being downloaded again.
+        Each tweet also gets 'image_sha256s' aligned with 'image_paths'.
+    workers : int
+        Number of tweets downloaded concurrently; the store's Fetcher caps
+        connections per host and retries transient failures.
+    records : Optional[Iterable[Dict[str, Any]]]
+        Stream of rows to use instead of reading input_path (e.g. handed
+        over by a running upstream stage).
+    on_record : Optional[Callable]
+        Called with each output row once it has been written.
     """
-    if not input_path.exists():
-        raise FileNotFoundError(f"Input file not found: {input_path}")
-
-    print(f"Loading tweets from {input_path}...")
-    data: List[Dict[str, Any]] = json.loads(input_path.read_text(encoding="utf-8"))
-    total = len(data)
-    print(f"Loaded {total} tweets.")
+    total: Any
+    if records is None:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        total = count_records(input_path)
+        print(f"Streaming {total} tweets from {input_path}.")
+        records = read_records(input_path)
+    else:
+        total = "?"
+        print("Streaming tweets from upstream stage.")
 
     if max_tweets is not None:
-        data = data[:max_tweets]
+        records = itertools.islice(records, max_tweets)
+        total = min(total, max_tweets) if isinstance(total, int) else total
         print(f"Limiting to first {max_tweets} tweets for image download.")
 
     image_dir.mkdir(parents=True, exist_ok=True)
+    if store is None:
+        store = get_image_store()
 
-    index_rows: List[str] = []
-    header = "tweet_id,image_idx,image_path,label,text,ocr_text\n"
-    index_rows.append(header)
+    index = _IndexWriter(index_csv_path)
 
     total_images = 0
     downloaded_images = 0
+    from_store = 0
 
-    for i, row in enumerate(data, start=1):
-        tweet_id = row.get("tweet_id")
-        tweet_id_safe = _safe_tweet_id(tweet_id)
+    def process_row(row: Dict[str, Any]) -> Optional[Tuple[List[str], List[Optional[str]], int, int]]:
+        """Fetch one tweet's images; returns paths, SHAs and counters."""
+        tweet_id_safe = _safe_tweet_id(row.get("tweet_id"))
         image_urls = row.get("image_urls") or []
         if not isinstance(image_urls, list):
-            continue
-
-        label = (row.get("label") or "").replace("\n", " ").replace('"', "'")
-        text = (row.get("text") or "").replace("\n", " ").replace('"', "'")
-        ocr_text = (row.get("ocr_text_combined") or "").replace("\n", " ").replace('"', "'")
+            return None
 
         local_paths: List[str] = []
-        if image_urls:
-            print(f"[{i}/{len(data)}] Tweet {tweet_id_safe}: {len(image_urls)} image(s).")
+        local_shas: List[Optional[str]] = []
+        new, reused = 0, 0
 
         for j, url in enumerate(image_urls):
-            total_images += 1
             if not isinstance(url, str) or not url.strip():
                 continue
 
-            ext = _guess_extension_from_url(url)
+            ext = guess_extension_from_url(url)
             fname = f"{tweet_id_safe}_{j}{ext}"
             fpath = image_dir / fname
-            
-            if fpath.exists():
-                local_paths.append(str(fpath))
-            
-                index_rows.append(
-                    f'{tweet_id_safe},{j},"{fpath}","{label}","{text}","{ocr_text}"\n'
-                )
-                continue
 
             try:
-                resp = requests.get(url, timeout=timeout)
-                resp.raise_for_status()
-                with fpath.open("wb") as out:
-                    out.write(resp.content)
-                downloaded_images += 1
+                if url in store:
+                    obj_path = store.fetch(url, timeout=timeout)
+                    reused += 1
+                elif fpath.exists():
+                    # Downloaded by an older run before the store existed: adopt it.
+                    obj_path = store.put_bytes(url, fpath.read_bytes())
+                else:
+                    obj_path = store.fetch(url, timeout=timeout)
+                    new += 1
+                if not fpath.exists():
+                    _materialize(obj_path, fpath)
                 local_paths.append(str(fpath))
-                index_rows.append(
-                    f'{tweet_id_safe},{j},"{fpath}","{label}","{text}","{ocr_text}"\n'
-                )
+                local_shas.append(store.sha_for_url(url))
             except Exception as e:
                 print(f"  - Failed to download image {j} for tweet {tweet_id_safe}: {e}")
 
-        row["image_paths"] = local_paths
+        return local_paths, local_shas, new, reused
+
+    print(f"Downloading with {workers} worker thread(s), "
+          f"at most {store.fetcher.per_host} connection(s) per host.")
+
+    with_paths = 0
+
+    def output_rows(pool: ThreadPoolExecutor) -> Iterator[Dict[str, Any]]:
+        nonlocal total_images, downloaded_images, from_store, with_paths
+
+        def work(row: Dict[str, Any]):
+            return row, process_row(row)
+
+        results = ordered_map(pool, work, records, max_in_flight=max(1, workers) * 4)
+        for i, (row, result) in enumerate(results, start=1):
+            if result is not None:
+                local_paths, local_shas, new, reused = result
+                n_urls = len(row.get("image_urls") or [])
+                total_images += n_urls
+                downloaded_images += new
+                from_store += reused
+                if n_urls:
+                    print(f"[{i}/{total}] Tweet {_safe_tweet_id(row.get('tweet_id'))}: {n_urls} image(s).")
+                with_paths += len(local_paths)
+                row["image_paths"] = local_paths
+                row["image_sha256s"] = local_shas
+                index.write(_index_lines(row, image_dir))
+            yield row
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            write_records(output_path, tap_records(output_rows(pool), on_record))
+        index.commit()
+    finally:
+        index.discard()
 
-    output_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
     print(f"\nSaved updated dataset with local image paths to {output_path}")
-
-    index_csv_path.write_text("".join(index_rows), encoding="utf-8")
-    print(f"Saved image index CSV with {len(index_rows) - 1} rows to {index_csv_path}")
+    if index_csv_path is not None:
+        print(f"Saved image index CSV with {index.count} rows to {index_csv_path}")
 
     print(f"\nTotal images referenced: {total_images}")
     print(f"Images successfully downloaded (new): {downloaded_images}")
-    print(f"Images (existing or new) with paths stored in dataset: "
-          f"{sum(len(r.get('image_paths', [])) for r in data)}")
+    print(f"Images served from the shared image store: {from_store}")
+    print(f"Download throughput: {store.fetcher.stats.summary()}")
+    print(f"Images (existing or new) with paths stored in dataset: {with_paths}")
+
+
+def attach_local_images(
+    labeled_path: Path = Path("health_tweets_labeled.jsonl"),
+    images_path: Path = Path("health_tweets_downloaded.jsonl"),
+    output_path: Path = DEFAULT_OUTPUT_PATH,
+    image_dir: Path = DEFAULT_IMAGE_DIR,
+    index_csv_path: Path = DEFAULT_INDEX_CSV,
+    labeled: Optional[Iterable[Dict[str, Any]]] = None,
+    images: Optional[Iterable[Dict[str, Any]]] = None,
+) -> int:
+    """
+    Join labeled tweets with the output of an image download that ran on
+    the unlabeled dataset, by tweet_id, and write the final dataset plus
+    the image index CSV. This lets downloading run alongside OCR/labeling.
+
+    Parameters
+    ----------
+    labeled_path, images_path : Path
+        Labeled dataset and download output (read when no stream is given).
+    output_path : Path
+        Labeled dataset with 'image_paths' / 'image_sha256s'.
+    image_dir, index_csv_path : Path
+        Same meaning as in download_images_for_dataset.
+    labeled, images : Optional[Iterable]
+        Streams to use instead of reading the two files.
+
+    Returns the number of tweets written.
+    """
+    if labeled is None:
+        labeled = read_records(labeled_path)
+    if images is None:
+        images = read_records(images_path)
+
+    index = _IndexWriter(index_csv_path)
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        for row in merge_records(labeled, images, IMAGE_FIELDS):
+            index.write(_index_lines(row, image_dir))
+            yield row
+
+    try:
+        n_saved = write_records(output_path, rows())
+        index.commit()
+    finally:
+        index.discard()
+
+    print(f"Saved {n_saved} labeled tweets with local image paths to {output_path}")
+    print(f"Saved image index CSV with {index.count} rows to {index_csv_path}")
+    return n_saved
 
 
 def main() -> None:
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+
+EMBED_DTYPE = os.getenv("EMBED_DTYPE", "float32")
+
+# Files of a store directory:
+#   meta.json    {"format", "model", "dim", "dtype", "count"}, replaced atomically
+#   keys.bin     count x 32-byte SHA-256 digests, in row order
+#   vectors.bin  capacity x dim array of `dtype`, memory-mapped; rows past
+#                count are spare capacity (or leftovers of a crashed run)
+_FORMAT = 1
+_KEY_BYTES = 32
+_MIN_CAPACITY = 1024
+DTYPES = ("float32", "float16")
+
+
+class EmbeddingStore:
+    """
+    Append-only store of fixed-size vectors keyed by SHA-256 (of an image's
+    bytes, of a preprocessed text, ...), backed by a memory-mapped array.
+
+    Only the keys are read into memory when a store is opened; vectors are
+    paged in by the OS as they are used, so opening a large store is
+    instant and `vectors` is a zero-copy view. Rows are committed by
+    flush(): the row count in meta.json is written last, atomically, so an
+    interrupted run loses at most the rows added since the last flush.
+
+    A store belongs to one model: opening it for a different model, dim or
+    dtype raises ValueError instead of mixing incompatible vectors.
+
+    Not safe for several writer processes; threads share one instance.
+
+    Usage:
+        store = EmbeddingStore("embeddings/clip_images", "ViT-B/32", 512)
+        todo = store.missing(keys)
+        store.add(todo, vectors_for(todo))
+        store.flush()
+        X = store.get(keys)
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        model: str,
+        dim: int,
+        dtype: str = EMBED_DTYPE,
+    ) -> None:
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding dtype {dtype!r}; choose from {DTYPES}")
+        self.root = Path(root)
+        self.model = model
+        self.dim = int(dim)
+        self.dtype = np.dtype(dtype)
+        self.meta_path = self.root / "meta.json"
+        self.keys_path = self.root / "keys.bin"
+        self.vectors_path = self.root / "vectors.bin"
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._count = 0
+        self._committed = 0
+        self._rows: Dict[bytes, int] = {}
+        self._keys = bytearray()
+
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            found = (meta.get("model"), meta.get("dim"), meta.get("dtype"))
+            if meta.get("format") != _FORMAT or found != (model, self.dim, self.dtype.name):
+                raise ValueError(
+                    f"Embedding store {self.root} holds {found[0]!r} vectors "
+                    f"(dim={found[1]}, dtype={found[2]}), not {model!r} (dim={self.dim}, "
+                    f"dtype={self.dtype.name}); use another directory or delete it"
+                )
+            self._count = self._committed = int(meta["count"])
+            with self.keys_path.open("rb") as f:
+                self._keys = bytearray(f.read(_KEY_BYTES * self._count))
+            if len(self._keys) != _KEY_BYTES * self._count:
+                raise ValueError(f"Embedding store {self.root} is truncated (keys.bin)")
+            self._rows = {
+                bytes(self._keys[i * _KEY_BYTES:(i + 1) * _KEY_BYTES]): i for i in range(self._count)
+            }
+
+        capacity = self.vectors_path.stat().st_size // self._row_bytes if self.vectors_path.exists() else 0
+        if capacity < self._count:
+            raise ValueError(f"Embedding store {self.root} is truncated (vectors.bin)")
+        self._vectors: Optional[np.memmap] = None
+        self._map(max(capacity, _MIN_CAPACITY))
+
+    # Storage ------------------------------------------------------------------
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def _map(self, capacity: int) -> None:
+        """(Re)map vectors.bin with room for `capacity` rows, growing the file if needed."""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        size = capacity * self._row_bytes
+        with self.vectors_path.open("ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+
+    @staticmethod
+    def _digest(key: Union[str, bytes]) -> bytes:
+        digest = bytes.fromhex(key) if isinstance(key, str) else bytes(key)
+        if len(digest) != _KEY_BYTES:
+            raise ValueError(f"Embedding keys are SHA-256 digests, got {key!r}")
+        return digest
+
+    # Lookup ---------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: Union[str, bytes]) -> bool:
+        return self._digest(key) in self._rows
+
+    def missing(self, keys: Iterable[Union[str, bytes]]) -> List[Union[str, bytes]]:
+        """Keys without a vector yet, deduplicated, in first-seen order."""
+        out: List[Union[str, bytes]] = []
+        seen = set()
+        for key in keys:
+            digest = self._digest(key)
+            if digest not in self._rows and digest not in seen:
+                seen.add(digest)
+                out.append(key)
+        return out
+
+    def rows(self, keys: Sequence[Union[str, bytes]]) -> np.ndarray:
+        """Row numbers of keys (KeyError if one is missing)."""
+        try:
+            return np.fromiter((self._rows[self._digest(k)] for k in keys), dtype=np.int64, count=len(keys))
+        except KeyError as e:
+            raise KeyError(f"No embedding for key {e.args[0].hex()}") from None
+
+    def get(self, keys: Sequence[Union[str, bytes]], dtype: Any = np.float32) -> np.ndarray:
+        """Vectors of keys, in order, as a new (len(keys), dim) array."""
+        return np.asarray(self.vectors[self.rows(keys)], dtype=dtype)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """All stored vectors, a zero-copy (len, dim) view of the mapped file."""
+        return self._vectors[:self._count]
+
+    # Writing --------------------------------------------------------------------
+
+    def add(self, keys: Sequence[Union[str, bytes]], vectors: np.ndarray) -> int:
+        """
+        Append vectors for keys that are not stored yet (others are
+        ignored). Visible at once in this process; durable after flush().
+        Returns how many rows were added.
+        """
+        vectors = np.asarray(vectors)
+        if vectors.shape != (len(keys), self.dim):
+            raise ValueError(f"Expected vectors of shape ({len(keys)}, {self.dim}), got {vectors.shape}")
+        with self._lock:
+            added = 0
+            for key, vector in zip(keys, vectors):
+                digest = self._digest(key)
+                if digest in self._rows:
+                    continue
+                if self._count >= len(self._vectors):
+                    self._map(2 * len(self._vectors))
+                self._vectors[self._count] = vector
+                self._rows[digest] = self._count
+                self._keys += digest
+                self._count += 1
+                added += 1
+            return added
+
+    def flush(self) -> None:
+        """Make all added rows durable: vectors and keys first, then the row count."""
+        with self._lock:
+            if self._count == self._committed and self.meta_path.exists():
+                return
+            self._vectors.flush()
+            with self.keys_path.open("r+b" if self.keys_path.exists() else "wb") as f:
+                f.seek(_KEY_BYTES * self._committed)
+                f.write(self._keys[_KEY_BYTES * self._committed:])
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+            meta = {
+                "format": _FORMAT,
+                "model": self.model,
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+                "count": self._count,
+            }
+            tmp = self.meta_path.with_name(self.meta_path.name + ".part")
+            tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+            os.replace(tmp, self.meta_path)
+            self._committed = self._count
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._vectors = None
+
+    def nbytes(self) -> int:
+        """Bytes taken by the stored vectors (excluding spare capacity)."""
+        return self._count * self._row_bytes
+
+
+def open_store(root: Union[str, Path]) -> EmbeddingStore:
+    """Open an existing store with the model, dim and dtype recorded in it."""
+    meta = json.loads((Path(root) / "meta.json").read_text(encoding="utf-8"))
+    return EmbeddingStore(root, meta["model"], meta["dim"], meta["dtype"])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage:")
+        print("  python3 -m src.embedding_store <store directory>")
+        sys.exit(1)
+
+    store = open_store(sys.argv[1])
+    print(f"{sys.argv[1]}: {len(store)} x {store.dim} {store.dtype.name} vectors of {store.model!r} "
+          f"({store.nbytes() / 1e6:.1f} MB)")
@@ -0,0 +1,545 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .embedding_store import EmbeddingStore, open_store
+from .image_embeddings import IMAGE_EMBED_DIR, row_images
+from .records import read_records
+from .text_embeddings import TEXT_EMBED_DIR
+from .text_preprocessing import PREPROCESS_VERSION, combine_text, text_key
+
+
+INPUT_PATH = Path("health_tweets_with_local_images.jsonl")
+FEATURE_DIR = Path(os.getenv("FEATURE_DIR", "features"))
+# Feature rows gathered before they are appended and flushed.
+FEATURE_CHUNK_SIZE = int(os.getenv("FEATURE_CHUNK_SIZE", "4096"))
+
+# The notebook's label_map; any other label (e.g. "unverified") is NO_LABEL.
+LABELS = {"false": 0, "misleading": 1, "true": 2}
+NO_LABEL = -1
+LABEL_VERSION = ",".join(f"{name}={value}" for name, value in LABELS.items())
+
+IMAGE_COLUMN = "clip_image"
+TEXT_COLUMN = "arabert_text"
+LABEL_COLUMN = "label"
+FEATURE_COLUMNS = (IMAGE_COLUMN, TEXT_COLUMN)
+# Bump when image vectors change for reasons other than the CLIP model.
+IMAGE_FEATURE_VERSION = "1"
+
+# Row identity and lineage, present in every store: the row key, and the
+# embedding-store keys its image / text vectors were copied from.
+KEY_COLUMNS = ("tweet_id", "image_index")
+_BASE_COLUMNS = {
+    "tweet_id": ("int64", 0),
+    "image_index": ("int32", 0),
+    "image_sha256": ("uint8", 32),
+    "text_key": ("uint8", 32),
+}
+
+# Files of a store directory:
+#   meta.json           {"format", "count", "updated", "columns": {name: spec}},
+#                       replaced atomically; spec = {"file", "dtype", "dim",
+#                       "model", "version", "generation"}
+#   <name>.<gen>.bin    one file per column: capacity x dim values (capacity
+#                       values for dim 0), memory-mapped; rows past count are
+#                       spare capacity
+_FORMAT = 1
+_MIN_CAPACITY = 1024
+_COLUMN_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+Key = Tuple[int, int]
+
+
+class FeatureStore:
+    """
+    Columnar, appendable table of per-image features: one row per
+    (tweet_id, image_index), one memory-mapped file per column (CLIP image
+    vectors, AraBERT text vectors, labels, ...). Each column records the
+    model and version that produced it.
+
+    Only the key columns are read when a store is opened; column() is a
+    zero-copy view of the mapped file, so training and serving read just
+    the rows they select. Like EmbeddingStore, rows are committed by
+    flush(), which writes meta.json last and atomically. Replacing a
+    column (set_column) writes a new file, so a crash or a reader never
+    sees half a column.
+
+    Open with readonly=True to share a store with a writer process safely;
+    a reader sees the rows committed when it opened the store.
+
+    Usage:
+        fs = FeatureStore("features")
+        fs.append(keys, {"clip_image": X_img, "arabert_text": X_txt, ...})
+        fs.flush()
+        X = fs.matrix(["clip_image", "arabert_text"], fs.tweet_rows(ids))
+    """
+
+    def __init__(self, root: Union[str, Path], readonly: bool = False) -> None:
+        self.root = Path(root)
+        self.readonly = readonly
+        self.meta_path = self.root / "meta.json"
+
+        self._lock = threading.Lock()
+        self._columns: Dict[str, Dict[str, Any]] = {}
+        self._maps: Dict[str, np.memmap] = {}
+        self._count = 0
+        self._committed = 0
+        self._dirty = False
+        self._by_tweet: Optional[Dict[int, List[int]]] = None
+
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            if meta.get("format") != _FORMAT:
+                raise ValueError(f"Feature store {self.root} has unsupported format {meta.get('format')!r}")
+            self._columns = meta["columns"]
+            self._count = self._committed = int(meta["count"])
+            for name in self._columns:
+                self._map(name)
+        elif readonly:
+            raise FileNotFoundError(f"No feature store at {self.root}")
+        else:
+            self.root.mkdir(parents=True, exist_ok=True)
+            for name, (dtype, dim) in _BASE_COLUMNS.items():
+                self._new_column(name, dtype, dim, "", "")
+
+        tweet_ids = self.column("tweet_id").tolist()
+        indices = self.column("image_index").tolist()
+        self._rows: Dict[Key, int] = {key: row for row, key in enumerate(zip(tweet_ids, indices))}
+
+    # Storage ------------------------------------------------------------------
+
+    def _row_shape(self, name: str) -> Tuple[np.dtype, Tuple[int, ...]]:
+        spec = self._columns[name]
+        return np.dtype(spec["dtype"]), ((spec["dim"],) if spec["dim"] else ())
+
+    def _map(self, name: str, capacity: Optional[int] = None) -> None:
+        """(Re)map a column's file with room for `capacity` rows, growing it if needed."""
+        dtype, shape = self._row_shape(name)
+        row_bytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        path = self.root / self._columns[name]["file"]
+        old = self._maps.pop(name, None)
+        if old is not None:
+            old.flush()
+        if self.readonly:
+            capacity = path.stat().st_size // row_bytes
+        else:
+            if capacity is None:
+                capacity = max(path.stat().st_size // row_bytes if path.exists() else 0, _MIN_CAPACITY)
+            with path.open("ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        if capacity < self._count:
+            raise ValueError(f"Feature store {self.root} is truncated ({path.name})")
+        self._maps[name] = np.memmap(
+            path, dtype=dtype, mode="r" if self.readonly else "r+", shape=(capacity,) + shape
+        )
+
+    def _new_column(self, name: str, dtype: Any, dim: int, model: str, version: str) -> None:
+        """Register a column backed by a fresh, empty file of the next generation."""
+        old = self._columns.get(name)
+        generation = old["generation"] + 1 if old else 0
+        spec = {
+            "file": f"{name}.{generation}.bin",
+            "dtype": np.dtype(dtype).name,
+            "dim": int(dim),
+            "model": model,
+            "version": version,
+            "generation": generation,
+        }
+        (self.root / spec["file"]).write_bytes(b"")
+        self._columns[name] = spec
+        self._maps.pop(name, None)
+        self._map(name, max(self._count, _MIN_CAPACITY))
+
+    def _check_writable(self) -> None:
+        if self.readonly:
+            raise PermissionError(f"Feature store {self.root} was opened read-only")
+
+    # Lookup ---------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: Key) -> bool:
+        return (int(key[0]), int(key[1])) in self._rows
+
+    @property
+    def columns(self) -> Dict[str, Dict[str, Any]]:
+        """{column: {"dtype", "dim", "model", "version", ...}}"""
+        return {name: dict(spec) for name, spec in self._columns.items()}
+
+    def column(self, name: str) -> np.ndarray:
+        """All values of a column, a zero-copy view of its mapped file."""
+        if name not in self._maps:
+            raise KeyError(f"Feature store {self.root} has no column {name!r}")
+        return self._maps[name][:self._count]
+
+    def rows(self, keys: Sequence[Key]) -> np.ndarray:
+        """Row numbers of (tweet_id, image_index) keys (KeyError if one is missing)."""
+        try:
+            return np.fromiter(
+                (self._rows[(int(t), int(i))] for t, i in keys), dtype=np.int64, count=len(keys)
+            )
+        except KeyError as e:
+            raise KeyError(f"No feature row for {e.args[0]}") from None
+
+    def tweet_rows(self, tweet_ids: Iterable[Any]) -> np.ndarray:
+        """Row numbers of every image of the given tweets, in order."""
+        if self._by_tweet is None:
+            by_tweet: Dict[int, List[int]] = {}
+            for (tweet_id, _), row in self._rows.items():
+                by_tweet.setdefault(tweet_id, []).append(row)
+            self._by_tweet = by_tweet
+        rows: List[int] = []
+        for tweet_id in tweet_ids:
+            rows.extend(self._by_tweet.get(int(tweet_id), ()))
+        return np.asarray(rows, dtype=np.int64)
+
+    def matrix(
+        self,
+        names: Sequence[str],
+        rows: Union[None, slice, Sequence[int], np.ndarray] = None,
+        dtype: Any = np.float32,
+    ) -> np.ndarray:
+        """
+        Columns side by side as one (n, sum of dims) matrix, for `rows`
+        (row numbers, a slice, or None for all rows).
+
+        A single column selected by a slice (or None) in its stored dtype
+        is a zero-copy view. Otherwise each column is written straight into
+        the preallocated result, with no concatenate of temporary arrays.
+        """
+        selection = slice(None) if rows is None else rows
+        parts = [self.column(name) for name in names]
+        if len(parts) == 1 and isinstance(selection, slice) and parts[0].dtype == np.dtype(dtype):
+            view = parts[0][selection]
+            return view.reshape(len(view), max(self._columns[names[0]]["dim"], 1))
+
+        n = len(range(*selection.indices(self._count))) if isinstance(selection, slice) else len(selection)
+        widths = [max(self._columns[name]["dim"], 1) for name in names]
+        out = np.empty((n, sum(widths)), dtype=dtype)
+        start = 0
+        for part, width in zip(parts, widths):
+            out[:, start:start + width] = part[selection].reshape(n, width)
+            start += width
+        return out
+
+    # Writing --------------------------------------------------------------------
+
+    def set_column(self, name: str, values: np.ndarray, model: str = "", version: str = "", dtype: Any = None) -> None:
+        """
+        Create column `name`, or replace all its values (e.g. for a new
+        model), with one value or vector per stored row. The values go to
+        a new file and meta.json switches to it on commit, so readers and
+        an interrupted run see either the old column or the new one.
+        Pending appended rows are committed as well.
+        """
+        self._check_writable()
+        if name in _BASE_COLUMNS or not _COLUMN_NAME.match(name):
+            raise ValueError(f"Invalid feature column name {name!r}")
+        values = np.asarray(values)
+        if values.ndim not in (1, 2) or len(values) != self._count:
+            raise ValueError(f"Expected {self._count} rows of values for column {name!r}, got shape {values.shape}")
+
+        with self._lock:
+            old = self._columns.get(name)
+            self._new_column(name, dtype or values.dtype, values.shape[1] if values.ndim == 2 else 0, model, version)
+            self._maps[name][:self._count] = values
+            self._commit()
+        if old is not None:
+            (self.root / old["file"]).unlink(missing_ok=True)
+
+    def append(self, keys: Sequence[Key], values: Dict[str, np.ndarray]) -> int:
+        """
+        Append rows for keys that are not stored yet (others are ignored);
+        `values` has an array per column, aligned with keys, for every
+        column except tweet_id / image_index. Visible at once in this
+        process; durable after flush(). Returns how many rows were added.
+        """
+        self._check_writable()
+        expected = set(self._columns) - set(KEY_COLUMNS)
+        if set(values) != expected:
+            raise ValueError(f"Expected values for columns {sorted(expected)}, got {sorted(values)}")
+        arrays = {name: np.asarray(v) for name, v in values.items()}
+        for name, array in arrays.items():
+            _, shape = self._row_shape(name)
+            if array.shape != (len(keys),) + shape:
+                raise ValueError(f"Expected column {name!r} of shape {(len(keys),) + shape}, got {array.shape}")
+
+        with self._lock:
+            new: List[int] = []
+            new_keys: List[Key] = []
+            for j, (tweet_id, index) in enumerate(keys):
+                key = (int(tweet_id), int(index))
+                if key not in self._rows:
+                    self._rows[key] = self._count + len(new)
+                    new.append(j)
+                    new_keys.append(key)
+            if not new:
+                return 0
+
+            end = self._count + len(new)
+            for name in self._columns:
+                capacity = len(self._maps[name])
+                if capacity < end:
+                    while capacity < end:
+                        capacity *= 2
+                    self._map(name, capacity)
+
+            rows = slice(self._count, end)
+            self._maps["tweet_id"][rows] = [key[0] for key in new_keys]
+            self._maps["image_index"][rows] = [key[1] for key in new_keys]
+            for name, array in arrays.items():
+                self._maps[name][rows] = array[new]
+            self._count = end
+            self._by_tweet = None
+            return len(new)
+
+    def update(self, name: str, rows: Sequence[int], values: np.ndarray) -> None:
+        """Overwrite the values of existing rows of a non-key column (durable after flush())."""
+        self._check_writable()
+        if name in KEY_COLUMNS:
+            raise ValueError("Row keys cannot be updated")
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and (rows.min() < 0 or rows.max() >= self._count):
+            raise IndexError(f"Row out of range for a store of {self._count} rows")
+        with self._lock:
+            self._maps[name][rows] = values
+            self._dirty = True
+
+    def _commit(self) -> None:
+        """Flush every column file, then atomically write meta.json (lock held)."""
+        for array in self._maps.values():
+            array.flush()
+        meta = {
+            "format": _FORMAT,
+            "count": self._count,
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "columns": self._columns,
+        }
+        tmp = self.meta_path.with_name(self.meta_path.name + ".part")
+        tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+        self._committed = self._count
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Make appended rows and updates durable: column files first, then the row count."""
+        if self.readonly:
+            return
+        with self._lock:
+            if self._count == self._committed and not self._dirty and self.meta_path.exists():
+                return
+            self._commit()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._maps = {}
+
+    def nbytes(self) -> int:
+        """Bytes taken by the stored rows of all columns (excluding spare capacity)."""
+        total = 0
+        for name in self._columns:
+            dtype, shape = self._row_shape(name)
+            total += self._count * dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        return total
+
+
+def open_feature_store(root: Union[str, Path] = FEATURE_DIR) -> FeatureStore:
+    """Open an existing feature store read-only (for training and serving)."""
+    return FeatureStore(root, readonly=True)
+
+
+def training_data(
+    fs: FeatureStore,
+    columns: Sequence[str] = FEATURE_COLUMNS,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (X float32, y, row numbers) of the labeled rows, X being the given
+    columns side by side (CLIP image, then AraBERT text, as in the notebook).
+    """
+    labels = fs.column(LABEL_COLUMN)
+    rows = np.flatnonzero(labels != NO_LABEL)
+    return fs.matrix(columns, rows), np.asarray(labels[rows], dtype=np.int64), rows
+
+
+# ---------------------------------------------------------------------------
+# Pipeline stage
+# ---------------------------------------------------------------------------
+
+def _digests(hex_keys: Sequence[str]) -> np.ndarray:
+    return np.frombuffer(b"".join(bytes.fromhex(k) for k in hex_keys), dtype=np.uint8).reshape(-1, 32)
+
+
+def _sync_column(fs: FeatureStore, name: str, store: EmbeddingStore, key_column: str, version: str) -> None:
+    """
+    Make column `name` hold the vectors of `store`: create it, or, if it
+    was built from another model, dtype or version, rebuild it for all
+    rows by copying from the store (nothing is re-encoded).
+    """
+    spec = fs.columns.get(name)
+    wanted = {"model": store.model, "version": version, "dtype": store.dtype.name, "dim": store.dim}
+    if spec is not None and all(spec[k] == v for k, v in wanted.items()):
+        return
+    try:
+        values = store.get([bytes(k) for k in fs.column(key_column)], dtype=store.dtype)
+    except KeyError as e:
+        raise ValueError(
+            f"Cannot rebuild feature column {name!r}: {store.root} lacks vectors of stored rows ({e.args[0]}); "
+            f"run its embedding stage first"
+        ) from None
+    print(f"  {'Rebuilding' if spec else 'Creating'} column {name} from {store.root} "
+          f"({store.model}, {store.dtype.name}, {len(fs)} rows)")
+    fs.set_column(name, values.reshape(len(fs), store.dim), model=store.model, version=version)
+
+
+def build_features(
+    input_path: Path = INPUT_PATH,
+    root: Path = FEATURE_DIR,
+    image_store_dir: Path = IMAGE_EMBED_DIR,
+    text_store_dir: Path = TEXT_EMBED_DIR,
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+) -> int:
+    """
+    Pipeline stage: bring the feature store at `root` up to date with a
+    labeled dataset. Every downloaded image of a tweet is one row, keyed by
+    (tweet_id, image_index), with its CLIP vector, the AraBERT vector of the
+    tweet's combined text and its label. Vectors are copied from the
+    embedding stores, never recomputed: new rows are appended, rows whose
+    image, text or label changed are updated in place, and a column whose
+    model changed is rebuilt from its store. Images without an embedding
+    (e.g. undecodable) are skipped, as in the notebook.
+
+    Returns the number of rows added.
+    """
+    if records is None:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        print(f"Building features of {input_path}")
+        records = read_records(input_path)
+
+    image_store = open_store(image_store_dir)
+    text_store = open_store(text_store_dir)
+    fs = FeatureStore(root)
+    print(f"Feature store {fs.root}: {len(fs)} rows")
+
+    started = time.monotonic()
+    n_rows = 0
+    n_missing = 0
+    added = 0
+    updated = 0
+    chunk: List[Tuple[Key, str, str, int]] = []
+
+    def apply_chunk() -> None:
+        nonlocal added, updated
+        new: List[Tuple[Key, str, str, int]] = []
+        old: List[Tuple[Key, str, str, int]] = []
+        for item in chunk:
+            (old if item[0] in fs else new).append(item)
+        if new:
+            keys, shas, tkeys, labels = zip(*new)
+            added += fs.append(keys, {
+                "image_sha256": _digests(shas),
+                "text_key": _digests(tkeys),
+                IMAGE_COLUMN: image_store.get(shas, dtype=image_store.dtype),
+                TEXT_COLUMN: text_store.get(tkeys, dtype=text_store.dtype),
+                LABEL_COLUMN: np.asarray(labels, dtype=np.int8),
+            })
+
+        if old:
+            keys, shas, tkeys, labels = zip(*old)
+            rows = fs.rows(keys)
+            changed_rows = set()
+            for key_column, column, store, hex_keys in (
+                ("image_sha256", IMAGE_COLUMN, image_store, shas),
+                ("text_key", TEXT_COLUMN, text_store, tkeys),
+            ):
+                digests = _digests(hex_keys)
+                changed = np.flatnonzero((fs.column(key_column)[rows] != digests).any(axis=1))
+                if len(changed):
+                    fs.update(key_column, rows[changed], digests[changed])
+                    fs.update(column, rows[changed], store.get([hex_keys[i] for i in changed], dtype=store.dtype))
+                    changed_rows.update(rows[changed].tolist())
+            labels = np.asarray(labels, dtype=np.int8)
+            changed = np.flatnonzero(fs.column(LABEL_COLUMN)[rows] != labels)
+            if len(changed):
+                fs.update(LABEL_COLUMN, rows[changed], labels[changed])
+                changed_rows.update(rows[changed].tolist())
+            updated += len(changed_rows)
+
+        fs.flush()
+        chunk.clear()
+
+    try:
+        _sync_column(fs, IMAGE_COLUMN, image_store, "image_sha256", IMAGE_FEATURE_VERSION)
+        _sync_column(fs, TEXT_COLUMN, text_store, "text_key", PREPROCESS_VERSION)
+        label_spec = fs.columns.get(LABEL_COLUMN)
+        if label_spec is None or label_spec["version"] != LABEL_VERSION:
+            # Labels come from the dataset: start from NO_LABEL, the rows below fill them in.
+            fs.set_column(LABEL_COLUMN, np.full(len(fs), NO_LABEL, dtype=np.int8), version=LABEL_VERSION)
+
+        for row in records:
+            n_rows += 1
+            if row.get("tweet_id") is None:
+                continue
+            tweet_id = int(row["tweet_id"])
+            tkey = text_key(combine_text(row))
+            label = LABELS.get(row.get("label"), NO_LABEL)
+            for index, sha, _ in row_images(row):
+                if sha not in image_store or tkey not in text_store:
+                    n_missing += 1
+                    continue
+                chunk.append(((tweet_id, index), sha, tkey, label))
+            if len(chunk) >= FEATURE_CHUNK_SIZE:
+                apply_chunk()
+        if chunk:
+            apply_chunk()
+    finally:
+        fs.close()
+        image_store.close()
+        text_store.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Features: {n_rows} tweets -> {added} row(s) added, {updated} updated, "
+          f"{n_missing} image(s) skipped without an embedding ({elapsed:.1f}s)")
+    print(f"Store {fs.root}: {len(fs)} rows, {fs.nbytes() / 1e6:.1f} MB")
+    return added
+
+
+def describe(fs: FeatureStore) -> None:
+    labels = fs.column(LABEL_COLUMN) if LABEL_COLUMN in fs.columns else np.empty(0)
+    print(f"{fs.root}: {len(fs)} rows, {len(np.unique(fs.column('tweet_id')))} tweets, "
+          f"{int((labels != NO_LABEL).sum())} labeled, {fs.nbytes() / 1e6:.1f} MB")
+    for name, spec in fs.columns.items():
+        shape = f"{spec['dim']} x {spec['dtype']}" if spec["dim"] else spec["dtype"]
+        origin = " ".join(x for x in (spec["model"], spec["version"] and f"({spec['version']})") if x)
+        print(f"  {name:<14} {shape:<12} {origin}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build or inspect the columnar feature store.")
+    parser.add_argument("--input", type=Path, default=INPUT_PATH, help="labeled dataset with image_paths")
+    parser.add_argument("--store", type=Path, default=FEATURE_DIR, help="feature store directory")
+    parser.add_argument("--image-store", type=Path, default=IMAGE_EMBED_DIR)
+    parser.add_argument("--text-store", type=Path, default=TEXT_EMBED_DIR)
+    parser.add_argument("--info", action="store_true", help="only describe the store")
+    args = parser.parse_args(argv or [])
+
+    if not args.info:
+        build_features(args.input, args.store, args.image_store, args.text_store)
+    describe(open_feature_store(args.store))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
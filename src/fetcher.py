@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .concurrency import backoff_delay, retry_after_seconds
+
+
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "8"))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "4"))
+
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Errors without a response worth retrying; anything else (InvalidURL,
+# MissingSchema, TooManyRedirects, SSLError, ...) fails the same way again.
+RETRY_ERRORS = (
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+)
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadStats:
+    """Thread-safe throughput / failure counters for one or more download runs."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failures: Counter = Counter()
+
+    def record_success(self, size: int) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self, reason: str) -> None:
+        with self._lock:
+            self.failures[reason] += 1
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        failures = ", ".join(f"{k}={v}" for k, v in sorted(self.failures.items())) or "none"
+        return (
+            f"{self.files} file(s), {self.bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+            f"({self.files / elapsed:.2f} files/s, {self.bytes / elapsed / 1e6:.2f} MB/s); "
+            f"retries={self.retries}; failures by status: {failures}"
+        )
+
+
+class Fetcher:
+    """
+    Pooled HTTP downloader: one keep-alive Session shared by all threads,
+    at most `per_host` concurrent requests per host, retries of transient
+    errors (timeouts, dropped connections, 429, 5xx) with jittered
+    exponential backoff, and bodies
+    streamed to a temporary file instead of being buffered in memory.
+    """
+
+    def __init__(
+        self,
+        per_host: int = DOWNLOAD_PER_HOST,
+        max_retries: int = DOWNLOAD_MAX_RETRIES,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.stats = DownloadStats()
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(per_host, 10))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self._host_slots[host] = slot
+            return slot
+
+    def _stream_once(self, url: str, dest_dir: Path, timeout: int) -> Tuple[Path, str, int]:
+        with self._slot(url):
+            with self.session.get(url, timeout=timeout, stream=True) as resp:
+                resp.raise_for_status()
+                digest = hashlib.sha256()
+                size = 0
+                fd, tmp = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as out:
+                        for chunk in resp.iter_content(CHUNK_SIZE):
+                            out.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                except BaseException:
+                    Path(tmp).unlink(missing_ok=True)
+                    raise
+        return Path(tmp), digest.hexdigest(), size
+
+    def download(self, url: str, dest_dir: Path, timeout: int = 20) -> Tuple[Path, str, int]:
+        """
+        Stream url into a temporary file inside dest_dir (so the caller can
+        rename it atomically into place). Returns (tmp_path, sha256, size).
+        """
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        attempt = 0
+        while True:
+            try:
+                result = self._stream_once(url, dest_dir, timeout)
+                self.stats.record_success(result[2])
+                return result
+            except requests.exceptions.RequestException as e:
+                response = getattr(e, "response", None)
+                status = getattr(response, "status_code", None)
+                if status is not None:
+                    transient = status in RETRY_STATUSES
+                else:
+                    transient = (isinstance(e, RETRY_ERRORS)
+                                 and not isinstance(e, requests.exceptions.SSLError))
+                if not transient or attempt >= self.max_retries:
+                    self.stats.record_failure(str(status) if status else type(e).__name__)
+                    raise
+                attempt += 1
+                self.stats.record_retry()
+                delay = retry_after_seconds(e)
+                time.sleep(delay if delay is not None else backoff_delay(attempt, base=0.5, cap=30.0))
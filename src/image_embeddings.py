@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .embedding_store import EMBED_DTYPE, EmbeddingStore
+from .image_store import get_image_store
+from .records import read_records
+
+
+INPUT_PATH = Path("health_tweets_with_local_images.jsonl")
+
+CLIP_MODEL = os.getenv("CLIP_MODEL", "ViT-B/32")
+IMAGE_EMBED_DIR = Path(os.getenv("IMAGE_EMBED_DIR", "embeddings/clip_images"))
+# Images per forward pass.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+# DataLoader processes decoding + preprocessing images while the model
+# runs; 0 decodes in the main process.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+# Torch intra-op threads for the forward pass (0 = torch's default).
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+# New images handed to one DataLoader run; stored and flushed per batch.
+EMBED_CHUNK_SIZE = int(os.getenv("EMBED_CHUNK_SIZE", "4096"))
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 of a file's bytes: the same key the ImageStore uses."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def row_images(row: Dict[str, Any]) -> Iterable[Tuple[int, str, Path]]:
+    """
+    (index in 'image_paths', sha256, local file) of the downloaded images of
+    one row, using the 'image_sha256s' recorded by the download stage
+    (hashing the file only for rows written before that field existed).
+    """
+    store = get_image_store()
+    paths = row.get("image_paths") or []
+    shas = row.get("image_sha256s") or [None] * len(paths)
+    for index, (path, sha) in enumerate(zip(paths, shas)):
+        local = store.path_for_sha(sha) if sha else None
+        if local is None:
+            local = Path(path)
+            if not local.is_file():
+                continue
+            sha = sha or file_sha256(local)
+        yield index, sha, local
+
+
+def dataset_images(rows: Iterable[Dict[str, Any]]) -> Iterable[Tuple[str, Path]]:
+    """(sha256, local file) of every downloaded image in the rows (see row_images)."""
+    for row in rows:
+        for _, sha, local in row_images(row):
+            yield sha, local
+
+
+class ImageFileDataset:
+    """
+    Map-style dataset for torch.utils.data.DataLoader: item i is
+    (key, preprocessed image tensor), or (key, None) if the file cannot be
+    decoded, so one bad image does not fail its batch.
+    """
+
+    def __init__(self, items: Sequence[Tuple[str, Path]], preprocess: Callable[[Image.Image], Any]) -> None:
+        self.items = list(items)
+        self.preprocess = preprocess
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, i: int) -> Tuple[str, Any]:
+        key, path = self.items[i]
+        try:
+            with Image.open(path) as img:
+                return key, self.preprocess(img.convert("RGB"))
+        except Exception as e:
+            print(f"  - Skipping image {path}: {e}")
+            return key, None
+
+
+def _collate(batch: List[Tuple[str, Any]]) -> Tuple[List[str], Any, List[str]]:
+    """DataLoader collate_fn: (keys, stacked tensors, keys that failed to decode)."""
+    import torch
+
+    ok = [(key, tensor) for key, tensor in batch if tensor is not None]
+    failed = [key for key, tensor in batch if tensor is None]
+    tensors = torch.stack([tensor for _, tensor in ok]) if ok else None
+    return [key for key, _ in ok], tensors, failed
+
+
+class ClipImageEncoder:
+    """CLIP image tower on CPU, in inference mode, returning L2-normalized float32 vectors."""
+
+    def __init__(self, model_name: str = CLIP_MODEL, threads: int = EMBED_THREADS) -> None:
+        import clip
+        import torch
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.model, self.preprocess = clip.load(model_name, device="cpu")
+        self.model.eval()
+        self.dim = int(self.model.visual.output_dim)
+
+    def encode(self, batch: Any) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode():
+            features = self.model.encode_image(batch)
+            features = features / features.norm(dim=-1, keepdim=True)
+        return features.float().numpy()
+
+
+def open_image_store(encoder: ClipImageEncoder, root: Path = IMAGE_EMBED_DIR, dtype: str = EMBED_DTYPE) -> EmbeddingStore:
+    return EmbeddingStore(root, f"clip:{encoder.model_name}", encoder.dim, dtype)
+
+
+def embed_new_images(
+    items: Sequence[Tuple[str, Path]],
+    encoder: ClipImageEncoder,
+    store: EmbeddingStore,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS,
+) -> Tuple[int, List[str]]:
+    """
+    Embed the images of `items` ((sha256, file) pairs) that are not in the
+    store yet, batch by batch: DataLoader workers decode and preprocess
+    the next batches while the model runs on the current one. Every batch
+    is stored and flushed as it finishes.
+    Returns (vectors added, keys of images that failed to decode).
+    """
+    from torch.utils.data import DataLoader
+
+    todo = set(store.missing(key for key, _ in items))
+    pending = [(key, path) for key, path in dict(items).items() if key in todo]
+    if not pending:
+        return 0, []
+
+    loader = DataLoader(
+        ImageFileDataset(pending, encoder.preprocess),
+        batch_size=batch_size,
+        num_workers=workers,
+        collate_fn=_collate,
+    )
+    added = 0
+    failed: List[str] = []
+    for keys, tensors, bad in loader:
+        failed.extend(bad)
+        if keys:
+            added += store.add(keys, encoder.encode(tensors))
+            store.flush()
+    return added, failed
+
+
+def embed_dataset_images(
+    input_path: Path = INPUT_PATH,
+    store_dir: Path = IMAGE_EMBED_DIR,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS,
+    dtype: str = EMBED_DTYPE,
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+) -> int:
+    """
+    Pipeline stage: make sure every downloaded image of a dataset has a
+    CLIP embedding in the store at store_dir, keyed by image SHA-256.
+    Images embedded by earlier runs (or shared between tweets) are not
+    embedded again.
+
+    - batch_size: images per forward pass.
+    - workers: DataLoader decode/preprocess processes.
+    - dtype: "float32" or "float16" storage for a new store.
+    - records: optional stream of rows to use instead of reading
+               input_path; new images are embedded in chunks of
+               EMBED_CHUNK_SIZE as the rows arrive.
+
+    Returns the number of vectors added.
+    """
+    if records is None:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        print(f"Embedding images of {input_path}")
+        records = read_records(input_path)
+    else:
+        print("Embedding images streamed from upstream stage")
+
+    encoder = ClipImageEncoder()
+    store = open_image_store(encoder, store_dir, dtype)
+    print(f"CLIP {encoder.model_name} -> {store.root} ({len(store)} vectors stored, {store.dtype.name}), "
+          f"batch size {batch_size}, {workers} decode worker(s)")
+
+    started = time.monotonic()
+    n_images = 0
+    seen = set()
+    added = 0
+    failed: List[str] = []
+    chunk: Dict[str, Path] = {}
+
+    def run_chunk() -> None:
+        nonlocal added
+        n, bad = embed_new_images(list(chunk.items()), encoder, store, batch_size, workers)
+        added += n
+        failed.extend(bad)
+        chunk.clear()
+
+    try:
+        for sha, path in dataset_images(records):
+            n_images += 1
+            if sha in seen:
+                continue
+            seen.add(sha)
+            if sha not in store:
+                chunk[sha] = path
+                if len(chunk) >= EMBED_CHUNK_SIZE:
+                    run_chunk()
+        if chunk:
+            run_chunk()
+    finally:
+        store.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Images: {n_images} referenced, {len(seen)} distinct, "
+          f"{len(seen) - added - len(failed)} already embedded")
+    print(f"Embedded {added} new image(s) in {elapsed:.1f}s "
+          f"({added / elapsed if elapsed else 0:.1f} images/s); {len(failed)} failed to decode")
+    print(f"Store {store.root}: {len(store)} vectors, {store.nbytes() / 1e6:.1f} MB")
+    return added
+
+
+def embed_image_files(
+    files: Sequence[Any],
+    store_dir: Path = IMAGE_EMBED_DIR,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    CLIP embeddings of image files, in order, embedding only files whose
+    content is not in the store yet (e.g. for a notebook).
+    Returns (vectors float32 (len(files), dim), ok) where ok[i] is False
+    for files that could not be read or decoded (their row is zero).
+    """
+    keys: List[Optional[str]] = []
+    for f in files:
+        try:
+            keys.append(file_sha256(Path(f)))
+        except OSError as e:
+            print(f"  - Skipping image {f}: {e}")
+            keys.append(None)
+
+    encoder = ClipImageEncoder()
+    store = open_image_store(encoder, store_dir)
+    try:
+        items = [(k, Path(f)) for k, f in zip(keys, files) if k is not None]
+        embed_new_images(items, encoder, store, batch_size, workers)
+        ok = np.array([k is not None and k in store for k in keys], dtype=bool)
+        vectors = np.zeros((len(files), store.dim), dtype=np.float32)
+        if ok.any():
+            vectors[ok] = store.get([k for k, good in zip(keys, ok) if good])
+    finally:
+        store.close()
+    return vectors, ok
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Embed the dataset's images with CLIP, skipping known ones.")
+    parser.add_argument("--input", type=Path, default=INPUT_PATH, help="dataset with image_paths")
+    parser.add_argument("--store", type=Path, default=IMAGE_EMBED_DIR, help="embedding store directory")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="DataLoader decode processes")
+    parser.add_argument("--dtype", choices=("float32", "float16"), default=EMBED_DTYPE,
+                        help="storage dtype of a new store")
+    args = parser.parse_args(argv or [])
+    embed_dataset_images(args.input, args.store, args.batch_size, args.workers, args.dtype)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
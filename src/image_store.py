@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+from .fetcher import Fetcher
+from .records import repair_jsonl_tail
+
+
+IMAGE_STORE_DIR = Path(os.getenv("IMAGE_STORE_DIR", "image_store"))
+
+
+def guess_extension_from_url(url: str) -> str:
+    url_lower = url.lower()
+
+    parsed = urlparse(url_lower)
+    qs = parse_qs(parsed.query)
+    if "format" in qs and qs["format"]:
+        fmt = qs["format"][0]
+        if re.match(r"^[a-z0-9]{3,4}$", fmt):
+            return f".{fmt}"
+
+    if ".png" in parsed.path:
+        return ".png"
+    if ".jpeg" in parsed.path:
+        return ".jpeg"
+    if ".jpg" in parsed.path:
+        return ".jpg"
+    if ".webp" in parsed.path:
+        return ".webp"
+
+    return ".jpg"
+
+
+class ImageStore:
+    """
+    Content-addressed local image store shared by the OCR, download and
+    embedding stages.
+
+    Images live at <root>/objects/<sha[:2]>/<sha256><ext>; <root>/manifest.jsonl
+    maps every URL ever fetched to its SHA-256 and file. Each URL is downloaded
+    at most once per store, across stages and across reruns, and identical
+    content reached through different URLs is kept once.
+    """
+
+    def __init__(
+        self,
+        root: Path = IMAGE_STORE_DIR,
+        fetcher: Optional[Fetcher] = None,
+    ) -> None:
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.manifest_path = self.root / "manifest.jsonl"
+        self.fetcher = fetcher or Fetcher()
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = {}
+        self._by_url: Dict[str, Dict[str, Any]] = {}
+        self._by_sha: Dict[str, str] = {}
+        self._load_manifest()
+
+    def _load_manifest(self) -> None:
+        if not self.manifest_path.exists():
+            return
+        # A line torn by a crashed run is dropped (its object is re-fetched),
+        # so new entries are not appended onto the fragment.
+        repair_jsonl_tail(self.manifest_path)
+        with self.manifest_path.open(encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A mangled line; the object is re-fetched.
+                    continue
+                if (self.root / entry["path"]).exists():
+                    self._by_url[entry["url"]] = entry
+                    self._by_sha[entry["sha256"]] = entry["path"]
+
+    def _append_manifest(self, entry: Dict[str, Any]) -> None:
+        with self.manifest_path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._by_url
+
+    def __len__(self) -> int:
+        return len(self._by_url)
+
+    def sha_for_url(self, url: str) -> Optional[str]:
+        entry = self._by_url.get(url)
+        return entry["sha256"] if entry else None
+
+    def path_for_url(self, url: str) -> Optional[Path]:
+        entry = self._by_url.get(url)
+        return self.root / entry["path"] if entry else None
+
+    def path_for_sha(self, sha256: str) -> Optional[Path]:
+        rel = self._by_sha.get(sha256)
+        return self.root / rel if rel else None
+
+    def _commit(self, url: str, tmp: Path, sha256: str, size: int) -> Path:
+        """Atomically move a finished temp file into place and record url."""
+        ext = guess_extension_from_url(url)
+
+        with self._lock:
+            rel = self._by_sha.get(sha256)
+            if rel is None:
+                rel = f"objects/{sha256[:2]}/{sha256}{ext}"
+                dest = self.root / rel
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, dest)
+                self._by_sha[sha256] = rel
+            else:
+                # Same content already stored under another URL.
+                tmp.unlink(missing_ok=True)
+
+            entry = {"url": url, "sha256": sha256, "path": rel, "size": size}
+            self._by_url[url] = entry
+            self._append_manifest(entry)
+
+        return self.root / rel
+
+    def put_bytes(self, url: str, data: bytes) -> Path:
+        """Store already-downloaded bytes for url and record it in the manifest."""
+        fd, tmp = tempfile.mkstemp(dir=self.objects_dir, suffix=".part")
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        return self._commit(url, Path(tmp), hashlib.sha256(data).hexdigest(), len(data))
+
+    def fetch(self, url: str, timeout: int = 30) -> Path:
+        """Return the local file for url, downloading it only if it is new."""
+        path = self.path_for_url(url)
+        if path is not None:
+            return path
+
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+
+        # Concurrent callers for the same URL wait instead of downloading twice.
+        with url_lock:
+            path = self.path_for_url(url)
+            if path is not None:
+                return path
+            tmp, sha256, size = self.fetcher.download(url, self.objects_dir, timeout=timeout)
+            return self._commit(url, tmp, sha256, size)
+
+    def read_bytes(self, url: str, timeout: int = 30) -> bytes:
+        return self.fetch(url, timeout=timeout).read_bytes()
+
+
+_store: Optional[ImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    """Process-wide ImageStore rooted at IMAGE_STORE_DIR."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+        return _store
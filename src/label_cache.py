@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from .labeler import DEFAULT_MODEL, PROMPT_VERSION, label_tweet
+from .text_preprocessing import PREPROCESS_VERSION
+
+
+LABEL_CACHE_PATH = Path(os.getenv("LABEL_CACHE_PATH", "label_cache.sqlite"))
+LABEL_CACHE_MAX_BYTES = int(os.getenv("LABEL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def _normalize_input(text: Optional[str]) -> str:
+    """Normalize prompt inputs so cosmetic differences map to the same key."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+class LabelCache:
+    """
+    Content-addressed, SQLite-backed cache of label_tweet results.
+
+    Keys are a SHA-256 over the normalized tweet/OCR/extra-context text, the
+    model name, PROMPT_VERSION and PREPROCESS_VERSION, so editing
+    SYSTEM_PROMPT or the text preprocessing automatically misses; stale
+    prompt versions can be purged with invalidate_prompt_versions().
+    When the stored payload grows past max_bytes, least recently used
+    entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: Path = LABEL_CACHE_PATH,
+        max_bytes: int = LABEL_CACHE_MAX_BYTES,
+        prompt_version: str = PROMPT_VERSION,
+        purge_stale: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.prompt_version = prompt_version
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS labels (
+                key TEXT PRIMARY KEY,
+                prompt_version TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS labels_last_access ON labels(last_access)"
+        )
+        self._conn.commit()
+
+        if purge_stale:
+            removed = self.invalidate_prompt_versions()
+            if removed:
+                print(f"Label cache: dropped {removed} entries from older SYSTEM_PROMPT versions.")
+
+    def make_key(
+        self,
+        tweet_text: str,
+        ocr_text: str = "",
+        extra_context: Optional[str] = None,
+        model: str = DEFAULT_MODEL,
+    ) -> str:
+        payload = json.dumps(
+            [
+                self.prompt_version,
+                PREPROCESS_VERSION,
+                model,
+                _normalize_input(tweet_text),
+                _normalize_input(ocr_text),
+                _normalize_input(extra_context),
+            ],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM labels WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE labels SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any], model: str = DEFAULT_MODEL) -> None:
+        result = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO labels "
+                "(key, prompt_version, model, result, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self.prompt_version, model, result, len(result), time.time()),
+            )
+            self._conn.commit()
+            self._evict_locked()
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """get(), counting the lookup as a hit when found."""
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+        return value
+
+    def record(self, key: str, value: Dict[str, Any], model: str = DEFAULT_MODEL) -> None:
+        """put() a freshly computed value, counting it as a miss."""
+        self.put(key, value, model=model)
+        with self._lock:
+            self.misses += 1
+
+    def _evict_locked(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM labels").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Evict down to 90% of the budget so we do not evict on every put.
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM labels ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM labels WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        self._conn.commit()
+        print(f"Label cache: evicted {removed} least recently used entries.")
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Dict[str, Any]],
+        model: str = DEFAULT_MODEL,
+    ) -> Dict[str, Any]:
+        """
+        Return the cached value for key, or run compute() once and store it.
+        Concurrent callers asking for the same key wait for the first one
+        instead of issuing a duplicate API call. Exceptions are not cached.
+        """
+        while True:
+            value = self.lookup(key)
+            if value is not None:
+                return value
+
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._in_flight[key] = event
+                    leader = True
+                else:
+                    leader = False
+
+            if not leader:
+                event.wait()
+                continue
+
+            try:
+                value = compute()
+                self.record(key, value, model=model)
+                return value
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                event.set()
+
+    def invalidate_prompt_versions(self, keep: Optional[str] = None) -> int:
+        """Delete every entry whose prompt version is not `keep` (default: current)."""
+        keep = keep or self.prompt_version
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM labels WHERE prompt_version != ?", (keep,))
+            self._conn.commit()
+        return cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM labels")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM labels"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def cached_label_tweet(
+    tweet_text: str,
+    ocr_text: str = "",
+    extra_context: Optional[str] = None,
+    model: str = DEFAULT_MODEL,
+    cache: Optional[LabelCache] = None,
+) -> Dict:
+    """label_tweet, served from `cache` when the same inputs were labeled before."""
+    if cache is None:
+        return label_tweet(tweet_text, ocr_text, extra_context, model=model)
+
+    key = cache.make_key(tweet_text, ocr_text, extra_context, model=model)
+    return cache.get_or_compute(
+        key,
+        lambda: label_tweet(tweet_text, ocr_text, extra_context, model=model),
+        model=model,
+    )
+
+
+if __name__ == "__main__":
+    cache = LabelCache()
+    print(json.dumps(cache.stats(), indent=2))
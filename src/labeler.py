@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import hashlib
 import json
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from openai import OpenAI
 from src.config import OPENAI_API_KEY
@@ -9,6 +10,8 @@ from src.config import OPENAI_API_KEY
 
 _client = OpenAI(api_key=OPENAI_API_KEY)
 
+DEFAULT_MODEL = "gpt-4.1-mini"
+
 SYSTEM_PROMPT = """
 You are a medical fact-checker specializing in Arabic social-media posts about health, wellness, parenting, lifestyle, diets, herbs, alternative medicine, and public health rumors.
 
@@ -91,6 +94,27 @@ REMINDER
 - If the tweet claims ANY health effect — positive or negative — you MUST pick "true", "misleading", or "false".
 """
 
+PACKED_INSTRUCTIONS = """
+PACKED MODE
+- You will receive SEVERAL posts at once, each introduced by "### tweet_id: <id>".
+- Judge every post independently, applying all rules above to each one.
+- Your entire output MUST be a JSON object with one entry per post, in the same order:
+
+{
+  "results": [
+    {"tweet_id": "<id>", "label": "true|false|misleading|unverified", "justification": "...", "sources": ["WHO", ...]},
+    ...
+  ]
+}
+
+- Copy each tweet_id exactly as given. Do not skip, merge or invent posts.
+"""
+
+VALID_LABELS = ("true", "false", "misleading", "unverified")
+
+# Changes whenever SYSTEM_PROMPT is edited; used to key and invalidate cached labels.
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+
 
 def build_user_prompt(
     tweet_text: str,
@@ -111,39 +135,58 @@ Extra context (if any):
 """.strip()
 
 
-def label_tweet(
+# Rough size of the JSON answer we expect back, used for TPM budgeting.
+RESPONSE_TOKEN_ALLOWANCE = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~3 characters per token for mixed Arabic/English)."""
+    return len(text or "") // 3 + 1
+
+
+def estimate_request_tokens(
     tweet_text: str,
     ocr_text: str = "",
     extra_context: Optional[str] = None,
-    model: str = "gpt-4.1-mini",
-) -> Dict:
-    """
-    Call the OpenAI model to label a tweet + OCR text.
-
-    Returns dict:
-    {
-      "label": "...",
-      "justification": "...",
-      "sources": [...]
-    }
-    """
+) -> int:
+    """Estimate prompt + completion tokens of one label_tweet call."""
     user_prompt = build_user_prompt(tweet_text, ocr_text, extra_context)
+    return (
+        estimate_tokens(SYSTEM_PROMPT)
+        + estimate_tokens(user_prompt)
+        + RESPONSE_TOKEN_ALLOWANCE
+    )
 
-    resp = _client.chat.completions.create(
-        model=model,
-        temperature=0.0,
-        response_format={"type": "json_object"},
-        messages=[
+
+def build_chat_request(
+    tweet_text: str,
+    ocr_text: str = "",
+    extra_context: Optional[str] = None,
+    model: str = DEFAULT_MODEL,
+) -> Dict:
+    """Chat-completions request body used for labeling (live and batch)."""
+    user_prompt = build_user_prompt(tweet_text, ocr_text, extra_context)
+    return {
+        "model": model,
+        "temperature": 0.0,
+        "response_format": {"type": "json_object"},
+        "messages": [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt},
         ],
-    )
+    }
 
-    content = resp.choices[0].message.content or "{}"
 
+def parse_label_response(content: Optional[str]) -> Dict:
+    """
+    Parse the model's JSON answer and fill in defaults for missing fields.
+    """
     try:
-        data = json.loads(content)
+        data = json.loads(content or "{}")
     except json.JSONDecodeError:
+        data = None
+
+    if not isinstance(data, dict):
         data = {
             "label": "unverified",
             "justification": "Failed to parse model response as valid JSON.",
@@ -160,6 +203,148 @@ def label_tweet(
     return data
 
 
+def build_packed_user_prompt(items: List[Dict[str, Any]]) -> str:
+    """
+    Compose one prompt holding several posts. Each item needs 'tweet_id',
+    'text' and optionally 'ocr_text'.
+    """
+    parts = []
+    for item in items:
+        parts.append(
+            f"### tweet_id: {item['tweet_id']}\n"
+            + build_user_prompt(item.get("text") or "", item.get("ocr_text") or "")
+        )
+    return "\n\n".join(parts)
+
+
+def estimate_packed_tokens(items: List[Dict[str, Any]]) -> int:
+    """Estimate prompt + completion tokens of one packed request."""
+    return (
+        estimate_tokens(SYSTEM_PROMPT + PACKED_INSTRUCTIONS)
+        + estimate_tokens(build_packed_user_prompt(items))
+        + RESPONSE_TOKEN_ALLOWANCE * len(items)
+    )
+
+
+def plan_packs(
+    items: List[Dict[str, Any]],
+    pack_size: int,
+    token_budget: int,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Greedily group items into packs of at most pack_size posts whose
+    estimated request size stays within token_budget. An item that is too
+    large on its own still gets a pack of one.
+    """
+    fixed = estimate_tokens(SYSTEM_PROMPT + PACKED_INSTRUCTIONS)
+    packs: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_tokens = fixed
+
+    for item in items:
+        item_tokens = (
+            estimate_tokens(build_packed_user_prompt([item])) + RESPONSE_TOKEN_ALLOWANCE
+        )
+        if current and (
+            len(current) >= pack_size or current_tokens + item_tokens > token_budget
+        ):
+            packs.append(current)
+            current = []
+            current_tokens = fixed
+        current.append(item)
+        current_tokens += item_tokens
+
+    if current:
+        packs.append(current)
+    return packs
+
+
+def _valid_packed_item(item: Any) -> bool:
+    return (
+        isinstance(item, dict)
+        and item.get("tweet_id") is not None
+        and item.get("label") in VALID_LABELS
+        and isinstance(item.get("justification"), str)
+        and isinstance(item.get("sources", []), list)
+    )
+
+
+def parse_packed_response(content: Optional[str]) -> Dict[str, Dict]:
+    """
+    Parse a packed answer into {tweet_id: label_info}. Items that are missing
+    or malformed are simply absent from the result.
+    """
+    try:
+        data = json.loads(content or "{}")
+    except json.JSONDecodeError:
+        return {}
+
+    if isinstance(data, dict):
+        data = data.get("results")
+    if not isinstance(data, list):
+        return {}
+
+    results: Dict[str, Dict] = {}
+    for item in data:
+        if not _valid_packed_item(item):
+            continue
+        results[str(item["tweet_id"])] = {
+            "label": item["label"],
+            "justification": item["justification"],
+            "sources": item.get("sources", []),
+        }
+    return results
+
+
+def label_tweets_packed(
+    items: List[Dict[str, Any]],
+    model: str = DEFAULT_MODEL,
+) -> Dict[str, Dict]:
+    """
+    Label several posts with a single request (SYSTEM_PROMPT is sent once).
+
+    Returns {tweet_id: label_info} for every item the model answered
+    validly; callers should fall back to label_tweet for the rest.
+    """
+    resp = _client.chat.completions.create(
+        model=model,
+        temperature=0.0,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT + PACKED_INSTRUCTIONS},
+            {"role": "user", "content": build_packed_user_prompt(items)},
+        ],
+    )
+
+    wanted = {str(item["tweet_id"]) for item in items}
+    results = parse_packed_response(resp.choices[0].message.content)
+    return {tid: info for tid, info in results.items() if tid in wanted}
+
+
+def label_tweet(
+    tweet_text: str,
+    ocr_text: str = "",
+    extra_context: Optional[str] = None,
+    model: str = DEFAULT_MODEL,
+) -> Dict:
+    """
+    Call the OpenAI model to label a tweet + OCR text.
+
+    Returns dict:
+    {
+      "label": "...",
+      "justification": "...",
+      "sources": [...]
+    }
+    """
+    resp = _client.chat.completions.create(
+        **build_chat_request(tweet_text, ocr_text, extra_context, model=model)
+    )
+
+    content = resp.choices[0].message.content or "{}"
+    return parse_label_response(content)
+
+
 if __name__ == "__main__":
     # test
     example_tweet = "Drinking hot lemon water cures COVID completely and replaces vaccines."
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import json
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+SEARCH_PATH = "/twitter/tweet/advanced_search"
+
+
+class MockTwitterAPI:
+    """
+    Local, deterministic stand-in for the twitterapi.io advanced_search
+    endpoint, for exercising the collector without network or API key.
+
+    The corpus holds `corpus_size` tweets posted one per hour from `start`
+    (tweet k has ID 10**18 + k, so IDs grow with time); add_tweets() posts
+    more. Tweet k matches a query topic term t when sha256(t, k) falls in a
+    1/`match_every` bucket, so different term groups overlap the way real
+    searches do. Results are newest first; since:/until: dates and since_id:
+    are honoured, pages hold `page_size` tweets (the cursor is the last
+    tweet returned, so it stays valid while new tweets arrive), and every
+    `rate_limit_every`-th request (0 = never) is answered with HTTP 429.
+
+    Usage:
+        with MockTwitterAPI() as api:
+            collect_tweets(..., base_url=api.base_url)
+    """
+
+    def __init__(
+        self,
+        corpus_size: int = 500,
+        page_size: int = 20,
+        match_every: int = 3,
+        rate_limit_every: int = 0,
+        start: Optional[dt.datetime] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.corpus_size = corpus_size
+        self.page_size = page_size
+        self.match_every = match_every
+        self.rate_limit_every = rate_limit_every
+        self.start_time = start or dt.datetime(2025, 1, 1, tzinfo=dt.timezone.utc)
+
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                api._handle(self)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{SEARCH_PATH}"
+
+    def start(self) -> "MockTwitterAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockTwitterAPI":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    # Corpus -----------------------------------------------------------------
+
+    def add_tweets(self, count: int) -> None:
+        """Post `count` new tweets (newer than everything so far)."""
+        with self._lock:
+            self.corpus_size += count
+
+    @staticmethod
+    def tweet_id(k: int) -> int:
+        return 10**18 + k
+
+    def created_at(self, k: int) -> dt.datetime:
+        return self.start_time + dt.timedelta(hours=k)
+
+    def tweet(self, k: int) -> Dict[str, Any]:
+        tweet_id = str(self.tweet_id(k))
+        return {
+            "id": tweet_id,
+            "full_text": f"tweet {k}",
+            "created_at": self.created_at(k).strftime("%a %b %d %H:%M:%S +0000 %Y"),
+            "lang": "ar",
+            "user": {"id": str(1000 + k % 50), "screen_name": f"user{k % 50}"},
+            "extended_entities": {
+                "media": [{"type": "photo", "media_url_https": f"https://mock.invalid/{tweet_id}.jpg"}]
+            },
+        }
+
+    def _matches(self, k: int, terms: List[str]) -> bool:
+        for term in terms:
+            digest = hashlib.sha256(f"{term}|{k}".encode("utf-8")).digest()
+            if digest[0] % self.match_every == 0:
+                return True
+        return False
+
+    @staticmethod
+    def _topic_terms(query: str) -> List[str]:
+        # The collector's queries start with "((term OR term ...) (claims...".
+        m = re.match(r"\(\(([^()]*)\)", query)
+        if not m:
+            return [query]
+        return [t.strip() for t in m.group(1).split(" OR ") if t.strip()]
+
+    def search(self, query: str) -> List[int]:
+        """Corpus indexes (newest first) that match query."""
+        terms = self._topic_terms(query)
+        since = re.search(r"since:(\d{4}-\d{2}-\d{2})", query)
+        until = re.search(r"until:(\d{4}-\d{2}-\d{2})", query)
+        since_id = re.search(r"since_id:(\d+)", query)
+        since_d = dt.date.fromisoformat(since.group(1)) if since else None
+        until_d = dt.date.fromisoformat(until.group(1)) if until else None
+        min_id = int(since_id.group(1)) if since_id else None
+
+        hits = []
+        for k in range(self.corpus_size - 1, -1, -1):
+            day = self.created_at(k).date()
+            if since_d and day < since_d:
+                continue
+            if until_d and day >= until_d:
+                continue
+            if min_id is not None and self.tweet_id(k) <= min_id:
+                continue
+            if self._matches(k, terms):
+                hits.append(k)
+        return hits
+
+    # HTTP -------------------------------------------------------------------
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, body: Dict[str, Any],
+              headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            handler.send_header(k, v)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _handle(self, handler: BaseHTTPRequestHandler) -> None:
+        url = urlparse(handler.path)
+        if url.path != SEARCH_PATH:
+            self._send(handler, 404, {"error": "not found"})
+            return
+
+        with self._lock:
+            self.requests += 1
+            throttle = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+            if throttle:
+                self.rate_limited += 1
+        if throttle:
+            self._send(handler, 429, {"error": "rate limited"}, {"Retry-After": "0.1"})
+            return
+
+        params = parse_qs(url.query)
+        query = (params.get("query") or [""])[0]
+        cursor = (params.get("cursor") or [""])[0]
+
+        hits = self.search(query)
+        if cursor:
+            hits = [k for k in hits if k < int(cursor)]
+        page = hits[:self.page_size]
+        has_next = len(hits) > len(page)
+        self._send(handler, 200, {
+            "tweets": [self.tweet(k) for k in page],
+            "has_next_page": has_next,
+            "next_cursor": str(page[-1]) if has_next else "",
+        })
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    api = MockTwitterAPI(port=port)
+    print(f"Mock twitterapi.io listening on {api.base_url}")
+    print(f"Use: TWITTERAPI_BASE_URL={api.base_url} python3 -m src.collector")
+    try:
+        api._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api._server.server_close()
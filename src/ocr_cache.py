@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+
+OCR_CACHE_PATH = Path(os.getenv("OCR_CACHE_PATH", "ocr_cache.sqlite"))
+# Minimum dHash similarity (1 - hamming / 64) for a near-duplicate to reuse text.
+OCR_CACHE_SIMILARITY = float(os.getenv("OCR_CACHE_SIMILARITY", "0.95"))
+
+HASH_BITS = 64
+# Near-duplicate candidates are found through hash bands: two hashes within
+# Hamming distance d agree exactly on at least one of d + 1 bands. Bands
+# narrower than 4 bits match almost everything, which caps d at 15
+# (similarity >= ~0.77).
+MAX_BANDS = 16
+
+
+def content_hash(data: bytes) -> str:
+    """Exact content hash (SHA-256 hex) of the encoded image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """
+    64-bit difference hash: compare neighbouring pixels of a 9x8 grayscale
+    thumbnail. Robust to re-encoding, resizing and small crops, which is what
+    Twitter does to the same infographic under different URLs.
+    """
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def band_count(max_distance: int) -> int:
+    """Bands needed to find every hash within max_distance (0 = exact only)."""
+    if max_distance <= 0:
+        return 0
+    if max_distance + 1 > MAX_BANDS:
+        raise ValueError(
+            f"OCR cache similarity too low: Hamming distance {max_distance} needs "
+            f"{max_distance + 1} bands (at most {MAX_BANDS} supported)"
+        )
+    return max_distance + 1
+
+
+def _bands(value: int, n_bands: int) -> List[int]:
+    """Split the hash into n_bands contiguous bands (widths differ by at most one bit)."""
+    bands = []
+    shift = 0
+    for i in range(n_bands):
+        width = HASH_BITS // n_bands + (i < HASH_BITS % n_bands)
+        bands.append((value >> shift) & ((1 << width) - 1))
+        shift += width
+    return bands
+
+
+class OcrCache:
+    """
+    Persistent OCR results keyed by image content, OCR language and
+    Tesseract config.
+
+    Lookups try the exact SHA-256 first, then near duplicates by dHash.
+    Candidates are found through max_distance + 1 hash bands (any hash
+    within that Hamming distance shares at least one band exactly), then
+    checked against the similarity threshold. Band rows are kept per band
+    count, and missing ones are filled in when the cache is opened with a
+    new similarity.
+    """
+
+    def __init__(
+        self,
+        path: Path = OCR_CACHE_PATH,
+        similarity: float = OCR_CACHE_SIMILARITY,
+    ) -> None:
+        self.path = Path(path)
+        self.max_distance = int(round((1.0 - similarity) * HASH_BITS))
+        self.n_bands = band_count(self.max_distance)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr (
+                sha256 TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                config TEXT NOT NULL,
+                dhash INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (sha256, lang, config)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_band (
+                n_bands INTEGER NOT NULL,
+                lang TEXT NOT NULL,
+                config TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (n_bands, lang, config, band, value, sha256)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ocr_band_entry ON ocr_band(sha256, lang, config, n_bands)"
+        )
+        self._conn.commit()
+        if self.n_bands:
+            self._fill_bands()
+
+    def _band_rows(self, sha256: str, dhash: int, lang: str, config: str) -> List[Tuple]:
+        return [
+            (self.n_bands, lang, config, i, value, sha256)
+            for i, value in enumerate(_bands(dhash, self.n_bands))
+        ]
+
+    def _fill_bands(self) -> None:
+        """Band the entries stored while the cache was used with another band count."""
+        with self._lock:
+            missing = self._conn.execute(
+                """
+                SELECT sha256, lang, config, dhash FROM ocr WHERE NOT EXISTS (
+                    SELECT 1 FROM ocr_band b WHERE b.n_bands = ? AND b.sha256 = ocr.sha256
+                    AND b.lang = ocr.lang AND b.config = ocr.config)
+                """,
+                (self.n_bands,),
+            ).fetchall()
+            rows = [
+                row
+                for sha256, lang, config, dhash in missing
+                for row in self._band_rows(sha256, _to_unsigned(dhash), lang, config)
+            ]
+            self._conn.executemany("INSERT OR IGNORE INTO ocr_band VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def lookup(
+        self,
+        sha256: str,
+        dhash: int,
+        lang: str,
+        config: str = "",
+    ) -> Optional[Tuple[str, str]]:
+        """Return (text, "exact" | "near") or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM ocr WHERE sha256 = ? AND lang = ? AND config = ?",
+                (sha256, lang, config),
+            ).fetchone()
+            if row is not None:
+                return row[0], "exact"
+
+            if not self.n_bands:
+                return None
+
+            bands = _bands(dhash, self.n_bands)
+            where = " OR ".join("(b.band = ? AND b.value = ?)" for _ in bands)
+            candidates = self._conn.execute(
+                f"""
+                SELECT DISTINCT o.dhash, o.text FROM ocr_band b
+                JOIN ocr o ON o.sha256 = b.sha256 AND o.lang = b.lang AND o.config = b.config
+                WHERE b.n_bands = ? AND b.lang = ? AND b.config = ? AND ({where})
+                """,
+                (self.n_bands, lang, config, *(x for band in enumerate(bands) for x in band)),
+            ).fetchall()
+
+        best: Optional[Tuple[int, str]] = None
+        for cand_hash, text in candidates:
+            distance = bin(_to_unsigned(cand_hash) ^ dhash).count("1")
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, text)
+        return (best[1], "near") if best else None
+
+    def store(self, sha256: str, dhash: int, lang: str, config: str, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr (sha256, lang, config, dhash, text) VALUES (?, ?, ?, ?, ?)",
+                (sha256, lang, config, _to_signed(dhash), text),
+            )
+            # Drop the bands of the old hash for every band count; other
+            # counts are refilled by _fill_bands when next opened with them.
+            self._conn.execute(
+                "DELETE FROM ocr_band WHERE sha256 = ? AND lang = ? AND config = ?",
+                (sha256, lang, config),
+            )
+            if self.n_bands:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO ocr_band VALUES (?, ?, ?, ?, ?, ?)",
+                    self._band_rows(sha256, dhash, lang, config),
+                )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ocr").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -2,13 +2,19 @@ from __future__ import annotations
 
 import io
 import os
+import shlex
+import threading
+import time
+from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional, Sequence, Tuple
 
-import requests
 from dotenv import load_dotenv
-from PIL import Image
-import pytesseract
+from PIL import Image, ImageFilter
+import numpy as np
+
+from src.image_store import get_image_store
+from src.ocr_cache import OcrCache, content_hash, image_dhash
 
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
@@ -16,27 +22,556 @@ ENV_PATH = ROOT_DIR / ".env"
 load_dotenv(ENV_PATH)
 
 TESSERACT_CMD = os.getenv("TESSERACT_CMD")
-if TESSERACT_CMD:
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
 
 OCR_LANG = os.getenv("OCR_LANG", "eng")
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "")
+
+# OCR engine. "tesserocr" runs libtesseract in-process and keeps one
+# initialized engine (language model loaded) per language in each worker
+# process; "pytesseract" starts a tesseract process per image, which
+# reloads the model every time. "auto" uses tesserocr when it is installed.
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+OCR_BACKENDS = ("auto", "tesserocr", "pytesseract")
+
+# Image preprocessing ahead of Tesseract: comma-separated steps out of
+# PREPROCESS_STEPS (always applied in that order), e.g.
+# "gray,rescale,threshold,deskew". Empty (default) OCRs the image as is.
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "")
+# "rescale" scales the image so its text lines are about this many pixels
+# tall (Tesseract is most accurate around 20-40 px) ...
+OCR_TARGET_TEXT_HEIGHT = int(os.getenv("OCR_TARGET_TEXT_HEIGHT", "32"))
+# ... and never lets the longer side exceed this.
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2500"))
+# Resolution recorded on preprocessed images, so Tesseract does not guess it.
+OCR_DPI = 300
+
+PREPROCESS_STEPS = ("gray", "rescale", "threshold", "deskew", "crop")
+
+# Text-presence pre-filter: images that show no sign of text (plain photos)
+# skip Tesseract and get empty OCR text.
+OCR_TEXT_FILTER = os.getenv("OCR_TEXT_FILTER", "false").lower() == "true"
+# An image passes if at least this many text-like blocks sit side by side
+# (one short line of small text scores ~7; photos score ~0).
+OCR_TEXT_MIN_BLOCKS = int(os.getenv("OCR_TEXT_MIN_BLOCKS", "3"))
+# Fraction of filtered-out images OCR'd anyway to measure false skips.
+OCR_TEXT_FILTER_AUDIT = float(os.getenv("OCR_TEXT_FILTER_AUDIT", "0.05"))
+
+# The filter looks at a copy whose longer side is at most this, split into
+# square blocks of _TEXT_BLOCK px; a gradient above _TEXT_EDGE (0-255) is an edge.
+_TEXT_FILTER_SIDE = 800
+_TEXT_BLOCK = 16
+_TEXT_EDGE = 40
+
+# Limits on the rescale factor, so a bad text-height estimate cannot
+# shrink text into noise or blow an image up to gigapixels.
+_MIN_SCALE, _MAX_SCALE = 0.25, 3.0
+# Deskew searches this many degrees either way.
+_MAX_SKEW = 10.0
+
+
+def parse_preprocess_steps(spec: Optional[str]) -> Tuple[str, ...]:
+    """Validate a comma-separated step list; returns the steps in canonical order."""
+    wanted = {s.strip().lower() for s in (spec or "").split(",") if s.strip()}
+    unknown = wanted - set(PREPROCESS_STEPS)
+    if unknown:
+        raise ValueError(
+            f"Unknown OCR preprocessing step(s) {sorted(unknown)}; choose from {PREPROCESS_STEPS}"
+        )
+    return tuple(step for step in PREPROCESS_STEPS if step in wanted)
+
+
+DEFAULT_PREPROCESS = parse_preprocess_steps(OCR_PREPROCESS)
+
+
+def ocr_settings_key(steps: Optional[Sequence[str]] = None, backend: Optional[str] = None) -> str:
+    """
+    Everything besides the language that changes OCR output; OCR cache
+    entries are only reused under the same key. `backend` defaults to the
+    name of this process's OCR backend (tesserocr and pytesseract can
+    return different text for the same image).
+    """
+    steps = DEFAULT_PREPROCESS if steps is None else tuple(steps)
+    key = f"{TESSERACT_CONFIG}|backend={backend or get_ocr_backend().name}"
+    if not steps:
+        return key
+    return f"{key}|preprocess={','.join(steps)}|h={OCR_TARGET_TEXT_HEIGHT}|max={OCR_MAX_SIDE}"
+
+
+def _adaptive_threshold(gray: np.ndarray, window: Optional[int] = None, t: float = 0.15) -> np.ndarray:
+    """
+    Bradley-Roth adaptive threshold: a pixel is ink if it is `t` darker
+    than the mean of the window around it (brighter, on a dark image).
+    Returns a bool array, True for ink.
+    """
+    h, w = gray.shape
+    if window is None:
+        window = max(15, min(h, w) // 16)
+    # Background dominates an image: a dark one is light text on a dark
+    # background, so look for pixels *brighter* than their surroundings.
+    if gray.mean() < 128:
+        gray = 255 - gray
+    # A box blur is the windowed mean, computed in C by Pillow.
+    mean = np.asarray(Image.fromarray(gray).filter(ImageFilter.BoxBlur(window // 2)), dtype=np.float32)
+    return gray < mean * (1.0 - t)
+
+
+def estimate_text_height(gray: np.ndarray) -> Optional[float]:
+    """
+    Median height in pixels of the text lines in a grayscale image, from
+    the runs of inked rows in its horizontal projection profile; None if
+    no line-like structure is found.
+    """
+    h, w = gray.shape
+    # Estimate on a small copy; line heights scale back linearly.
+    scale = min(1.0, 800.0 / max(h, w))
+    if scale < 1.0:
+        small = np.asarray(
+            Image.fromarray(gray).resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BILINEAR)
+        )
+    else:
+        small = gray
+    ink = _adaptive_threshold(small)
+    profile = ink.mean(axis=1)
+    rows = profile > max(0.01, 0.25 * profile.mean())
+
+    heights = []
+    run = 0
+    for inked in rows:
+        if inked:
+            run += 1
+        elif run:
+            heights.append(run)
+            run = 0
+    if run:
+        heights.append(run)
+    heights = [x for x in heights if x >= 3]
+    if not heights:
+        return None
+    return float(np.median(heights)) / scale
+
+
+def _deskew_angle(ink: np.ndarray) -> float:
+    """
+    Rotation (degrees) that makes text lines horizontal: the angle whose
+    horizontal projection profile is sharpest (highest variance).
+    """
+    h, w = ink.shape
+    scale = min(1.0, 600.0 / max(h, w))
+    img = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+    if scale < 1.0:
+        img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.NEAREST)
+
+    def score(angle: float) -> float:
+        rotated = np.asarray(img.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=255))
+        return float(np.var((rotated < 128).sum(axis=1)))
+
+    best = max(np.arange(-_MAX_SKEW, _MAX_SKEW + 0.01, 1.0), key=score)
+    return float(max(np.arange(best - 1.0, best + 1.01, 0.2), key=score))
+
+
+def _ink_bbox(ink: np.ndarray, margin: int = 10) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box (left, top, right, bottom) of the inked rows/columns, with a margin."""
+    rows = np.flatnonzero(ink.mean(axis=1) > 0.005)
+    cols = np.flatnonzero(ink.mean(axis=0) > 0.005)
+    if not len(rows) or not len(cols):
+        return None
+    h, w = ink.shape
+    return (
+        max(0, int(cols[0]) - margin),
+        max(0, int(rows[0]) - margin),
+        min(w, int(cols[-1]) + 1 + margin),
+        min(h, int(rows[-1]) + 1 + margin),
+    )
+
+
+def preprocess_for_ocr(
+    img: Image.Image,
+    steps: Optional[Sequence[str]] = None,
+) -> Image.Image:
+    """
+    Prepare an image for Tesseract. Steps (default: OCR_PREPROCESS):
+      - gray: convert to 8-bit grayscale
+      - rescale: scale so text lines are ~OCR_TARGET_TEXT_HEIGHT px tall,
+                 capped at OCR_MAX_SIDE px; the image is tagged OCR_DPI
+      - threshold: adaptive (local mean) binarization, dark text on light
+      - deskew: rotate by the angle that makes text lines horizontal
+      - crop: keep only the region that contains ink
+    threshold, deskew and crop work on grayscale and imply it.
+    """
+    steps = DEFAULT_PREPROCESS if steps is None else parse_preprocess_steps(",".join(steps))
+    if not steps:
+        return img
+
+    if "gray" in steps or {"threshold", "deskew", "crop"} & set(steps):
+        img = img.convert("L")
+
+    if "rescale" in steps:
+        factor = 1.0
+        height = estimate_text_height(np.asarray(img.convert("L")))
+        if height:
+            factor = min(_MAX_SCALE, max(_MIN_SCALE, OCR_TARGET_TEXT_HEIGHT / height))
+        factor = min(factor, OCR_MAX_SIDE / max(img.size))
+        if abs(factor - 1.0) > 0.05:
+            size = (max(1, round(img.width * factor)), max(1, round(img.height * factor)))
+            img = img.resize(size, Image.LANCZOS if factor < 1 else Image.BICUBIC)
+
+    ink: Optional[np.ndarray] = None
+    if {"threshold", "deskew", "crop"} & set(steps):
+        ink = _adaptive_threshold(np.asarray(img))
+        if "threshold" in steps:
+            img = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+
+    if "deskew" in steps and ink is not None:
+        angle = _deskew_angle(ink)
+        if abs(angle) >= 0.2:
+            img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+            ink_img = Image.fromarray(ink.astype(np.uint8) * 255).rotate(
+                angle, resample=Image.NEAREST, expand=True, fillcolor=0
+            )
+            ink = np.asarray(ink_img) > 127
+
+    if "crop" in steps and ink is not None:
+        box = _ink_bbox(ink)
+        if box is not None and (box[2] - box[0]) * (box[3] - box[1]) < 0.9 * img.width * img.height:
+            img = img.crop(box)
+
+    img.info["dpi"] = (OCR_DPI, OCR_DPI)
+    return img
+
+
+def text_block_score(img: Image.Image) -> int:
+    """
+    Cheap text-presence score: the number of "text-like" blocks that have
+    a text-like neighbour to the left or right, on a downscaled grayscale
+    copy. A block is text-like if it has a moderate density of sharp
+    edges in both directions (character strokes); smooth regions and
+    blurry photo texture have few sharp edges, solid shapes only have them
+    along their outline, and text lines string such blocks together
+    horizontally.
+    """
+    factor = max(img.size) // _TEXT_FILTER_SIDE
+    if factor > 1:
+        img = img.reduce(factor)
+    gray = img.convert("L")
+    if max(gray.size) > _TEXT_FILTER_SIDE:
+        scale = _TEXT_FILTER_SIDE / max(gray.size)
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))), Image.BILINEAR)
+
+    a = np.asarray(gray, dtype=np.int16)
+    if a.shape[0] < 2 or a.shape[1] < 2:
+        return 0
+    gx = np.abs(np.diff(a, axis=1))[:-1, :] > _TEXT_EDGE
+    gy = np.abs(np.diff(a, axis=0))[:, :-1] > _TEXT_EDGE
+    b = _TEXT_BLOCK
+    hb, wb = gx.shape[0] // b, gx.shape[1] // b
+    if not hb or not wb:
+        return 0
+
+    def block_mean(m: np.ndarray) -> np.ndarray:
+        return m[:hb * b, :wb * b].reshape(hb, b, wb, b).mean(axis=(1, 3))
+
+    bx, by = block_mean(gx), block_mean(gy)
+    density = block_mean(gx | gy)
+    text_like = (density > 0.08) & (density < 0.6) & (bx > 0.03) & (by > 0.03)
+
+    pairs = text_like[:, :-1] & text_like[:, 1:]
+    in_line = np.zeros_like(text_like)
+    in_line[:, :-1] |= pairs
+    in_line[:, 1:] |= pairs
+    return int(in_line.sum())
+
+
+def has_text(img: Image.Image, min_blocks: int = OCR_TEXT_MIN_BLOCKS) -> bool:
+    """Whether an image probably contains text (see text_block_score)."""
+    return text_block_score(img) >= min_blocks
+
+
+def _audit_pick(sha256: str, rate: float = OCR_TEXT_FILTER_AUDIT) -> bool:
+    """Deterministic sample of filtered-out images (by content hash) to OCR anyway."""
+    return int(sha256[:8], 16) < rate * 0x100000000
+
+
+def ocr_image_screened(
+    img: Image.Image,
+    sha256: str,
+    lang: Optional[str] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[str, str]:
+    """
+    OCR an image unless the text-presence filter (OCR_TEXT_FILTER) rules
+    it out. Returns (text, source): "miss" for a normal OCR run, "skipped"
+    (empty text) for an image the filter ruled out, and "audit" for a
+    ruled-out image that was sampled for OCR anyway (OCR_TEXT_FILTER_AUDIT)
+    so false skips can be counted. `timings` receives the seconds spent
+    in the filter ("screen") and in ocr_image_timed.
+    """
+    source = "miss"
+    if OCR_TEXT_FILTER:
+        started = time.perf_counter()
+        passed = has_text(img)
+        if timings is not None:
+            timings["screen"] = time.perf_counter() - started
+        if not passed:
+            if not _audit_pick(sha256):
+                return "", "skipped"
+            source = "audit"
+
+    text, spent = ocr_image_timed(img, lang=lang)
+    if timings is not None:
+        timings.update(spent)
+    return text, source
+
+
+class OcrBackend(ABC):
+    """Tesseract text recognition of a prepared PIL image."""
+
+    name = ""
 
-SESSION = requests.Session()
+    @abstractmethod
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        """Recognized text of img in language(s) lang."""
+
+    def warm_up(self, lang: str) -> None:
+        """Load whatever `lang` needs ahead of the first image."""
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractBackend(OcrBackend):
+    """The tesseract CLI through pytesseract: one process per image."""
+
+    name = "pytesseract"
+
+    def __init__(self, config: str = TESSERACT_CONFIG) -> None:
+        import pytesseract
+
+        if TESSERACT_CMD:
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        self._pytesseract = pytesseract
+        self.config = config
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        return self._pytesseract.image_to_string(img, lang=lang, config=self.config)
+
+
+def tesserocr_options(config: str = TESSERACT_CONFIG) -> Dict[str, Any]:
+    """
+    Translate a tesseract command-line config (the TESSERACT_CONFIG passed
+    to pytesseract) into tesserocr.PyTessBaseAPI arguments. Supports
+    --psm N, --oem N, --tessdata-dir DIR and -c name=value.
+    """
+    options: Dict[str, Any] = {}
+    variables: Dict[str, str] = {}
+    args = iter(shlex.split(config))
+    for arg in args:
+        if arg in ("--psm", "--oem", "--tessdata-dir", "-c"):
+            value = next(args, None)
+            if value is None:
+                raise ValueError(f"TESSERACT_CONFIG: {arg} needs a value")
+        elif arg.startswith("-c"):
+            arg, value = "-c", arg[2:]
+        else:
+            raise ValueError(f"TESSERACT_CONFIG option {arg!r} is not supported by the tesserocr backend")
+
+        if arg == "--psm":
+            options["psm"] = int(value)
+        elif arg == "--oem":
+            options["oem"] = int(value)
+        elif arg == "--tessdata-dir":
+            options["path"] = value
+        else:
+            name, sep, val = value.partition("=")
+            if not sep:
+                raise ValueError(f"TESSERACT_CONFIG: expected -c name=value, got {value!r}")
+            variables[name] = val
+    if variables:
+        options["variables"] = variables
+    return options
+
+
+class TesserocrBackend(OcrBackend):
+    """
+    libtesseract in-process through tesserocr. The engine for a language
+    is initialized once (loading its traineddata) and reused for every
+    later image; images are recognized one at a time per process.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, config: str = TESSERACT_CONFIG) -> None:
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        self._options = tesserocr_options(config)
+        self._engines: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _engine(self, lang: str) -> Any:
+        api = self._engines.get(lang)
+        if api is None:
+            api = self._engines[lang] = self._tesserocr.PyTessBaseAPI(lang=lang, **self._options)
+        return api
+
+    def warm_up(self, lang: str) -> None:
+        with self._lock:
+            self._engine(lang)
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        with self._lock:
+            api = self._engine(lang)
+            api.SetImage(img)
+            dpi = img.info.get("dpi")
+            if dpi:
+                api.SetSourceResolution(int(dpi[0]))
+            try:
+                return api.GetUTF8Text()
+            finally:
+                api.Clear()
+
+    def close(self) -> None:
+        with self._lock:
+            for api in self._engines.values():
+                api.End()
+            self._engines.clear()
+
+
+def create_ocr_backend(name: str = OCR_BACKEND) -> OcrBackend:
+    """
+    Backend by name (see OCR_BACKENDS); "auto" is tesserocr if it can be
+    imported, else pytesseract.
+    """
+    name = name.lower()
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR_BACKEND {name!r}; choose from {OCR_BACKENDS}")
+    if name in ("auto", "tesserocr"):
+        try:
+            return TesserocrBackend()
+        except ImportError:
+            if name == "tesserocr":
+                raise
+    return PytesseractBackend()
+
+
+_backend: Optional[OcrBackend] = None
+_backend_pid: Optional[int] = None
+
+
+def get_ocr_backend() -> OcrBackend:
+    """Per-process OCR backend (engines are not shared across fork)."""
+    global _backend, _backend_pid
+    if _backend is None or _backend_pid != os.getpid():
+        _backend = create_ocr_backend()
+        _backend_pid = os.getpid()
+    return _backend
+
+
+def warm_up_ocr(lang: Optional[str] = None) -> None:
+    """Create this process's backend and load `lang` (e.g. as a pool initializer)."""
+    get_ocr_backend().warm_up(lang or OCR_LANG)
+
+
+def _tesseract(img: Image.Image, lang: str) -> str:
+    return get_ocr_backend().image_to_string(img, lang).strip()
+
+
+def ocr_image_timed(
+    img: Image.Image,
+    lang: Optional[str] = None,
+    steps: Optional[Sequence[str]] = None,
+) -> Tuple[str, Dict[str, float]]:
+    """
+    Preprocess (see preprocess_for_ocr) and OCR a PIL image.
+    Returns (text, {"preprocess": seconds, "ocr": seconds}).
+    """
+    lang = lang or OCR_LANG
+    started = time.perf_counter()
+    img = preprocess_for_ocr(img, steps)
+    prepared = time.perf_counter()
+    text = _tesseract(img, lang)
+    return text, {"preprocess": prepared - started, "ocr": time.perf_counter() - prepared}
 
 
 def _ocr_image(img: Image.Image, lang: Optional[str] = None) -> str:
-    """Run Tesseract OCR on a PIL image."""
+    """Run Tesseract OCR on a PIL image (after the configured preprocessing)."""
+    return ocr_image_timed(img, lang=lang)[0]
+
+
+def fetch_image_bytes(image_url: str, timeout: int = 30) -> bytes:
+    """
+    Load a remote image (Twitter, etc.) into memory through the shared
+    ImageStore, which downloads each URL only once and keeps it on disk for
+    the download and embedding stages.
+    """
+    return get_image_store().read_bytes(image_url, timeout=timeout)
+
+
+def ocr_image_bytes(data: bytes, lang: Optional[str] = None) -> str:
+    """OCR for an encoded image already held in memory."""
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    return _ocr_image(img, lang=lang)
+
+
+_cache: Optional[OcrCache] = None
+_cache_pid: Optional[int] = None
+
+
+def get_ocr_cache() -> OcrCache:
+    """Per-process OCR cache handle (SQLite connections must not cross fork)."""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = OcrCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+
+def ocr_image_bytes_cached(
+    data: bytes,
+    lang: Optional[str] = None,
+    cache: Optional[OcrCache] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[str, str]:
+    """
+    OCR an in-memory image, reusing cached text for identical or
+    near-duplicate images (same OCR_LANG, OCR backend, TESSERACT_CONFIG
+    and preprocessing, see ocr_settings_key).
+
+    Returns (text, source) where source is "exact", "near", or one of the
+    ocr_image_screened sources on a cache miss ("miss", "skipped",
+    "audit"). Images skipped by the text filter are not cached.
+    If `timings` is given, the seconds spent decoding, screening,
+    preprocessing and in Tesseract are recorded into it (all but decoding
+    only on a miss).
+    """
     lang = lang or OCR_LANG
-    text = pytesseract.image_to_string(img, lang=lang)
-    return text.strip()
+    if cache is None:
+        cache = get_ocr_cache()
+    settings = ocr_settings_key()
+
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    sha256 = content_hash(data)
+    dhash = image_dhash(img)
+    if timings is not None:
+        timings["decode"] = time.perf_counter() - started
+
+    hit = cache.lookup(sha256, dhash, lang, settings)
+    if hit is not None:
+        text, source = hit
+        if source == "near":
+            # Remember this exact encoding too, so the next lookup is exact.
+            cache.store(sha256, dhash, lang, settings, text)
+        return text, source
+
+    text, source = ocr_image_screened(img, sha256, lang=lang, timings=timings)
+    if source != "skipped":
+        cache.store(sha256, dhash, lang, settings, text)
+    return text, source
 
 
 def ocr_image_url(image_url: str, lang: Optional[str] = None) -> str:
     """OCR for a remote image URL (Twitter, etc.)."""
-    resp = SESSION.get(image_url, timeout=30)
-    resp.raise_for_status()
-    img = Image.open(io.BytesIO(resp.content)).convert("RGB")
-    return _ocr_image(img, lang=lang)
+    return ocr_image_bytes(fetch_image_bytes(image_url), lang=lang)
 
 
 def ocr_local_image(image_path: str | Path, lang: Optional[str] = None) -> str:
@@ -0,0 +1,514 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .embedding_store import open_store
+from .image_embeddings import CLIP_MODEL, IMAGE_EMBED_DIR, dataset_images
+from .image_embeddings import INPUT_PATH as IMAGE_INPUT_PATH
+from .records import read_records
+from .text_embeddings import (
+    ARABERT_MODEL,
+    TEXT_EMBED_BATCH_SIZE,
+    TEXT_EMBED_BATCH_TOKENS,
+    TEXT_EMBED_DIR,
+    TEXT_MAX_LENGTH,
+    length_buckets,
+)
+from .text_embeddings import INPUT_PATH as TEXT_INPUT_PATH
+from .text_preprocessing import combine_text, text_key
+
+
+ONNX_DIR = Path(os.getenv("ONNX_DIR", "models/onnx"))
+TEXT_ONNX_DIR = ONNX_DIR / "arabert"
+IMAGE_ONNX_DIR = ONNX_DIR / "clip_image"
+# ONNX Runtime intra-op threads per session (0 = one per physical core).
+ORT_THREADS = int(os.getenv("ORT_THREADS", "0"))
+# "int8" (dynamically quantized) or "fp32" graphs for the ONNX encoders.
+ONNX_PRECISION = os.getenv("ONNX_PRECISION", "int8")
+ONNX_OPSET = 17
+
+# Parity thresholds against the fp32 PyTorch embeddings: mean cosine
+# similarity and nearest-neighbour agreement within the sample.
+PARITY_MIN_COSINE = float(os.getenv("PARITY_MIN_COSINE", "0.98"))
+PARITY_MIN_NN_AGREEMENT = float(os.getenv("PARITY_MIN_NN_AGREEMENT", "0.9"))
+
+_MODEL_FILES = {"fp32": "model.onnx", "int8": "model.int8.onnx"}
+
+
+# ---------------------------------------------------------------------------
+# Export + quantization
+# ---------------------------------------------------------------------------
+
+def quantize_int8(fp32_path: Path, int8_path: Path) -> None:
+    """
+    Dynamic int8 quantization: MatMul/Gemm weights are stored as int8 and
+    activations are quantized on the fly, so no calibration data is needed.
+    Convolutions (CLIP's patch embedding) stay fp32; ConvInteger is often
+    slower than fp32 Conv on CPU.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        str(fp32_path), str(int8_path),
+        weight_type=QuantType.QInt8,
+        op_types_to_quantize=["MatMul", "Gemm"],
+    )
+
+
+def _write_config(out_dir: Path, config: Dict[str, Any]) -> None:
+    tmp = out_dir / "config.json.part"
+    tmp.write_text(json.dumps(config, indent=2), encoding="utf-8")
+    os.replace(tmp, out_dir / "config.json")
+
+
+def _report_sizes(out_dir: Path) -> None:
+    for precision, name in _MODEL_FILES.items():
+        path = out_dir / name
+        if path.exists():
+            print(f"  {precision}: {path} ({path.stat().st_size / 1e6:.0f} MB)")
+
+
+def export_text_encoder(
+    out_dir: Path = TEXT_ONNX_DIR,
+    model_name: str = ARABERT_MODEL,
+    max_length: int = TEXT_MAX_LENGTH,
+) -> None:
+    """
+    Export AraBERT's [CLS] embedding (what text_embeddings computes) to
+    ONNX with dynamic batch and sequence axes, save its tokenizer next to
+    it, and write an int8-quantized copy.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    class ClsEmbedding(torch.nn.Module):
+        def __init__(self, bert: Any) -> None:
+            super().__init__()
+            self.bert = bert
+
+        def forward(self, input_ids: Any, attention_mask: Any, token_type_ids: Any) -> Any:
+            out = self.bert(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+            return out.last_hidden_state[:, 0, :]
+
+    sample = tokenizer(["نص تجريبي قصير", "نص تجريبي أطول قليلا من الأول"], padding=True, return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    fp32_path = out_dir / _MODEL_FILES["fp32"]
+    with torch.inference_mode():
+        torch.onnx.export(
+            ClsEmbedding(model),
+            tuple(sample[name] for name in names),
+            str(fp32_path),
+            input_names=names,
+            output_names=["embedding"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in names}, "embedding": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(str(out_dir))
+    quantize_int8(fp32_path, out_dir / _MODEL_FILES["int8"])
+    _write_config(out_dir, {
+        "source_model": model_name,
+        "store_model": f"arabert:{model_name}:max{max_length}",
+        "max_length": max_length,
+        "dim": int(model.config.hidden_size),
+    })
+    print(f"Exported {model_name} text encoder to {out_dir}")
+    _report_sizes(out_dir)
+
+
+def export_image_encoder(out_dir: Path = IMAGE_ONNX_DIR, model_name: str = CLIP_MODEL) -> None:
+    """
+    Export CLIP's image tower (with the L2 normalization image_embeddings
+    applies) to ONNX with a dynamic batch axis, plus an int8 copy. The
+    preprocessing constants go to config.json, so inference needs neither
+    torch nor torchvision.
+    """
+    import clip
+    import torch
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model, _ = clip.load(model_name, device="cpu")
+    model.eval()
+    resolution = int(model.visual.input_resolution)
+
+    class ImageEmbedding(torch.nn.Module):
+        def __init__(self, clip_model: Any) -> None:
+            super().__init__()
+            self.clip_model = clip_model
+
+        def forward(self, pixel_values: Any) -> Any:
+            features = self.clip_model.encode_image(pixel_values)
+            return features / features.norm(dim=-1, keepdim=True)
+
+    fp32_path = out_dir / _MODEL_FILES["fp32"]
+    with torch.inference_mode():
+        torch.onnx.export(
+            ImageEmbedding(model),
+            (torch.randn(2, 3, resolution, resolution),),
+            str(fp32_path),
+            input_names=["pixel_values"],
+            output_names=["embedding"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embedding": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+        )
+    quantize_int8(fp32_path, out_dir / _MODEL_FILES["int8"])
+    _write_config(out_dir, {
+        "source_model": model_name,
+        "store_model": f"clip:{model_name}",
+        "resolution": resolution,
+        # CLIP's normalization constants (clip/clip.py _transform)
+        "mean": [0.48145466, 0.4578275, 0.40821073],
+        "std": [0.26862954, 0.26130258, 0.27577711],
+        "dim": int(model.visual.output_dim),
+    })
+    print(f"Exported CLIP {model_name} image encoder to {out_dir}")
+    _report_sizes(out_dir)
+
+
+# ---------------------------------------------------------------------------
+# ONNX Runtime encoders
+# ---------------------------------------------------------------------------
+
+def create_session(path: Path, threads: int = ORT_THREADS) -> Any:
+    """CPU InferenceSession with full graph optimizations and `threads` intra-op threads."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.inter_op_num_threads = 1
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+
+class _OnnxEncoder:
+    def __init__(self, model_dir: Path, precision: str, threads: int) -> None:
+        if precision not in _MODEL_FILES:
+            raise ValueError(f"Unknown ONNX precision {precision!r}; choose from {tuple(_MODEL_FILES)}")
+        path = Path(model_dir) / _MODEL_FILES[precision]
+        if not path.exists():
+            raise FileNotFoundError(f"{path} not found; run `python3 -m src.onnx_encoders export` first")
+        self.model_dir = Path(model_dir)
+        self.precision = precision
+        self.config = json.loads((self.model_dir / "config.json").read_text(encoding="utf-8"))
+        self.dim = int(self.config["dim"])
+        self.session = create_session(path, threads)
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def store_model(self) -> str:
+        """Model identity for an EmbeddingStore; int8 vectors differ from the fp32 ones."""
+        return f"{self.config['store_model']}:onnx-{self.precision}"
+
+
+class OnnxTextEncoder(_OnnxEncoder):
+    """
+    Exported AraBERT [CLS] encoder on ONNX Runtime, with the same
+    length-bucketed, dynamically padded batching as ArabertTextEncoder.
+    Texts must already be preprocessed (text_preprocessing).
+    """
+
+    def __init__(
+        self,
+        model_dir: Path = TEXT_ONNX_DIR,
+        precision: str = ONNX_PRECISION,
+        threads: int = ORT_THREADS,
+    ) -> None:
+        from transformers import AutoTokenizer
+
+        super().__init__(model_dir, precision, threads)
+        self.max_length = int(self.config["max_length"])
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        batch_size: int = TEXT_EMBED_BATCH_SIZE,
+        batch_tokens: int = TEXT_EMBED_BATCH_TOKENS,
+    ) -> np.ndarray:
+        """float32 vectors of texts, in input order."""
+        tokens = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for batch in length_buckets([len(x) for x in tokens["input_ids"]], batch_size, batch_tokens):
+            features = {name: [values[i] for i in batch] for name, values in tokens.items()}
+            padded = self.tokenizer.pad(features, padding=True, return_tensors="np")
+            feeds = {name: np.asarray(padded[name], dtype=np.int64) for name in self._inputs}
+            out[batch] = self.session.run(None, feeds)[0]
+        return out
+
+
+def clip_pixels(img: Image.Image, resolution: int, mean: Sequence[float], std: Sequence[float]) -> np.ndarray:
+    """
+    CLIP preprocessing without torchvision, matching clip's _transform:
+    bicubic resize of the short side to `resolution`, center crop, RGB,
+    scale to [0, 1], normalize. Returns a (3, resolution, resolution) array.
+    """
+    w, h = img.size
+    if w <= h:
+        size = (resolution, int(resolution * h / w))
+    else:
+        size = (int(resolution * w / h), resolution)
+    img = img.convert("RGB").resize(size, Image.BICUBIC)
+    left = int(round((size[0] - resolution) / 2.0))
+    top = int(round((size[1] - resolution) / 2.0))
+    img = img.crop((left, top, left + resolution, top + resolution))
+    pixels = np.asarray(img, dtype=np.float32) / 255.0
+    pixels = (pixels - np.asarray(mean, dtype=np.float32)) / np.asarray(std, dtype=np.float32)
+    return pixels.transpose(2, 0, 1)
+
+
+class OnnxImageEncoder(_OnnxEncoder):
+    """Exported CLIP image encoder on ONNX Runtime; returns L2-normalized vectors."""
+
+    def __init__(
+        self,
+        model_dir: Path = IMAGE_ONNX_DIR,
+        precision: str = ONNX_PRECISION,
+        threads: int = ORT_THREADS,
+    ) -> None:
+        super().__init__(model_dir, precision, threads)
+        self.resolution = int(self.config["resolution"])
+
+    def preprocess(self, img: Image.Image) -> np.ndarray:
+        return clip_pixels(img, self.resolution, self.config["mean"], self.config["std"])
+
+    def encode(self, images: Sequence[Image.Image], batch_size: int = 32) -> np.ndarray:
+        """float32 vectors of PIL images, in input order."""
+        out = np.zeros((len(images), self.dim), dtype=np.float32)
+        for start in range(0, len(images), batch_size):
+            batch = np.stack([self.preprocess(img) for img in images[start:start + batch_size]])
+            out[start:start + len(batch)] = self.session.run(None, {"pixel_values": batch})[0]
+        return out
+
+
+# ---------------------------------------------------------------------------
+# Parity check
+# ---------------------------------------------------------------------------
+
+def parity_metrics(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """
+    How closely candidate vectors reproduce the reference ones: row-wise
+    cosine similarity (mean, 1st percentile, min), the largest absolute
+    difference, and nearest-neighbour agreement (the share of items whose
+    most similar other item is the same under both).
+    """
+    ref = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    cand = candidate / np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+    cosine = (ref * cand).sum(axis=1)
+    metrics = {
+        "n": float(len(ref)),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_p01": float(np.percentile(cosine, 1)),
+        "cosine_min": float(cosine.min()),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+        "nn_agreement": float("nan"),
+    }
+    if len(ref) >= 3:
+        ref_sim, cand_sim = ref @ ref.T, cand @ cand.T
+        np.fill_diagonal(ref_sim, -np.inf)
+        np.fill_diagonal(cand_sim, -np.inf)
+        metrics["nn_agreement"] = float((ref_sim.argmax(axis=1) == cand_sim.argmax(axis=1)).mean())
+    return metrics
+
+
+def _parity_line(name: str, m: Dict[str, float], min_cosine: float, min_nn: float) -> Tuple[str, bool]:
+    ok = m["cosine_mean"] >= min_cosine and (np.isnan(m["nn_agreement"]) or m["nn_agreement"] >= min_nn)
+    return (
+        f"  {name:<18} n={int(m['n']):5d}  cos mean {m['cosine_mean']:.5f}  p01 {m['cosine_p01']:.5f}  "
+        f"min {m['cosine_min']:.5f}  max|d| {m['max_abs_diff']:.4f}  NN agree {m['nn_agreement']:.3f}  "
+        f"{'PASS' if ok else 'FAIL'}"
+    ), ok
+
+
+def _sample_rows(input_path: Path, n: int) -> List[Dict[str, Any]]:
+    return [row for _, row in zip(range(n), read_records(input_path))]
+
+
+def parity_check(
+    text_input: Path = TEXT_INPUT_PATH,
+    image_input: Path = IMAGE_INPUT_PATH,
+    n: int = 200,
+    precisions: Sequence[str] = ("fp32", "int8"),
+    min_cosine: float = PARITY_MIN_COSINE,
+    min_nn: float = PARITY_MIN_NN_AGREEMENT,
+) -> bool:
+    """
+    Compare ONNX embeddings of the texts / images of the first `n` rows of
+    the datasets against the fp32 PyTorch embeddings the embedding stages
+    stored for them (what the notebook trains on). Items missing from the
+    stores are skipped. Returns True if every checked encoder passes the
+    thresholds.
+    """
+    passed = True
+
+    if (TEXT_EMBED_DIR / "meta.json").exists() and (TEXT_ONNX_DIR / "config.json").exists():
+        store = open_store(TEXT_EMBED_DIR)
+        texts = list(dict.fromkeys(combine_text(row) for row in _sample_rows(text_input, n)))
+        texts = [t for t in texts if text_key(t) in store]
+        if texts:
+            reference = store.get([text_key(t) for t in texts])
+            print(f"Text parity vs {store.root} ({store.model}, {store.dtype.name}):")
+            for precision in precisions:
+                got = OnnxTextEncoder(precision=precision).encode(texts)
+                line, ok = _parity_line(f"arabert onnx-{precision}", parity_metrics(reference, got), min_cosine, min_nn)
+                print(line)
+                passed &= ok
+    else:
+        print(f"Text parity skipped: needs {TEXT_EMBED_DIR} (embed_texts stage) and {TEXT_ONNX_DIR} (export)")
+
+    if (IMAGE_EMBED_DIR / "meta.json").exists() and (IMAGE_ONNX_DIR / "config.json").exists():
+        store = open_store(IMAGE_EMBED_DIR)
+        rows = _sample_rows(image_input, n)
+        items = [(sha, path) for sha, path in dict(dataset_images(rows)).items() if sha in store]
+        if items:
+            reference = store.get([sha for sha, _ in items])
+            images = [Image.open(path).convert("RGB") for _, path in items]
+            print(f"Image parity vs {store.root} ({store.model}, {store.dtype.name}):")
+            for precision in precisions:
+                got = OnnxImageEncoder(precision=precision).encode(images)
+                line, ok = _parity_line(f"clip onnx-{precision}", parity_metrics(reference, got), min_cosine, min_nn)
+                print(line)
+                passed &= ok
+    else:
+        print(f"Image parity skipped: needs {IMAGE_EMBED_DIR} (embed_images stage) and {IMAGE_ONNX_DIR} (export)")
+
+    return passed
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+def _latency_ms(fn: Callable[[], Any], runs: int) -> Tuple[float, float]:
+    """p50 and p99 wall time of fn in milliseconds, after one warm-up call."""
+    fn()
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1e3)
+    times.sort()
+    return times[len(times) // 2], times[min(len(times) - 1, int(0.99 * len(times)))]
+
+
+def _throughput(fn: Callable[[], Any], n_items: int) -> float:
+    started = time.perf_counter()
+    fn()
+    return n_items / (time.perf_counter() - started)
+
+
+def _text_variants() -> List[Tuple[str, Callable[[Sequence[str]], np.ndarray]]]:
+    variants: List[Tuple[str, Callable[[Sequence[str]], np.ndarray]]] = []
+    try:
+        from .text_embeddings import ArabertTextEncoder
+
+        torch_encoder = ArabertTextEncoder()
+        variants.append(("torch fp32", torch_encoder.encode))
+    except ImportError as e:
+        print(f"  (torch text encoder unavailable: {e})")
+    for precision in _MODEL_FILES:
+        variants.append((f"onnx {precision}", OnnxTextEncoder(precision=precision).encode))
+    return variants
+
+
+def _image_variants() -> List[Tuple[str, Callable[[Sequence[Image.Image]], np.ndarray]]]:
+    variants: List[Tuple[str, Callable[[Sequence[Image.Image]], np.ndarray]]] = []
+    try:
+        import torch
+
+        from .image_embeddings import ClipImageEncoder
+
+        torch_encoder = ClipImageEncoder()
+        variants.append((
+            "torch fp32",
+            lambda images: torch_encoder.encode(torch.stack([torch_encoder.preprocess(img) for img in images])),
+        ))
+    except ImportError as e:
+        print(f"  (torch image encoder unavailable: {e})")
+    for precision in _MODEL_FILES:
+        variants.append((f"onnx {precision}", OnnxImageEncoder(precision=precision).encode))
+    return variants
+
+
+def benchmark(
+    text_input: Path = TEXT_INPUT_PATH,
+    image_input: Path = IMAGE_INPUT_PATH,
+    n: int = 200,
+    runs: int = 50,
+) -> None:
+    """
+    Per-item latency (p50/p99 of single-item calls, as when scoring one new
+    tweet) and batch throughput of the PyTorch fp32 encoders and the ONNX
+    fp32 / int8 ones, on the texts / images of the first `n` dataset rows.
+    """
+    texts = [combine_text(row) for row in _sample_rows(text_input, n)] if text_input.exists() else []
+    images = []
+    if image_input.exists():
+        rows = _sample_rows(image_input, n)
+        images = [Image.open(path).convert("RGB") for _, path in dict(dataset_images(rows)).items()]
+    print(f"Benchmark on {len(texts)} texts and {len(images)} images "
+          f"(ORT_THREADS={ORT_THREADS or 'default'}, {os.cpu_count()} CPUs)")
+
+    for kind, items, variants in (
+        ("text", texts, _text_variants() if (TEXT_ONNX_DIR / "config.json").exists() else []),
+        ("image", images, _image_variants() if (IMAGE_ONNX_DIR / "config.json").exists() else []),
+    ):
+        if not items or not variants:
+            print(f"{kind}: skipped (no inputs or no exported model)")
+            continue
+        print(f"{kind}:")
+        base = None
+        for name, encode in variants:
+            p50, p99 = _latency_ms(lambda: encode(items[:1]), runs)
+            rate = _throughput(lambda: encode(items), len(items))
+            base = base or rate
+            print(f"  {name:<11} latency p50 {p50:7.1f} ms  p99 {p99:7.1f} ms   "
+                  f"throughput {rate:7.1f} items/s  x{rate / base:.1f}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export, check and benchmark the ONNX Runtime CPU encoders.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export AraBERT and CLIP to ONNX (fp32 + int8)")
+    export.add_argument("--only", choices=("text", "image"), help="export just one encoder")
+    commands = {
+        "parity": sub.add_parser("parity", help="compare ONNX embeddings with the stored fp32 ones"),
+        "bench": sub.add_parser("bench", help="latency / throughput of torch fp32 vs ONNX fp32 / int8"),
+    }
+    for cmd in commands.values():
+        cmd.add_argument("--texts", type=Path, default=TEXT_INPUT_PATH, help="dataset with text / OCR text")
+        cmd.add_argument("--images", type=Path, default=IMAGE_INPUT_PATH, help="dataset with image_paths")
+        cmd.add_argument("--n", type=int, default=200, help="dataset rows to use")
+    commands["bench"].add_argument("--runs", type=int, default=50, help="single-item calls for latency")
+    args = parser.parse_args(argv or [])
+
+    if args.command == "export":
+        if args.only in (None, "text"):
+            export_text_encoder()
+        if args.only in (None, "image"):
+            export_image_encoder()
+    elif args.command == "parity":
+        if not parity_check(args.texts, args.images, args.n):
+            sys.exit(1)
+    else:
+        benchmark(args.texts, args.images, args.n, args.runs)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .records import read_records, write_records
+
+
+RAW_STORE_PATH = Path(os.getenv("RAW_STORE_PATH", "raw_tweets.sqlite"))
+
+# Field that points a dataset row at the store holding its raw tweet.
+RAW_REF_FIELD = "raw_store"
+
+_COMMIT_EVERY = 500
+
+
+class RawTweetStore:
+    """
+    SQLite table of raw tweet payloads (zlib-compressed JSON) keyed by
+    tweet_id.
+
+    Dataset rows keep only the selected fields plus a reference to this
+    store, instead of a full copy of the raw tweet that every downstream
+    stage would re-serialize; raw_payload(row) loads it back on demand.
+    """
+
+    def __init__(self, path: Path = RAW_STORE_PATH) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS raw_tweets (
+                tweet_id TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                stored_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    def put(self, tweet_id: Any, tweet: Dict[str, Any]) -> None:
+        """Store (or replace) one raw tweet; committed in batches and by flush()."""
+        payload = zlib.compress(json.dumps(tweet, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO raw_tweets (tweet_id, payload, stored_at) VALUES (?, ?, ?)",
+                (str(tweet_id), payload, time.time()),
+            )
+            self._pending += 1
+            if self._pending >= _COMMIT_EVERY:
+                self._conn.commit()
+                self._pending = 0
+
+    def get(self, tweet_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM raw_tweets WHERE tweet_id = ?", (str(tweet_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def __contains__(self, tweet_id: Any) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM raw_tweets WHERE tweet_id = ?", (str(tweet_id),)
+            ).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM raw_tweets").fetchone()[0]
+
+    def flush(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+_open_stores: Dict[str, RawTweetStore] = {}
+_open_lock = threading.Lock()
+
+
+def _store_for(path: str) -> RawTweetStore:
+    with _open_lock:
+        store = _open_stores.get(path)
+        if store is None:
+            store = _open_stores[path] = RawTweetStore(Path(path))
+        return store
+
+
+def raw_payload(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The raw tweet behind a dataset row, loaded lazily from the store the
+    row references (stores are opened once per process). Rows written
+    before the side store existed still carry it inline under "raw".
+    Returns None if the row has neither or the store lacks the tweet.
+    """
+    if "raw" in row:
+        return row["raw"]
+    ref = row.get(RAW_REF_FIELD)
+    if not ref or row.get("tweet_id") is None:
+        return None
+    if not Path(ref).exists():
+        return None
+    return _store_for(ref).get(row["tweet_id"])
+
+
+def externalize_raw(
+    input_path: Path,
+    output_path: Path,
+    store_path: Path = RAW_STORE_PATH,
+) -> Tuple[int, int]:
+    """
+    Move the inline "raw" payloads of an existing dataset into the side
+    store and rewrite the rows with a reference instead.
+    Returns (rows written, payloads moved).
+    """
+    store = RawTweetStore(store_path)
+    moved = 0
+
+    def rows() -> Iterable[Dict[str, Any]]:
+        nonlocal moved
+        for row in read_records(input_path):
+            raw = row.pop("raw", None)
+            if raw is not None and row.get("tweet_id") is not None:
+                store.put(row["tweet_id"], raw)
+                row[RAW_REF_FIELD] = str(store_path)
+                moved += 1
+            elif raw is not None:
+                row["raw"] = raw
+            yield row
+
+    try:
+        n = write_records(output_path, rows())
+    finally:
+        store.close()
+    return n, moved
+
+
+def _load_seconds(path: Path) -> float:
+    started = time.perf_counter()
+    for _ in read_records(path):
+        pass
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage:")
+        print("  python3 -m src.raw_store <dataset.jsonl> [raw store, default raw_tweets.sqlite]")
+        print("Moves inline raw tweets of a dataset into the side store, in place,")
+        print("and reports the file size and load time before and after.")
+        sys.exit(1)
+
+    dataset = Path(sys.argv[1])
+    store_path = Path(sys.argv[2]) if len(sys.argv) == 3 else RAW_STORE_PATH
+    size_before, load_before = dataset.stat().st_size, _load_seconds(dataset)
+    n, moved = externalize_raw(dataset, dataset, store_path)
+    size_after, load_after = dataset.stat().st_size, _load_seconds(dataset)
+
+    print(f"{dataset}: {n} rows, {moved} raw payloads moved to {store_path}")
+    print(f"  size: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB "
+          f"({100 * (1 - size_after / max(1, size_before)):.0f}% smaller)")
+    print(f"  load: {load_before:.2f}s -> {load_after:.2f}s")
+    print(f"  store: {store_path.stat().st_size / 1e6:.1f} MB")
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TextIO
+
+# Intermediate datasets are JSON Lines (one tweet per line) unless a path
+# ends in .json, in which case the legacy JSON-array format is used.
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+
+_READ_CHUNK = 1 << 20
+
+
+def is_jsonl(path: Path) -> bool:
+    return Path(path).suffix.lower() in JSONL_SUFFIXES
+
+
+def _iter_json_array(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """
+    Incrementally decode a top-level JSON array, one element at a time, so
+    legacy .json files do not have to be loaded whole.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        chunk = f.read(_READ_CHUNK)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    while True:
+        # Skip whitespace and separators.
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or not fill():
+                break
+
+        if pos >= len(buf):
+            if not started:
+                return
+            raise ValueError("Unexpected end of JSON array")
+
+        ch = buf[pos]
+        if not started:
+            if ch != "[":
+                raise ValueError("Expected a JSON array of records")
+            started = True
+            pos += 1
+            continue
+        if ch == "]":
+            return
+
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError:
+                if eof or not fill():
+                    raise
+        pos = end
+        yield item
+
+
+def read_records(path: Path, start: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Yield records from a .jsonl file or a legacy .json array, one at a time.
+    A JSON Lines file can be read from byte offset `start` (a line start).
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Input file not found: {path}")
+
+    with path.open(encoding="utf-8") as f:
+        if is_jsonl(path):
+            if start:
+                f.seek(start)
+            for lineno, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Failed to parse JSON from {path}:{lineno}: {e}") from e
+        else:
+            try:
+                yield from _iter_json_array(f)
+            except ValueError as e:
+                raise ValueError(f"Failed to parse JSON from {path}: {e}") from e
+
+
+def count_records(path: Path) -> int:
+    """Number of records in path (cheap line count for JSON Lines)."""
+    path = Path(path)
+    if is_jsonl(path):
+        with path.open("rb") as f:
+            return sum(1 for line in f if line.strip())
+    return sum(1 for _ in read_records(path))
+
+
+def write_records(path: Path, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Stream records to path (.jsonl, or a legacy indented .json array) and
+    return how many were written. Output goes to a temp file that replaces
+    path only once complete, so reading and writing the same file is safe
+    and a crash never leaves a truncated dataset behind.
+    """
+    path = Path(path)
+    jsonl = is_jsonl(path)
+    count = 0
+
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            if jsonl:
+                for rec in records:
+                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    count += 1
+            else:
+                # Same bytes as json.dumps(list, indent=2), written item by item.
+                for rec in records:
+                    out.write("[\n" if count == 0 else ",\n")
+                    # json.dumps escapes newlines inside strings, so every "\n"
+                    # here is structural and safe to indent after.
+                    item = json.dumps(rec, ensure_ascii=False, indent=2)
+                    out.write("  " + item.replace("\n", "\n  "))
+                    count += 1
+                out.write("\n]" if count else "[]")
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+    return count
+
+
+def repair_jsonl_tail(path: Path) -> int:
+    """
+    Drop a torn last line (no trailing newline) left in an append-only
+    JSON Lines file by a crash. Returns the number of bytes removed.
+    """
+    path = Path(path)
+    if not path.exists():
+        return 0
+    with path.open("rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return 0
+        end = size
+        while end > 0:
+            start = max(0, end - _READ_CHUNK)
+            f.seek(start)
+            chunk = f.read(end - start)
+            nl = chunk.rfind(b"\n")
+            if nl >= 0:
+                keep = start + nl + 1
+                break
+            end = start
+        else:
+            keep = 0
+        f.truncate(keep)
+        return size - keep
+
+
+def tap_records(
+    records: Iterable[Dict[str, Any]],
+    callback: Optional[Callable[[Dict[str, Any]], None]],
+) -> Iterator[Dict[str, Any]]:
+    """
+    Pass records through unchanged, calling callback(record) once each has
+    been consumed (e.g. written), so a downstream stage can start on it.
+    """
+    if callback is None:
+        yield from records
+        return
+    for rec in records:
+        yield rec
+        callback(rec)
+
+
+def merge_records(
+    primary: Iterable[Dict[str, Any]],
+    secondary: Iterable[Dict[str, Any]],
+    fields: Iterable[str],
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield primary records with `fields` copied over from the secondary
+    record that has the same tweet_id.
+
+    The secondary stream is read only as far as needed, so two streams
+    derived from the same input (same order) are joined with a tiny buffer.
+    Primary records without a match are passed through unchanged.
+    """
+    fields = tuple(fields)
+    secondary = iter(secondary)
+    pending: Dict[str, Dict[str, Any]] = {}
+    exhausted = False
+
+    for rec in primary:
+        tweet_id = rec.get("tweet_id")
+        key = None if tweet_id is None else str(tweet_id)
+
+        while key is not None and key not in pending and not exhausted:
+            other = next(secondary, None)
+            if other is None:
+                exhausted = True
+            elif other.get("tweet_id") is not None:
+                pending[str(other["tweet_id"])] = other
+
+        other = pending.pop(key, None) if key is not None else None
+        if other is not None:
+            for name in fields:
+                if name in other:
+                    rec[name] = other[name]
+        yield rec
+
+
+def convert_records(input_path: Path, output_path: Path) -> int:
+    """Convert between .json and .jsonl datasets (import/export)."""
+    return write_records(output_path, read_records(input_path))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage:")
+        print("  python3 -m src.records <input.json|jsonl> <output.json|jsonl>")
+        sys.exit(1)
+
+    n = convert_records(Path(sys.argv[1]), Path(sys.argv[2]))
+    print(f"Converted {n} records: {sys.argv[1]} -> {sys.argv[2]}")
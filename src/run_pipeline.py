@@ -1,44 +1,414 @@
 from __future__ import annotations
 
+import argparse
+import ast
+import hashlib
+import json
 import os
 import sys
-import subprocess
+import threading
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
 
+from .concurrency import RecordChannel
 
-PIPELINE_MODULES = [
-    "collector",
-    "build_dataset",
-    "add_ocr_to_dataset",
-    "add_labels_to_dataset",
-    "download_images",
+
+SRC_DIR = Path(__file__).resolve().parent
+STATE_PATH = Path(".pipeline_state.json")
+
+RAW_PATH = Path("raw_health_tweets.jsonl")
+WITH_IMAGES_PATH = Path("health_tweets_with_images.jsonl")
+WITH_OCR_PATH = Path("health_tweets_with_ocr.jsonl")
+LABELED_PATH = Path("health_tweets_labeled.jsonl")
+DOWNLOADED_PATH = Path("health_tweets_downloaded.jsonl")
+FINAL_PATH = Path("health_tweets_with_local_images.jsonl")
+IMAGE_EMBED_DIR = Path(os.getenv("IMAGE_EMBED_DIR", "embeddings/clip_images"))
+TEXT_EMBED_DIR = Path(os.getenv("TEXT_EMBED_DIR", "embeddings/arabert_text"))
+FEATURE_DIR = Path(os.getenv("FEATURE_DIR", "features"))
+
+# Records buffered between two running stages before the producer waits.
+CHANNEL_SIZE = int(os.getenv("PIPELINE_CHANNEL_SIZE", "1000"))
+
+# A stage's run function gets {dependency name: record stream or None} and
+# an on_record callback (or None); None inputs mean "read your input file".
+OnRecord = Optional[Callable[[Dict[str, Any]], None]]
+StageRunner = Callable[[Dict[str, Any], OnRecord], None]
+
+
+class Stage:
+    """
+    One node of the pipeline graph.
+
+    - name: stage name used on the command line and in the state file
+    - output: file the stage produces (what downstream stages read)
+    - deps: names of the stages whose outputs this one consumes
+    - modules: src/ modules the stage runs; their source code, and that of
+               every src/ module they import, versions the stage's output
+    - run: StageRunner doing the work
+    - params: settings that change the output; part of the fingerprint
+    - always: run on every invocation (e.g. an incremental collector whose
+              input is the live API, not a file)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        output: Path,
+        deps: Sequence[str],
+        modules: Sequence[str],
+        run: StageRunner,
+        params: Optional[Dict[str, Any]] = None,
+        always: bool = False,
+    ) -> None:
+        self.name = name
+        self.output = output
+        self.deps = tuple(deps)
+        self.modules = tuple(modules)
+        self.run = run
+        self.params = params or {}
+        self.always = always
+
+
+def _drain(*streams: Any) -> None:
+    """
+    Wait for the producers of the given streams to finish by consuming and
+    discarding their records. Streams are drained concurrently, so none of
+    the producers blocks on a full channel while another one is awaited.
+    """
+    def consume(stream: Any) -> None:
+        try:
+            for _ in stream:
+                pass
+        except BaseException as e:
+            errors.append(e)
+
+    errors: List[BaseException] = []
+    threads = [
+        threading.Thread(target=consume, args=(stream,), daemon=True)
+        for stream in streams if stream is not None
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+def _run_collect(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .collector import collect_tweets
+    collect_tweets(RAW_PATH, on_record=on_record)
+
+
+def _run_build(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .build_dataset import build_image_tweet_dataset
+    build_image_tweet_dataset(
+        str(RAW_PATH), str(WITH_IMAGES_PATH), records=inputs["collect"], on_record=on_record
+    )
+
+
+def _run_ocr(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .add_ocr_to_dataset import OCR_WORKERS, add_ocr_to_dataset
+    add_ocr_to_dataset(
+        WITH_IMAGES_PATH, WITH_OCR_PATH, workers=OCR_WORKERS,
+        records=inputs["build"], on_record=on_record,
+    )
+
+
+def _run_label(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .add_labels_to_dataset import (
+        LABEL_BACKEND,
+        LABEL_CONCURRENCY,
+        LABEL_PACK_SIZE,
+        add_labels_to_dataset,
+    )
+    add_labels_to_dataset(
+        WITH_OCR_PATH, LABELED_PATH,
+        sleep_seconds=0.5,
+        concurrency=LABEL_CONCURRENCY,
+        backend=LABEL_BACKEND,
+        pack_size=LABEL_PACK_SIZE,
+        records=inputs["ocr"],
+        on_record=on_record,
+    )
+
+
+def _run_download(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .download_images import download_images_for_dataset
+    download_images_for_dataset(
+        WITH_IMAGES_PATH, DOWNLOADED_PATH, index_csv_path=None,
+        records=inputs["build"], on_record=on_record,
+    )
+
+
+def _run_assemble(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .download_images import attach_local_images
+    # Joining the two live streams would hold the download branch back until
+    # labeling catches up (the batch labeler emits nothing before its input
+    # is complete); with bounded channels that stalls build and thus OCR.
+    # Let both branches run to completion and join their output files.
+    _drain(inputs["label"], inputs["download"])
+    attach_local_images(LABELED_PATH, DOWNLOADED_PATH, FINAL_PATH)
+
+
+def _run_embed_images(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .image_embeddings import embed_dataset_images
+    embed_dataset_images(DOWNLOADED_PATH, IMAGE_EMBED_DIR, records=inputs["download"])
+
+
+def _run_embed_texts(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .text_embeddings import embed_dataset_texts
+    embed_dataset_texts(WITH_OCR_PATH, TEXT_EMBED_DIR, records=inputs["ocr"])
+
+
+def _run_features(inputs: Dict[str, Any], on_record: OnRecord) -> None:
+    from .feature_store import build_features
+    # Rows need the final vectors of both embedding stages, so wait for all
+    # inputs to finish (draining the streams) and read the assembled file.
+    _drain(inputs["assemble"], inputs["embed_images"], inputs["embed_texts"])
+    build_features(FINAL_PATH, FEATURE_DIR, IMAGE_EMBED_DIR, TEXT_EMBED_DIR)
+
+
+# Image download only needs image_urls, so it runs beside OCR and labeling;
+# "assemble" joins both branches on tweet_id.
+STAGES: List[Stage] = [
+    Stage("collect", RAW_PATH, [], ["collector"], _run_collect,
+          {"target_n": 100, "max_pages": 20,
+           "shards": [os.getenv(k, "") for k in (
+               "COLLECT_TERM_GROUPS", "COLLECT_WINDOW_DAYS", "COLLECT_SINCE", "COLLECT_UNTIL")],
+           "base_url": os.getenv("TWITTERAPI_BASE_URL", "")},
+          always=os.getenv("COLLECT_INCREMENTAL", "false").lower() == "true"),
+    Stage("build", WITH_IMAGES_PATH, ["collect"], ["build_dataset"], _run_build),
+    Stage("ocr", WITH_OCR_PATH, ["build"], ["add_ocr_to_dataset"], _run_ocr,
+          {"lang": os.getenv("OCR_LANG", "eng"),
+           "backend": os.getenv("OCR_BACKEND", "auto").lower(),
+           "cache_similarity": os.getenv("OCR_CACHE_SIMILARITY", "0.95"),
+           "tesseract_config": os.getenv("TESSERACT_CONFIG", ""),
+           "preprocess": [os.getenv(k, "") for k in (
+               "OCR_PREPROCESS", "OCR_TARGET_TEXT_HEIGHT", "OCR_MAX_SIDE")],
+           "text_filter": [os.getenv(k, "") for k in (
+               "OCR_TEXT_FILTER", "OCR_TEXT_MIN_BLOCKS", "OCR_TEXT_FILTER_AUDIT")]}),
+    Stage("label", LABELED_PATH, ["ocr"], ["add_labels_to_dataset"], _run_label,
+          {"backend": os.getenv("LABEL_BACKEND", "sync"),
+           "batch": [os.getenv(k, "") for k in ("LABEL_BATCH_TRANSPORT", "LABEL_BATCH_BASE_URL")],
+           "pack": [os.getenv(k, "") for k in ("LABEL_PACK_SIZE", "LABEL_PACK_TOKEN_BUDGET")]}),
+    Stage("download", DOWNLOADED_PATH, ["build"], ["download_images"], _run_download),
+    Stage("assemble", FINAL_PATH, ["label", "download"], ["download_images"], _run_assemble),
+    Stage("embed_images", IMAGE_EMBED_DIR / "meta.json", ["download"],
+          ["image_embeddings"], _run_embed_images,
+          {"model": os.getenv("CLIP_MODEL", "ViT-B/32"), "dtype": os.getenv("EMBED_DTYPE", "float32")}),
+    Stage("embed_texts", TEXT_EMBED_DIR / "meta.json", ["ocr"],
+          ["text_embeddings"], _run_embed_texts,
+          {"model": os.getenv("ARABERT_MODEL", "aubmindlab/bert-base-arabertv2"),
+           "max_length": os.getenv("TEXT_MAX_LENGTH", "128"), "dtype": os.getenv("EMBED_DTYPE", "float32")}),
+    Stage("features", FEATURE_DIR / "meta.json", ["assemble", "embed_images", "embed_texts"],
+          ["feature_store"], _run_features),
 ]
 
 
-def _run_as_module(module_name: str) -> None:
-    cmd = [sys.executable, "-m", f"src.{module_name}"]
-    print(f"\n===== RUNNING: {' '.join(cmd)} =====")
-    subprocess.run(cmd, check=True)
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
-def _try_import_and_run_main(module_name: str) -> bool:
+def module_dependencies(modules: Sequence[str]) -> List[str]:
+    """
+    The given src/ modules and every src/ module they import, directly or
+    not (imports inside functions included), sorted by name.
+    """
+    found: Set[str] = set()
+    todo = list(modules)
+    while todo:
+        name = todo.pop()
+        if name in found:
+            continue
+        found.add(name)
+        tree = ast.parse((SRC_DIR / f"{name}.py").read_text(encoding="utf-8"))
+        for node in ast.walk(tree):
+            # `import src.x`, `from src.x import y`, `from .x import y`, `from . import x`
+            if isinstance(node, ast.Import):
+                targets = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = "src." + (node.module or "") if node.level else (node.module or "")
+                targets = [f"{base}.{alias.name}" for alias in node.names] + [base]
+            else:
+                continue
+            for target in targets:
+                parts = target.split(".")
+                if len(parts) > 1 and parts[0] == "src" and (SRC_DIR / f"{parts[1]}.py").exists():
+                    todo.append(parts[1])
+    return sorted(found)
+
+
+def _code_version(modules: Sequence[str]) -> str:
+    digest = hashlib.sha256()
+    for name in module_dependencies(modules):
+        digest.update(name.encode())
+        digest.update((SRC_DIR / f"{name}.py").read_bytes())
+    return digest.hexdigest()
+
+
+def stage_fingerprint(stage: Stage, by_name: Dict[str, Stage]) -> str:
+    """Hash of the stage's code, its params and the exact bytes of its inputs."""
+    payload = {
+        "code": _code_version(stage.modules),
+        "params": stage.params,
+        "inputs": {dep: _file_digest(by_name[dep].output) for dep in stage.deps},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _load_state(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
     try:
-        mod = __import__(f"src.{module_name}", fromlist=["main"])
-    except Exception as e:
-        print(f"[WARN] Could not import src.{module_name}: {e}")
-        return False
+        return json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return {}
+
+
+def _save_state(path: Path, state: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+REFRESH = "refreshed on every run"
+
+
+def plan(
+    stages: Sequence[Stage],
+    state: Dict[str, Any],
+    force: Sequence[str] = (),
+    refreshed: Sequence[str] = (),
+) -> Dict[str, str]:
+    """
+    Decide, make-style, which stages must run. Returns {stage: reason} for
+    the stale ones. A stage is stale if forced, if its output is missing,
+    if it is marked `always`, if any dependency is stale, or if its fingerprint (code version,
+    params, input bytes) differs from the one recorded after its last run.
+    `stages` must be listed in dependency order.
+
+    An `always` stage stale only for that reason (REFRESH) does not make
+    its dependents stale: whether it changed its output is only known once
+    it ran. main() runs such stages first and plans again, passing them as
+    `refreshed`; their dependents are then judged by their fingerprints,
+    which include the bytes of the refreshed output.
+    """
+    by_name = {s.name: s for s in stages}
+    stale: Dict[str, str] = {}
+
+    for stage in stages:
+        if stage.name in force or "all" in force:
+            stale[stage.name] = "forced"
+        elif not stage.output.exists():
+            stale[stage.name] = f"{stage.output} missing"
+        elif stage.always:
+            if stage.name not in refreshed:
+                stale[stage.name] = REFRESH
+        elif any(dep in stale and stale[dep] != REFRESH for dep in stage.deps):
+            stale[stage.name] = "upstream changes"
+        elif state.get(stage.name) != stage_fingerprint(stage, by_name):
+            stale[stage.name] = "code, settings or inputs changed"
+
+    return stale
+
 
-    main_fn: Optional[Callable[[], None]] = getattr(mod, "main", None)
-    if callable(main_fn):
-        print(f"\n===== RUNNING: src.{module_name}.main() =====")
-        main_fn()
-        return True
+def execute(stages: Sequence[Stage], to_run: Sequence[str]) -> None:
+    """
+    Run the given stages concurrently, one thread each. A running stage
+    hands every record it writes to the running stages that consume it;
+    stages whose inputs are up to date read their input files instead.
+    """
+    abort = threading.Event()
+    running = [s for s in stages if s.name in to_run]
 
-    return False
+    channels: Dict[Tuple[str, str], RecordChannel] = {}
+    for consumer in running:
+        for dep in consumer.deps:
+            if dep in to_run:
+                channels[(dep, consumer.name)] = RecordChannel(CHANNEL_SIZE, abort)
 
+    errors: List[Tuple[str, BaseException]] = []
+
+    def worker(stage: Stage) -> None:
+        outs = [ch for (src, _), ch in channels.items() if src == stage.name]
+        inputs = {dep: channels.get((dep, stage.name)) for dep in stage.deps}
+
+        def on_record(rec: Dict[str, Any]) -> None:
+            for ch in outs:
+                # Each consumer gets its own copy: stages add fields in place.
+                ch.put(dict(rec))
+
+        print(f"\n===== RUNNING STAGE: {stage.name} =====")
+        try:
+            stage.run(inputs, on_record if outs else None)
+        except BaseException as e:
+            errors.append((stage.name, e))
+            abort.set()
+            for ch in outs:
+                ch.close(e)
+            return
+        for ch in outs:
+            ch.close()
+        print(f"\n===== FINISHED STAGE: {stage.name} =====")
+
+    threads = [
+        threading.Thread(target=worker, args=(s,), name=f"stage-{s.name}", daemon=True)
+        for s in running
+    ]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(timeout=0.5)
+    except KeyboardInterrupt:
+        abort.set()
+        raise
+
+    if errors:
+        # Report the root cause, not the stages that were aborted because of it.
+        name, error = errors[0]
+        raise RuntimeError(f"Pipeline stage {name!r} failed: {error}") from error
+
+
+def _print_plan(stale: Dict[str, str]) -> None:
+    width = max(len(stage.name) for stage in STAGES)
+    for stage in STAGES:
+        print(f"  {stage.name:<{width}} {'RUN  (' + stale[stage.name] + ')' if stage.name in stale else 'up to date'}")
+
+
+def _run_and_record(names: List[str], state: Dict[str, Any]) -> None:
+    execute(STAGES, names)
+
+    # Fingerprints are taken from the inputs as finally written.
+    by_name = {s.name: s for s in STAGES}
+    for stage in STAGES:
+        if stage.name in names:
+            state[stage.name] = stage_fingerprint(stage, by_name)
+    _save_state(STATE_PATH, state)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the pipeline, rebuilding only stale stages.")
+    parser.add_argument(
+        "--force",
+        nargs="+",
+        default=[],
+        metavar="STAGE",
+        help="rerun these stages (and everything downstream); 'all' reruns everything",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only print which stages would run and why",
+    )
+    args = parser.parse_args(argv or [])
 
-def main() -> None:
     repo_root = Path(__file__).resolve().parents[1]
     os.chdir(repo_root)
 
@@ -46,17 +416,35 @@ def main() -> None:
     print("Repo root:", repo_root)
     print("Python:", sys.executable)
 
-    src_dir = repo_root / "src"
-    if not src_dir.exists():
-        raise RuntimeError(f"Could not find src/ directory at: {src_dir}")
+    names = {s.name for s in STAGES} | {"all"}
+    unknown = [name for name in args.force if name not in names]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    state = _load_state(STATE_PATH)
+    stale = plan(STAGES, state, args.force)
+    _print_plan(stale)
+
+    refresh = [name for name, reason in stale.items() if reason == REFRESH]
+    if refresh:
+        print(f"\nStages depending on {', '.join(refresh)} are rechecked once it has run.")
+    if args.dry_run or not stale:
+        if not stale:
+            print("\nNothing to do: all stages are up to date.")
+        return
 
-    for name in PIPELINE_MODULES:
-        ran = _try_import_and_run_main(name)
-        if not ran:
-            _run_as_module(name)
+    if refresh:
+        _run_and_record(refresh, state)
+        stale = plan(STAGES, state, args.force, refreshed=refresh)
+        print()
+        _print_plan(stale)
+        if not stale:
+            print("\nNothing else to do: the refreshed stages did not change their outputs.")
+            return
 
+    _run_and_record(list(stale), state)
     print("\nPipeline completed successfully.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1:])
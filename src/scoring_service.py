@@ -0,0 +1,621 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+from PIL import Image
+
+from .add_ocr_to_dataset import ocr_bytes_worker
+from .feature_store import (
+    FEATURE_COLUMNS,
+    FEATURE_DIR,
+    IMAGE_COLUMN,
+    LABELS,
+    TEXT_COLUMN,
+    open_feature_store,
+    training_data,
+)
+from .filter_media import extract_image_urls
+from .ocr_step import fetch_image_bytes, warm_up_ocr
+from .records import read_records
+from .text_preprocessing import combine_text
+
+
+CLASSIFIER_PATH = Path(os.getenv("CLASSIFIER_PATH", "models/classifier.pkl"))
+SCORING_HOST = os.getenv("SCORING_HOST", "127.0.0.1")
+SCORING_PORT = int(os.getenv("SCORING_PORT", "8080"))
+# "onnx" (ONNX Runtime, see ONNX_PRECISION) or "torch" encoders.
+SCORING_ENCODERS = os.getenv("SCORING_ENCODERS", "onnx")
+# End-to-end latency objective of one /score request; encoder batches are
+# started early enough for the most urgent request in them to meet it.
+SCORING_SLO_MS = float(os.getenv("SCORING_SLO_MS", "2000"))
+# Longest an item waits for others to join its batch, and the largest batch.
+SCORING_BATCH_WAIT_MS = float(os.getenv("SCORING_BATCH_WAIT_MS", "20"))
+SCORING_MAX_BATCH = int(os.getenv("SCORING_MAX_BATCH", "32"))
+# OCR processes, each with its Tesseract model loaded (0 = OCR in the request thread).
+SCORING_OCR_WORKERS = int(os.getenv("SCORING_OCR_WORKERS", "2"))
+# Threads fetching a request's images concurrently (shared by all requests).
+SCORING_FETCH_THREADS = int(os.getenv("SCORING_FETCH_THREADS", "16"))
+# Latency samples kept per step for the /metrics percentiles.
+SCORING_METRICS_WINDOW = int(os.getenv("SCORING_METRICS_WINDOW", "10000"))
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+# ---------------------------------------------------------------------------
+# Classifier
+# ---------------------------------------------------------------------------
+
+def train_classifier(
+    feature_dir: Path = FEATURE_DIR,
+    out_path: Path = CLASSIFIER_PATH,
+    test_size: float = 0.3,
+) -> None:
+    """
+    Fit the notebook's classifier (StandardScaler + LogisticRegression on
+    the CLIP image and AraBERT text columns) on the labeled rows of the
+    feature store, print held-out metrics for the notebook's stratified
+    split, and save it together with the model / version of each feature
+    column, so the service can refuse encoders that do not match.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import classification_report
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    fs = open_feature_store(feature_dir)
+    X, y, _ = training_data(fs, FEATURE_COLUMNS)
+    print(f"Training on {len(y)} labeled rows of {fs.root} ({X.shape[1]} features)")
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=42, stratify=y
+    )
+    scaler = StandardScaler()
+    clf = LogisticRegression(max_iter=2000)
+    clf.fit(scaler.fit_transform(X_train), y_train)
+    print(classification_report(
+        y_test, clf.predict(scaler.transform(X_test)),
+        labels=list(LABELS.values()), target_names=list(LABELS), digits=3, zero_division=0,
+    ))
+
+    model = {
+        "scaler": scaler,
+        "classifier": clf,
+        "columns": {name: fs.columns[name] for name in FEATURE_COLUMNS},
+        "rows": len(y_train),
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".part")
+    with tmp.open("wb") as f:
+        pickle.dump(model, f)
+    os.replace(tmp, out_path)
+    print(f"Classifier saved to {out_path}")
+
+
+def _load_encoders(kind: str) -> Tuple[Callable[[List[Any]], np.ndarray], Callable[[List[str]], np.ndarray], Dict[str, str]]:
+    """(encode images, encode texts, {feature column: model identity}) of an encoder backend."""
+    if kind == "onnx":
+        from .onnx_encoders import OnnxImageEncoder, OnnxTextEncoder
+
+        image_encoder = OnnxImageEncoder()
+        text_encoder = OnnxTextEncoder()
+        models = {IMAGE_COLUMN: image_encoder.config["store_model"], TEXT_COLUMN: text_encoder.config["store_model"]}
+        print(f"Encoders: ONNX Runtime {image_encoder.precision} ({image_encoder.store_model}, {text_encoder.store_model})")
+        return image_encoder.encode, text_encoder.encode, models
+    if kind == "torch":
+        import torch
+
+        from .image_embeddings import ClipImageEncoder
+        from .text_embeddings import ArabertTextEncoder
+
+        clip_encoder = ClipImageEncoder()
+        arabert_encoder = ArabertTextEncoder()
+
+        def encode_images(images: List[Any]) -> np.ndarray:
+            return clip_encoder.encode(torch.stack([clip_encoder.preprocess(img) for img in images]))
+
+        models = {IMAGE_COLUMN: f"clip:{clip_encoder.model_name}", TEXT_COLUMN: arabert_encoder.store_model}
+        print(f"Encoders: PyTorch fp32 ({models[IMAGE_COLUMN]}, {models[TEXT_COLUMN]})")
+        return encode_images, arabert_encoder.encode, models
+    raise ValueError(f"Unknown SCORING_ENCODERS {kind!r}; use 'onnx' or 'torch'")
+
+
+# ---------------------------------------------------------------------------
+# Micro-batching + metrics
+# ---------------------------------------------------------------------------
+
+class ScoringMetrics:
+    """
+    Thread-safe request counters and rolling latency samples (the last
+    `window` per step) behind GET /metrics.
+    """
+
+    def __init__(self, slo: float, window: int = SCORING_METRICS_WINDOW) -> None:
+        self.slo = slo
+        self.window = window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts = {"requests": 0, "errors": 0, "rejected": 0, "timeouts": 0, "slo_missed": 0}
+        self._batches: Dict[str, List[int]] = {}
+
+    def observe(self, step: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(step, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def request(self, seconds: float) -> None:
+        """A request that was scored, `seconds` after it arrived."""
+        self.observe("total", seconds)
+        with self._lock:
+            self._counts["requests"] += 1
+            if seconds > self.slo:
+                self._counts["slo_missed"] += 1
+
+    def batch(self, name: str, size: int, seconds: float, waits: Sequence[float]) -> None:
+        with self._lock:
+            stats = self._batches.setdefault(name, [0, 0])
+            stats[0] += 1
+            stats[1] += size
+            self._samples.setdefault(f"{name}_batch", deque(maxlen=self.window)).append(seconds)
+            self._samples.setdefault(f"{name}_queue", deque(maxlen=self.window)).extend(waits)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {step: list(values) for step, values in self._samples.items()}
+            counts = dict(self._counts)
+            batches = {name: list(stats) for name, stats in self._batches.items()}
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            **counts,
+            "slo_ms": self.slo * 1e3,
+            "slo_met_ratio": round(1 - counts["slo_missed"] / counts["requests"], 4) if counts["requests"] else None,
+            "latency_ms": {
+                step: {
+                    "n": len(values),
+                    "p50": round(_percentile(values, 0.50) * 1e3, 1),
+                    "p99": round(_percentile(values, 0.99) * 1e3, 1),
+                    "mean": round(sum(values) / len(values) * 1e3, 1),
+                }
+                for step, values in samples.items() if values
+            },
+            "batches": {
+                name: {"count": n, "mean_size": round(items / n, 2) if n else 0.0}
+                for name, (n, items) in batches.items()
+            },
+        }
+
+
+class MicroBatcher:
+    """
+    Runs `fn` (list of items -> array with one row per item) on batches of
+    the items that request threads submit concurrently; each caller waits
+    on the Future of its own item.
+
+    A batch starts as soon as it holds max_batch items, when its oldest
+    item has waited max_wait, or earlier if waiting any longer would make
+    its most urgent item miss its deadline, given how long recent batches
+    took. One worker thread runs the batches, so the model runs one batch
+    at a time, using all of its intra-op threads. Items whose Future was
+    cancelled (the caller gave up) before their batch starts are dropped.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[List[Any]], np.ndarray],
+        max_batch: int = SCORING_MAX_BATCH,
+        max_wait: float = SCORING_BATCH_WAIT_MS / 1e3,
+        metrics: Optional[ScoringMetrics] = None,
+    ) -> None:
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics
+        # (item, submitted at, deadline, future), oldest first
+        self._queue: Deque[Tuple[Any, float, float, Future]] = deque()
+        self._cond = threading.Condition()
+        self._batch_time = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, deadline: float) -> Future:
+        """Queue one item; `deadline` is a time.perf_counter() value."""
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Batcher {self.name} is closed")
+            self._queue.append((item, time.perf_counter(), deadline, future))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self) -> List[Tuple[Any, float, float, Future]]:
+        with self._cond:
+            while True:
+                if not self._queue:
+                    if self._closed:
+                        return []
+                    self._cond.wait()
+                    continue
+                if len(self._queue) >= self.max_batch or self._closed:
+                    break
+                urgent = min(deadline for _, _, deadline, _ in self._queue)
+                start_by = min(self._queue[0][1] + self.max_wait, urgent - self._batch_time)
+                now = time.perf_counter()
+                if now >= start_by:
+                    break
+                self._cond.wait(start_by - now)
+            return [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch))]
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            batch = [entry for entry in batch if entry[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                vectors = self.fn([item for item, _, _, _ in batch])
+                if len(vectors) != len(batch):
+                    raise RuntimeError(
+                        f"{self.name} encoder returned {len(vectors)} rows for {len(batch)} items"
+                    )
+                for (_, _, _, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except BaseException as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            elapsed = time.perf_counter() - started
+            # Smoothed, so one slow batch does not make every later one start early.
+            self._batch_time = elapsed if not self._batch_time else 0.8 * self._batch_time + 0.2 * elapsed
+            if self.metrics is not None:
+                self.metrics.batch(self.name, len(batch), elapsed, [started - t for _, t, _, _ in batch])
+
+    def close(self) -> None:
+        """Finish the queued items, then stop the worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+# ---------------------------------------------------------------------------
+# Scoring
+# ---------------------------------------------------------------------------
+
+class Scorer:
+    """
+    Scores tweets with the pipeline's own steps: image URLs
+    (filter_media.extract_image_urls), OCR + cleaning (the OCR stage's
+    per-image worker, with its cache and text filter), text preprocessing
+    (combine_text), CLIP and AraBERT embeddings, and the trained classifier.
+
+    Everything is loaded once: the classifier, both encoders (behind
+    MicroBatchers, so concurrent requests share forward passes) and a pool
+    of OCR processes with Tesseract warmed up.
+
+    A request that is still waiting on OCR or an encoder one SLO past its
+    deadline (twice the SLO in total) fails with TimeoutError.
+    """
+
+    def __init__(
+        self,
+        classifier_path: Path = CLASSIFIER_PATH,
+        encoders: str = SCORING_ENCODERS,
+        slo_ms: float = SCORING_SLO_MS,
+        batch_wait_ms: float = SCORING_BATCH_WAIT_MS,
+        max_batch: int = SCORING_MAX_BATCH,
+        ocr_workers: int = SCORING_OCR_WORKERS,
+        fetch_threads: int = SCORING_FETCH_THREADS,
+    ) -> None:
+        if not classifier_path.exists():
+            raise FileNotFoundError(f"{classifier_path} not found; run `python3 -m src.scoring_service train` first")
+        with classifier_path.open("rb") as f:
+            model = pickle.load(f)
+        self.scaler = model["scaler"]
+        self.classifier = model["classifier"]
+        names = {value: name for name, value in LABELS.items()}
+        self.classes = [names[int(c)] for c in self.classifier.classes_]
+        print(f"Classifier {classifier_path}: trained {model['trained_at']} on {model['rows']} rows")
+
+        encode_images, encode_texts, models = _load_encoders(encoders)
+        for column, produced in models.items():
+            trained = model["columns"][column]["model"]
+            if produced != trained:
+                raise ValueError(
+                    f"Classifier was trained on {column} features of {trained!r}, "
+                    f"but the encoder produces {produced!r}"
+                )
+        # First calls allocate buffers / pick kernels; keep that out of request latency.
+        encode_images([Image.new("RGB", (256, 256))])
+        encode_texts(["نص"])
+
+        self.slo = slo_ms / 1e3
+        self.metrics = ScoringMetrics(self.slo)
+        self.images = MicroBatcher("clip", encode_images, max_batch, batch_wait_ms / 1e3, self.metrics)
+        self.texts = MicroBatcher("arabert", encode_texts, max_batch, batch_wait_ms / 1e3, self.metrics)
+        self.ocr_pool = (
+            ProcessPoolExecutor(max_workers=ocr_workers, initializer=warm_up_ocr) if ocr_workers > 0 else None
+        )
+        if self.ocr_pool is not None:
+            for future in [self.ocr_pool.submit(time.sleep, 0) for _ in range(ocr_workers)]:
+                future.result()
+        self.fetch_pool = ThreadPoolExecutor(max_workers=max(1, fetch_threads))
+
+    def _wait(self, future: Future, give_up_at: float) -> Any:
+        """future.result(), but cancel it and raise TimeoutError at give_up_at."""
+        try:
+            return future.result(timeout=max(0.0, give_up_at - time.perf_counter()))
+        except TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"scoring took more than {2 * self.slo * 1e3:.0f} ms") from None
+
+    @staticmethod
+    def _fetch(url: str) -> Tuple[bytes, Image.Image]:
+        data = fetch_image_bytes(url)
+        return data, Image.open(io.BytesIO(data)).convert("RGB")
+
+    def _ocr(self, datas: List[bytes], give_up_at: float) -> List[str]:
+        """Cleaned OCR text of each image (empty for failures), as the OCR stage computes it."""
+        if self.ocr_pool is not None:
+            futures = [self.ocr_pool.submit(ocr_bytes_worker, data) for data in datas]
+            results = []
+            for future in futures:
+                try:
+                    results.append(self._wait(future, give_up_at)[0])
+                except TimeoutError:
+                    for other in futures:
+                        other.cancel()
+                    raise
+                except Exception as e:
+                    print(f"  - OCR failed: {e}")
+                    results.append("")
+            return results
+        results = []
+        for data in datas:
+            try:
+                results.append(ocr_bytes_worker(data)[0])
+            except Exception as e:
+                print(f"  - OCR failed: {e}")
+                results.append("")
+        return results
+
+    def score(self, tweet: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Score one tweet: a raw tweet object or a dataset row (with
+        'image_urls'). Raises ValueError if it has no usable image, since
+        the classifier needs image and text features.
+        """
+        started = time.perf_counter()
+        deadline = started + self.slo
+        give_up_at = deadline + self.slo
+        spent: Dict[str, float] = {}
+
+        urls = tweet.get("image_urls") or extract_image_urls(tweet)
+        if not urls:
+            raise ValueError("Tweet has no images; the classifier scores image + text features")
+
+        datas: List[bytes] = []
+        images: List[Image.Image] = []
+        fetches = [(url, self.fetch_pool.submit(self._fetch, url)) for url in urls]
+        for url, future in fetches:
+            try:
+                data, img = self._wait(future, give_up_at)
+            except TimeoutError:
+                for _, other in fetches:
+                    other.cancel()
+                raise
+            except Exception as e:
+                print(f"  - Skipping image {url}: {e}")
+                continue
+            datas.append(data)
+            images.append(img)
+        if not images:
+            raise ValueError("None of the tweet's images could be fetched and decoded")
+        spent["fetch"] = time.perf_counter() - started
+
+        # CLIP needs no OCR text: its batches run while OCR does.
+        image_futures = [self.images.submit(img, deadline) for img in images]
+
+        try:
+            mark = time.perf_counter()
+            ocr_texts = self._ocr(datas, give_up_at)
+            spent["ocr"] = time.perf_counter() - mark
+
+            mark = time.perf_counter()
+            row = {
+                "text": tweet.get("full_text") or tweet.get("text") or "",
+                "ocr_text_combined": "\n\n".join(text for text in ocr_texts if text),
+            }
+            text_vector = self._wait(self.texts.submit(combine_text(row), deadline), give_up_at)
+            image_vectors = np.stack([self._wait(future, give_up_at) for future in image_futures])
+            spent["embed"] = time.perf_counter() - mark
+        except TimeoutError:
+            for future in image_futures:
+                future.cancel()
+            raise
+
+        mark = time.perf_counter()
+        X = np.hstack([image_vectors, np.repeat(text_vector[None, :], len(image_vectors), axis=0)])
+        proba = self.classifier.predict_proba(self.scaler.transform(X))
+        # One feature row per image, as in training; the tweet gets their mean.
+        mean = proba.mean(axis=0)
+        spent["classify"] = time.perf_counter() - mark
+
+        total = time.perf_counter() - started
+        for step, seconds in spent.items():
+            self.metrics.observe(step, seconds)
+        self.metrics.request(total)
+        return {
+            "tweet_id": tweet.get("tweet_id") or tweet.get("id"),
+            "label": self.classes[int(mean.argmax())],
+            "probabilities": {name: round(float(p), 4) for name, p in zip(self.classes, mean)},
+            "images": len(images),
+            "image_probabilities": [
+                {name: round(float(p), 4) for name, p in zip(self.classes, row_proba)} for row_proba in proba
+            ],
+            "ocr_text": row["ocr_text_combined"],
+            "latency_ms": {step: round(seconds * 1e3, 1) for step, seconds in {**spent, "total": total}.items()},
+            "slo_met": total <= self.slo,
+        }
+
+    def close(self) -> None:
+        self.images.close()
+        self.texts.close()
+        self.fetch_pool.shutdown()
+        if self.ocr_pool is not None:
+            self.ocr_pool.shutdown()
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+def make_server(scorer: Scorer, host: str = SCORING_HOST, port: int = SCORING_PORT) -> ThreadingHTTPServer:
+    """
+    HTTP front end, one thread per connection:
+      POST /score    tweet JSON -> label, probabilities, per-step latency
+      GET  /metrics  request counts, SLO ratio, p50/p99 per step, batch sizes
+      GET  /healthz
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if self.path == "/metrics":
+                self._send(200, scorer.metrics.snapshot())
+            elif self.path == "/healthz":
+                self._send(200, {"status": "ok"})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if self.path != "/score":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                tweet = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                if not isinstance(tweet, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                scorer.metrics.count("rejected")
+                self._send(400, {"error": f"invalid request body: {e}"})
+                return
+            try:
+                self._send(200, scorer.score(tweet))
+            except ValueError as e:
+                scorer.metrics.count("rejected")
+                self._send(422, {"error": str(e)})
+            except TimeoutError as e:
+                scorer.metrics.count("timeouts")
+                self._send(504, {"error": str(e)})
+            except Exception as e:
+                scorer.metrics.count("errors")
+                print(f"  - Error scoring tweet {tweet.get('tweet_id') or tweet.get('id')}: {e}")
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def load_test(url: str, input_path: Path, n: int = 200, concurrency: int = 8) -> None:
+    """
+    Post the first `n` rows with images of a dataset to a running service
+    from `concurrency` threads; print client-side latency and the
+    service's /metrics.
+    """
+    rows = [row for row in read_records(input_path) if row.get("image_urls")][:n]
+    base = url.rstrip("/")
+
+    def post(row: Dict[str, Any]) -> Tuple[float, int]:
+        started = time.perf_counter()
+        response = requests.post(f"{base}/score", json=row, timeout=60)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, rows))
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds for seconds, status in results if status == 200]
+    print(f"{len(rows)} requests from {concurrency} threads in {elapsed:.1f}s "
+          f"({len(rows) / elapsed if elapsed else 0:.1f} req/s), {len(latencies)} scored")
+    print(f"  client latency p50 {_percentile(latencies, 0.5) * 1e3:.0f} ms  "
+          f"p99 {_percentile(latencies, 0.99) * 1e3:.0f} ms")
+    print(json.dumps(requests.get(f"{base}/metrics", timeout=10).json(), indent=2))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Train the classifier and serve it as a low-latency scoring service.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="fit the classifier on the feature store and save it")
+    train.add_argument("--features", type=Path, default=FEATURE_DIR)
+    train.add_argument("--out", type=Path, default=CLASSIFIER_PATH)
+    serve = sub.add_parser("serve", help="run the HTTP scoring service")
+    serve.add_argument("--host", default=SCORING_HOST)
+    serve.add_argument("--port", type=int, default=SCORING_PORT)
+    serve.add_argument("--classifier", type=Path, default=CLASSIFIER_PATH)
+    serve.add_argument("--encoders", choices=("onnx", "torch"), default=SCORING_ENCODERS)
+    load = sub.add_parser("loadtest", help="replay dataset rows against a running service")
+    load.add_argument("--url", default=f"http://{SCORING_HOST}:{SCORING_PORT}")
+    load.add_argument("--input", type=Path, default=Path("health_tweets_with_images.jsonl"))
+    load.add_argument("--n", type=int, default=200)
+    load.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv or [])
+
+    if args.command == "train":
+        train_classifier(args.features, args.out)
+        return
+    if args.command == "loadtest":
+        load_test(args.url, args.input, args.n, args.concurrency)
+        return
+
+    scorer = Scorer(args.classifier, args.encoders)
+    server = make_server(scorer, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Scoring service on http://{host}:{port} (POST /score, GET /metrics), "
+          f"SLO {scorer.slo * 1e3:.0f} ms")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scorer.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .embedding_store import EMBED_DTYPE, EmbeddingStore
+from .records import read_records
+from .text_preprocessing import combine_text, text_key
+
+
+INPUT_PATH = Path("health_tweets_with_ocr.jsonl")
+
+ARABERT_MODEL = os.getenv("ARABERT_MODEL", "aubmindlab/bert-base-arabertv2")
+TEXT_EMBED_DIR = Path(os.getenv("TEXT_EMBED_DIR", "embeddings/arabert_text"))
+# Tokens per text; longer texts are truncated (as in the notebook).
+TEXT_MAX_LENGTH = int(os.getenv("TEXT_MAX_LENGTH", "128"))
+# A batch holds at most this many texts ...
+TEXT_EMBED_BATCH_SIZE = int(os.getenv("TEXT_EMBED_BATCH_SIZE", "64"))
+# ... and at most this many (padded) tokens, so batches of short texts
+# are large and batches of long texts small.
+TEXT_EMBED_BATCH_TOKENS = int(os.getenv("TEXT_EMBED_BATCH_TOKENS", "4096"))
+# Torch intra-op threads for the forward pass (0 = torch's default).
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+# New texts collected from a row stream before they are bucketed and encoded.
+TEXT_EMBED_CHUNK_SIZE = int(os.getenv("TEXT_EMBED_CHUNK_SIZE", "8192"))
+
+
+def length_buckets(
+    lengths: Sequence[int],
+    batch_size: int = TEXT_EMBED_BATCH_SIZE,
+    batch_tokens: int = TEXT_EMBED_BATCH_TOKENS,
+) -> List[List[int]]:
+    """
+    Group text indices into batches of similar token length: indices are
+    sorted by length and cut into runs of at most `batch_size` texts whose
+    padded size (count x longest) stays within `batch_tokens`. Dynamic
+    padding then pads each batch only to its own longest text.
+    """
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Sorted ascending, so lengths[i] is the longest in the batch so far.
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * lengths[i] > batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class ArabertTextEncoder:
+    """
+    AraBERT on CPU, in inference mode: the [CLS] vector of the last hidden
+    layer of each text (as in the notebook), computed in length-bucketed,
+    dynamically padded batches.
+    """
+
+    def __init__(
+        self,
+        model_name: str = ARABERT_MODEL,
+        max_length: int = TEXT_MAX_LENGTH,
+        threads: int = EMBED_THREADS,
+    ) -> None:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+        self.dim = int(self.model.config.hidden_size)
+
+    @property
+    def store_model(self) -> str:
+        """Model identity recorded in the store: truncation changes the vectors too."""
+        return f"arabert:{self.model_name}:max{self.max_length}"
+
+    def tokenize(self, texts: Sequence[str]) -> Dict[str, List[List[int]]]:
+        """Token ids of all texts at once, truncated but not padded."""
+        return self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+
+    def encode_batch(self, features: Dict[str, List[List[int]]]) -> np.ndarray:
+        """[CLS] vectors of one batch of tokenized texts, padded to the batch's longest."""
+        import torch
+
+        batch = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+        with torch.inference_mode():
+            outputs = self.model(**batch)
+        return outputs.last_hidden_state[:, 0, :].float().numpy()
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        batch_size: int = TEXT_EMBED_BATCH_SIZE,
+        batch_tokens: int = TEXT_EMBED_BATCH_TOKENS,
+        on_batch: Optional[Callable[[List[int], np.ndarray], None]] = None,
+    ) -> np.ndarray:
+        """
+        Vectors of texts, in input order. `on_batch(indices, vectors)` is
+        called after each batch (e.g. to store it right away).
+        """
+        tokens = self.tokenize(texts)
+        ids = tokens["input_ids"]
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for batch in length_buckets([len(x) for x in ids], batch_size, batch_tokens):
+            features = {name: [values[i] for i in batch] for name, values in tokens.items()}
+            vectors = self.encode_batch(features)
+            out[batch] = vectors
+            if on_batch is not None:
+                on_batch(batch, vectors)
+        return out
+
+
+def open_text_store(encoder: ArabertTextEncoder, root: Path = TEXT_EMBED_DIR, dtype: str = EMBED_DTYPE) -> EmbeddingStore:
+    return EmbeddingStore(root, encoder.store_model, encoder.dim, dtype)
+
+
+def embed_new_texts(
+    texts: Sequence[str],
+    encoder: ArabertTextEncoder,
+    store: EmbeddingStore,
+    batch_size: int = TEXT_EMBED_BATCH_SIZE,
+) -> int:
+    """
+    Encode the preprocessed texts that have no vector in the store yet;
+    each batch is stored and flushed as it finishes. Returns how many
+    were added.
+    """
+    by_key = {text_key(t): t for t in texts}
+    todo = store.missing(by_key)
+    if not todo:
+        return 0
+    pending = [by_key[k] for k in todo]
+
+    def store_batch(batch: List[int], vectors: np.ndarray) -> None:
+        store.add([todo[i] for i in batch], vectors)
+        store.flush()
+
+    encoder.encode(pending, batch_size, on_batch=store_batch)
+    return len(pending)
+
+
+def embed_dataset_texts(
+    input_path: Path = INPUT_PATH,
+    store_dir: Path = TEXT_EMBED_DIR,
+    batch_size: int = TEXT_EMBED_BATCH_SIZE,
+    dtype: str = EMBED_DTYPE,
+    records: Optional[Iterable[Dict[str, Any]]] = None,
+) -> int:
+    """
+    Pipeline stage: make sure the combined, preprocessed text of every row
+    (text_preprocessing.combine_text: tweet + OCR text) has an AraBERT
+    embedding in the store at store_dir, keyed by text_key. Texts encoded
+    by earlier runs, or shared by several tweets, are not encoded again.
+
+    - batch_size: most texts per forward pass (see length_buckets).
+    - dtype: "float32" or "float16" storage for a new store.
+    - records: optional stream of rows to use instead of reading
+               input_path; new texts are encoded in chunks of
+               TEXT_EMBED_CHUNK_SIZE as the rows arrive.
+
+    Returns the number of vectors added.
+    """
+    if records is None:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        print(f"Embedding texts of {input_path}")
+        records = read_records(input_path)
+    else:
+        print("Embedding texts streamed from upstream stage")
+
+    encoder = ArabertTextEncoder()
+    store = open_text_store(encoder, store_dir, dtype)
+    print(f"{encoder.model_name} (max {encoder.max_length} tokens) -> {store.root} "
+          f"({len(store)} vectors stored, {store.dtype.name}), batches of up to {batch_size} texts")
+
+    started = time.monotonic()
+    n_rows = 0
+    seen = set()
+    added = 0
+    chunk: List[str] = []
+
+    try:
+        for row in records:
+            n_rows += 1
+            text = combine_text(row)
+            key = text_key(text)
+            if key in seen:
+                continue
+            seen.add(key)
+            if key not in store:
+                chunk.append(text)
+                if len(chunk) >= TEXT_EMBED_CHUNK_SIZE:
+                    added += embed_new_texts(chunk, encoder, store, batch_size)
+                    chunk = []
+        if chunk:
+            added += embed_new_texts(chunk, encoder, store, batch_size)
+    finally:
+        store.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Texts: {n_rows} rows, {len(seen)} distinct, {len(seen) - added} already embedded")
+    print(f"Embedded {added} new text(s) in {elapsed:.1f}s ({added / elapsed if elapsed else 0:.1f} texts/s)")
+    print(f"Store {store.root}: {len(store)} vectors, {store.nbytes() / 1e6:.1f} MB")
+    return added
+
+
+def embed_texts(
+    texts: Sequence[str],
+    store_dir: Path = TEXT_EMBED_DIR,
+    batch_size: int = TEXT_EMBED_BATCH_SIZE,
+) -> np.ndarray:
+    """
+    AraBERT embeddings (float32, in order) of already preprocessed texts,
+    encoding only texts not in the store yet (e.g. for a notebook).
+    """
+    encoder = ArabertTextEncoder()
+    store = open_text_store(encoder, store_dir)
+    try:
+        embed_new_texts(texts, encoder, store, batch_size)
+        return store.get([text_key(t) for t in texts])
+    finally:
+        store.close()
+
+
+def benchmark(texts: Sequence[str], batch_size: int = TEXT_EMBED_BATCH_SIZE) -> None:
+    """
+    Compare throughput against the notebook's per-text loop (padding every
+    text to max_length) and check that both give the same vectors.
+    """
+    import torch
+
+    encoder = ArabertTextEncoder()
+    print(f"Benchmark: {len(texts)} texts, {torch.get_num_threads()} torch threads")
+
+    started = time.perf_counter()
+    baseline = []
+    for text in texts:
+        inputs = encoder.tokenizer(
+            text, return_tensors="pt", truncation=True, padding="max_length", max_length=encoder.max_length
+        )
+        with torch.no_grad():
+            baseline.append(encoder.model(**inputs).last_hidden_state[0, 0, :].numpy())
+    per_text = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = encoder.encode(texts, batch_size)
+    bucketed = time.perf_counter() - started
+
+    lengths = [len(x) for x in encoder.tokenize(texts)["input_ids"]]
+    padded = sum(len(b) * max(lengths[i] for i in b) for b in length_buckets(lengths, batch_size))
+    diff = float(np.max(np.abs(np.stack(baseline) - batched))) if texts else 0.0
+    print(f"  per-text, padded to {encoder.max_length}: {len(texts) / per_text:7.1f} texts/s "
+          f"({len(texts) * encoder.max_length} tokens)")
+    print(f"  bucketed batches, dynamic padding: {len(texts) / bucketed:7.1f} texts/s "
+          f"({padded} tokens)  x{per_text / bucketed:.1f}")
+    print(f"  max abs difference between the two: {diff:.2e}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Embed the dataset's texts with AraBERT, skipping known ones.")
+    parser.add_argument("--input", type=Path, default=INPUT_PATH, help="dataset with text / OCR text")
+    parser.add_argument("--store", type=Path, default=TEXT_EMBED_DIR, help="embedding store directory")
+    parser.add_argument("--batch-size", type=int, default=TEXT_EMBED_BATCH_SIZE)
+    parser.add_argument("--dtype", choices=("float32", "float16"), default=EMBED_DTYPE,
+                        help="storage dtype of a new store")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="instead, time N dataset texts per-text vs. bucketed (nothing is stored)")
+    args = parser.parse_args(argv or [])
+
+    if args.benchmark:
+        texts = [combine_text(row) for _, row in zip(range(args.benchmark), read_records(args.input))]
+        benchmark(texts, args.batch_size)
+        return
+    embed_dataset_texts(args.input, args.store, args.batch_size, args.dtype)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
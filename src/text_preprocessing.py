@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Mapping, Tuple
+
+from .ocr_cleaning import DELETED_CHARS_PATTERN, normalize_arabic_letters
+
+
+# Bump when the output of preprocess_text changes, so stores keyed by
+# preprocessed text (embeddings, label cache) can tell old entries apart.
+PREPROCESS_VERSION = "1"
+
+# Distinct texts remembered per process; a text seen again (tweet text in
+# every stage, OCR text repeated across tweets) is not cleaned twice.
+PREPROCESS_CACHE_SIZE = int(os.getenv("PREPROCESS_CACHE_SIZE", "100000"))
+
+# Arabic-Indic (٠-٩) and Extended Arabic-Indic / Persian (۰-۹) digits → 0-9
+ARABIC_DIGITS_PATTERN = re.compile(r"[\u0660-\u0669\u06F0-\u06F9]")
+_DIGIT_TABLE = str.maketrans(
+    {chr(0x0660 + i): str(i) for i in range(10)} | {chr(0x06F0 + i): str(i) for i in range(10)}
+)
+
+
+@lru_cache(maxsize=PREPROCESS_CACHE_SIZE)
+def preprocess_text(text: str) -> str:
+    """
+    AraBERT-compatible normalization of tweet or OCR text:
+      - Unicode normalize (NFKC)
+      - Remove control chars, diacritics & tatweel
+      - Unify letter variants (alef, ya, teh marbuta)
+      - Map Arabic-Indic digits to 0-9
+      - Collapse whitespace
+
+    Unlike clean_ocr_text it keeps every other character (Latin words,
+    hashtags, emoji), which carry meaning in tweet text. Results are
+    memoized per text.
+    """
+    if not text:
+        return ""
+
+    text = unicodedata.normalize("NFKC", text)
+    if not text.isascii():
+        text = DELETED_CHARS_PATTERN.sub("", text)
+        text = normalize_arabic_letters(text)
+        if ARABIC_DIGITS_PATTERN.search(text):
+            text = text.translate(_DIGIT_TABLE)
+    return " ".join(text.split())
+
+
+def row_texts(row: Mapping[str, Any]) -> Tuple[str, str]:
+    """Preprocessed (tweet text, OCR text) of a dataset row."""
+    return (
+        preprocess_text(row.get("text") or ""),
+        preprocess_text(row.get("ocr_text_combined") or ""),
+    )
+
+
+def combine_text(row: Mapping[str, Any]) -> str:
+    """
+    Tweet text and OCR text of a row (dict or pandas Series), preprocessed
+    and joined: the single text fed to the text encoders.
+    """
+    tweet_text, ocr_text = row_texts(row)
+    return (tweet_text + " " + ocr_text).strip()
+
+
+def text_key(preprocessed: str) -> str:
+    """
+    SHA-256 key of an already preprocessed text (e.g. combine_text's
+    output), tied to PREPROCESS_VERSION so stores keyed by it never mix
+    texts normalized by different versions.
+    """
+    return hashlib.sha256(f"{PREPROCESS_VERSION}\0{preprocessed}".encode("utf-8")).hexdigest()
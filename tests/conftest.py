@@ -0,0 +1,5 @@
+import os
+
+# src.config refuses to import without API credentials; tests never use them.
+for key in ("TWITTERAPI_KEY", "BRIGHT_DATA_AUTH", "OPENAI_API_KEY"):
+    os.environ.setdefault(key, "test")
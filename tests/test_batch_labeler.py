@@ -0,0 +1,87 @@
+"""The batch labeling path, run offline against MockBatchTransport."""
+from __future__ import annotations
+
+import hashlib
+import json
+
+import pytest
+
+pytest.importorskip("openai")
+
+from src.batch_labeler import MockBatchTransport, build_batch_file, run_batch, submit_batch
+
+
+def test_run_batch_with_mock_transport(tmp_path):
+    rows = [{"tweet_id": str(i), "text": f"tweet {i}", "ocr_text": ""} for i in range(10)]
+    state_path = tmp_path / "state.json"
+    results = run_batch(
+        rows, transport=MockBatchTransport(fail_every=4),
+        batch_path=tmp_path / "requests.jsonl", state_path=state_path, poll_seconds=0,
+    )
+
+    assert sorted(results, key=int) == [str(i) for i in range(10)]
+    failed = [k for k, info in results.items() if info["label"] == "unverified"]
+    assert len(failed) == 2
+    assert all(results[k]["justification"].startswith("Labeling error") for k in failed)
+    assert not state_path.exists()
+
+
+def _saved_state(tmp_path, rows, **overrides):
+    batch_path = tmp_path / "requests.jsonl"
+    build_batch_file(rows, batch_path)
+    state = {"batch_id": "batch-from-an-earlier-run",
+             "input_sha256": hashlib.sha256(batch_path.read_bytes()).hexdigest(),
+             "transport": MockBatchTransport.name}
+    state.update(overrides)
+    state_path = tmp_path / "state.json"
+    state_path.write_text(json.dumps(state), encoding="utf-8")
+    return batch_path, state_path
+
+
+@pytest.mark.parametrize("overrides", [
+    {},  # matches, but the batch expired
+    {"input_sha256": "other input"},
+    {"transport": "openai"},
+    {"input_sha256": None, "transport": None},  # state without input or transport
+])
+def test_saved_batch_is_replaced_unless_resumable(tmp_path, overrides):
+    rows = [{"tweet_id": "1", "text": "x"}, {"tweet_id": "2", "text": "y"}]
+    batch_path, state_path = _saved_state(tmp_path, rows, **overrides)
+    results = run_batch(
+        rows, transport=MockBatchTransport(),
+        batch_path=batch_path, state_path=state_path, poll_seconds=0,
+    )
+    assert sorted(results) == ["1", "2"]
+    assert all(info["label"] in MockBatchTransport.LABELS for info in results.values())
+    assert not state_path.exists()
+
+
+def test_matching_saved_batch_is_resumed(tmp_path):
+    rows = [{"tweet_id": "1", "text": "x"}]
+    transport = MockBatchTransport()
+    batch_path, state_path = _saved_state(tmp_path, rows)
+    batch_id = submit_batch(batch_path, transport)
+    state = json.loads(state_path.read_text(encoding="utf-8"))
+    state_path.write_text(json.dumps(dict(state, batch_id=batch_id)), encoding="utf-8")
+
+    results = run_batch(rows, transport=transport, batch_path=batch_path,
+                        state_path=state_path, poll_seconds=0)
+    assert list(results) == ["1"]
+    assert list(transport._batches) == [batch_id]
+
+
+class FailingTransport(MockBatchTransport):
+    def create(self, input_file_id: str) -> str:
+        batch_id = self._new_id("batch")
+        self._batches[batch_id] = {"status": "failed", "output_file_id": None, "error_file_id": None}
+        return batch_id
+
+
+def test_failed_batch_without_results_raises(tmp_path):
+    state_path = tmp_path / "state.json"
+    with pytest.raises(RuntimeError, match="status=failed"):
+        run_batch(
+            [{"tweet_id": "1", "text": "x"}], transport=FailingTransport(),
+            batch_path=tmp_path / "requests.jsonl", state_path=state_path, poll_seconds=0,
+        )
+    assert not state_path.exists()
@@ -0,0 +1,57 @@
+"""Resuming a stage from its progress journal."""
+from __future__ import annotations
+
+from src.checkpoint import StageJournal
+
+
+def test_restores_journaled_fields_after_restart(tmp_path):
+    path = tmp_path / "out.jsonl.journal"
+    journal = StageJournal(path, ["ocr_text"])
+    for i in range(5):
+        journal.record({"tweet_id": i, "text": "not journaled", "ocr_text": f"ocr {i}"})
+    journal.record({"tweet_id": 2, "ocr_text": "ocr 2, redone"})
+    journal.close()
+    with path.open("a", encoding="utf-8") as f:
+        f.write('{"tweet_id": 9, "ocr_te')  # torn by a crash
+
+    journal = StageJournal(path, ["ocr_text"])
+    assert len(journal) == 5
+    row = {"tweet_id": "2", "text": "t"}
+    assert journal.restore(row)
+    assert row == {"tweet_id": "2", "text": "t", "ocr_text": "ocr 2, redone"}
+    assert not journal.restore({"tweet_id": 9})
+
+    # Rows recorded by this run are only remembered by key.
+    journal.record({"tweet_id": 7, "ocr_text": "ocr 7"})
+    assert {"tweet_id": 7} in journal
+    assert journal.restored == 1
+    journal.finish()
+    assert not path.exists()
+
+
+def test_resume_false_discards_the_journal(tmp_path):
+    path = tmp_path / "out.jsonl.journal"
+    journal = StageJournal(path, ["label"])
+    journal.record({"tweet_id": 1, "label": "true"})
+    journal.close()
+
+    journal = StageJournal(path, ["label"], resume=False)
+    assert len(journal) == 0
+    assert not journal.restore({"tweet_id": 1})
+    journal.close()
+
+
+def test_record_after_torn_tail_survives_reopen(tmp_path):
+    path = tmp_path / "out.jsonl.journal"
+    path.write_text('{"tweet_id": 1, "x": 1}\n{"tweet_id": 2, ', encoding="utf-8")
+
+    journal = StageJournal(path, ["x"])
+    assert len(journal) == 1
+    journal.record({"tweet_id": 3, "x": 3})
+    journal.close()
+
+    journal = StageJournal(path, ["x"])
+    row = {"tweet_id": 3}
+    assert journal.restore(row) and row == {"tweet_id": 3, "x": 3}
+    assert len(journal) == 2
+    journal.close()
@@ -0,0 +1,62 @@
+"""Incremental collection against the local mock search API."""
+from __future__ import annotations
+
+from src import collector
+from src.collector import build_query, collect_tweets
+from src.mock_twitterapi import MockTwitterAPI
+from src.records import read_records
+
+QUERY = build_query(["a", "b", "c"])
+
+
+def _collect(api: MockTwitterAPI, target_n, full: bool = False) -> int:
+    return collect_tweets(
+        "raw.jsonl", query=QUERY, target_n=target_n, max_pages=50,
+        workers=1, base_url=api.base_url, incremental=True, full=full,
+    )
+
+
+def test_target_n_does_not_skip_rest_of_page(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collector, "get_twitter_cookies", lambda: {})
+    with MockTwitterAPI(corpus_size=300, page_size=20) as api:
+        first = _collect(api, target_n=None, full=True)
+        assert first == len(api.search(QUERY))
+
+        api.add_tweets(100)
+        expected = [k for k in api.search(QUERY) if k >= 300]
+        assert len(expected) > 30
+
+        counts = [_collect(api, target_n=30) for _ in range(6)]
+
+    # Runs stop at target_n mid-page; later runs pick up the rest of that page.
+    assert all(n <= 30 for n in counts)
+    assert sum(counts) == len(expected)
+    ids = [int(tw["id"]) for tw in read_records(tmp_path / "raw.jsonl")]
+    assert len(ids) == len(set(ids)) == first + len(expected)
+
+
+def test_rerun_reads_only_tweets_past_the_saved_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collector, "get_twitter_cookies", lambda: {})
+    starts = []
+
+    def tracking_read_records(path, start=0):
+        starts.append(start)
+        return read_records(path, start=start)
+
+    monkeypatch.setattr(collector, "read_records", tracking_read_records)
+    raw = tmp_path / "raw.jsonl"
+    with MockTwitterAPI(corpus_size=100, page_size=20) as api:
+        _collect(api, target_n=None, full=True)
+        indexed = raw.stat().st_size
+        # A tweet written after the index was last saved (e.g. by a crashed run).
+        api.add_tweets(20)
+        new = [k for k in api.search(QUERY) if k >= 100]
+        with raw.open("a", encoding="utf-8") as f:
+            f.write(f'{{"id": "{api.tweet_id(new[0])}"}}\n')
+
+        assert _collect(api, target_n=None) == len(new) - 1
+        assert starts == [indexed]
+        assert _collect(api, target_n=None) == 0
+        assert starts == [indexed, raw.stat().st_size]
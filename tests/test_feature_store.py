@@ -0,0 +1,170 @@
+"""FeatureStore storage, and build_features keeping it in sync with a dataset."""
+from __future__ import annotations
+
+import hashlib
+import json
+
+import numpy as np
+import pytest
+
+from src.embedding_store import EmbeddingStore
+from src.feature_store import (
+    IMAGE_COLUMN,
+    LABEL_COLUMN,
+    LABELS,
+    TEXT_COLUMN,
+    _MIN_CAPACITY,
+    FeatureStore,
+    build_features,
+    open_feature_store,
+)
+from src.text_preprocessing import combine_text, text_key
+
+DIM = 4
+
+
+def _sha(value: str) -> bytes:
+    return hashlib.sha256(value.encode()).digest()
+
+
+def _rows(keys):
+    digests = np.frombuffer(b"".join(_sha(f"{t}/{i}") for t, i in keys), dtype=np.uint8)
+    return {
+        "image_sha256": digests.reshape(-1, 32),
+        "text_key": digests.reshape(-1, 32),
+        "vec": np.asarray([[t, i, 0, 0] for t, i in keys], dtype=np.float32),
+    }
+
+
+def test_matrix_of_empty_store_keeps_column_width(tmp_path):
+    fs = FeatureStore(tmp_path / "features")
+    fs.set_column("clip_image", np.empty((0, 4), dtype=np.float32), model="m")
+
+    assert fs.matrix(["clip_image"]).shape == (0, 4)
+    assert fs.matrix(["tweet_id"], dtype=np.int64).shape == (0, 1)
+    assert fs.matrix(["clip_image", "tweet_id"]).shape == (0, 5)
+    fs.close()
+
+
+def test_append_past_min_capacity_and_reopen_readonly(tmp_path):
+    root = tmp_path / "features"
+    fs = FeatureStore(root)
+    fs.set_column("vec", np.empty((0, DIM), dtype=np.float32), model="m")
+
+    first = [(t, 0) for t in range(_MIN_CAPACITY - 10)]
+    second = [(t, 1) for t in range(_MIN_CAPACITY - 10)] + [(5, 0)]  # (5, 0) is a duplicate
+    assert fs.append(first, _rows(first)) == len(first)
+    assert fs.append(second, _rows(second)) == len(second) - 1
+    assert len(fs) == len(first) + len(second) - 1 > _MIN_CAPACITY
+    fs.flush()
+
+    reader = open_feature_store(root)
+    assert len(reader) == len(fs)
+    rows = reader.rows([(7, 1), (3, 0)])
+    np.testing.assert_array_equal(reader.matrix(["vec"], rows), [[7, 1, 0, 0], [3, 0, 0, 0]])
+    assert sorted(reader.column("image_index")[reader.tweet_rows([9])].tolist()) == [0, 1]
+    with pytest.raises(PermissionError):
+        reader.append([(10**6, 0)], _rows([(10**6, 0)]))
+
+    # Rows appended but not flushed are invisible to a new reader.
+    fs.append([(10**6, 0)], _rows([(10**6, 0)]))
+    assert len(open_feature_store(root)) == len(reader)
+    fs.close()
+    assert len(open_feature_store(root)) == len(reader) + 1
+
+
+def test_set_column_writes_a_new_generation(tmp_path):
+    root = tmp_path / "features"
+    fs = FeatureStore(root)
+    keys = [(t, 0) for t in range(3)]
+    fs.set_column("vec", np.empty((0, DIM), dtype=np.float32), model="m")
+    fs.append(keys, _rows(keys))
+    fs.set_column("vec", np.ones((3, 2), dtype=np.float16), model="m2", version="2")
+
+    spec = fs.columns["vec"]
+    assert (spec["generation"], spec["model"], spec["version"], spec["dim"]) == (1, "m2", "2", 2)
+    assert (root / "vec.1.bin").exists() and not (root / "vec.0.bin").exists()
+    with pytest.raises(ValueError):
+        fs.set_column("vec", np.ones((2, 2)))
+    with pytest.raises(ValueError):
+        fs.set_column("tweet_id", np.ones(3))
+    fs.close()
+
+    reader = open_feature_store(root)
+    assert reader.column("vec").dtype == np.float16
+    np.testing.assert_array_equal(reader.matrix(["vec"]), np.ones((3, 2)))
+
+
+def test_update_is_durable_after_flush(tmp_path):
+    root = tmp_path / "features"
+    fs = FeatureStore(root)
+    keys = [(t, 0) for t in range(5)]
+    fs.set_column("vec", np.empty((0, DIM), dtype=np.float32), model="m")
+    fs.append(keys, _rows(keys))
+    fs.flush()
+
+    fs.update("vec", [1, 3], np.full((2, DIM), 9, dtype=np.float32))
+    with pytest.raises(ValueError):
+        fs.update("tweet_id", [0], [42])
+    with pytest.raises(IndexError):
+        fs.update("vec", [5], np.zeros((1, DIM)))
+    fs.flush()
+    meta = json.loads((root / "meta.json").read_text(encoding="utf-8"))
+    assert meta["count"] == 5
+    fs.close()
+
+    reader = open_feature_store(root)
+    np.testing.assert_array_equal(reader.column("vec")[:, 0], [0, 9, 2, 9, 4])
+
+
+def _embedding_store(root, keys):
+    store = EmbeddingStore(root, "m", DIM)
+    store.add(keys, np.arange(len(keys) * DIM, dtype=np.float32).reshape(-1, DIM))
+    store.flush()
+    store.close()
+
+
+def _write_dataset(path, rows):
+    path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows), encoding="utf-8")
+
+
+def test_build_features_updates_changed_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    images = []
+    for i in range(4):
+        (tmp_path / f"img{i}.jpg").write_bytes(b"image %d" % i)
+        images.append(hashlib.sha256(b"image %d" % i).hexdigest())
+    texts = ["صحة", "لقاح", "سكري"]
+    rows = [
+        {"tweet_id": "1", "text": texts[0], "label": "true",
+         "image_paths": ["img0.jpg", "img1.jpg"], "image_sha256s": images[:2]},
+        {"tweet_id": "2", "text": texts[1], "label": "false",
+         "image_paths": ["img2.jpg"], "image_sha256s": images[2:3]},
+    ]
+    _embedding_store(tmp_path / "img_store", images)
+    _embedding_store(tmp_path / "txt_store", [text_key(combine_text({"text": t})) for t in texts])
+    dataset = tmp_path / "final.jsonl"
+    _write_dataset(dataset, rows)
+
+    def build():
+        return build_features(dataset, tmp_path / "features", tmp_path / "img_store", tmp_path / "txt_store")
+
+    assert build() == 3
+    img_store = EmbeddingStore(tmp_path / "img_store", "m", DIM)
+    txt_store = EmbeddingStore(tmp_path / "txt_store", "m", DIM)
+
+    rows[0]["label"] = "misleading"
+    rows[1]["text"] = texts[2]
+    rows[1]["image_paths"], rows[1]["image_sha256s"] = ["img3.jpg"], images[3:]
+    _write_dataset(dataset, rows)
+    assert build() == 0
+
+    fs = open_feature_store(tmp_path / "features")
+    assert len(fs) == 3
+    r = fs.rows([(1, 0), (1, 1), (2, 0)])
+    np.testing.assert_array_equal(fs.column(LABEL_COLUMN)[r],
+                                  [LABELS["misleading"], LABELS["misleading"], LABELS["false"]])
+    np.testing.assert_array_equal(fs.column(IMAGE_COLUMN)[r[2]], img_store.get([images[3]])[0])
+    tkey = text_key(combine_text({"text": texts[2]}))
+    np.testing.assert_array_equal(fs.column(TEXT_COLUMN)[r[2]], txt_store.get([tkey])[0])
+    assert bytes(fs.column("image_sha256")[r[2]]).hex() == images[3]
@@ -0,0 +1,60 @@
+"""Which download errors the fetcher retries."""
+from __future__ import annotations
+
+import pytest
+import requests
+
+from src import fetcher
+from src.fetcher import Fetcher
+
+
+class FailingSession(requests.Session):
+    def __init__(self, error: Exception) -> None:
+        super().__init__()
+        self.error = error
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def _http_error(status: int) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(response=response)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(fetcher.time, "sleep", lambda _: None)
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.InvalidURL("bad"),
+    requests.exceptions.MissingSchema("bad"),
+    requests.exceptions.InvalidSchema("bad"),
+    requests.exceptions.TooManyRedirects("loop"),
+    requests.exceptions.SSLError("cert"),
+    _http_error(404),
+])
+def test_permanent_errors_fail_fast(tmp_path, error):
+    session = FailingSession(error)
+    with pytest.raises(type(error)):
+        Fetcher(max_retries=3, session=session).download("https://x/a.jpg", tmp_path)
+    assert session.calls == 1
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ReadTimeout("slow"),
+    requests.exceptions.ConnectionError("reset"),
+    requests.exceptions.ChunkedEncodingError("cut"),
+    _http_error(503),
+])
+def test_transient_errors_are_retried(tmp_path, error):
+    session = FailingSession(error)
+    f = Fetcher(max_retries=3, session=session)
+    with pytest.raises(type(error)):
+        f.download("https://x/a.jpg", tmp_path)
+    assert session.calls == 4
+    assert f.stats.retries == 3
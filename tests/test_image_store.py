@@ -0,0 +1,20 @@
+"""Reopening the image store after a crash."""
+from __future__ import annotations
+
+from src.image_store import ImageStore
+
+
+def test_put_after_torn_manifest_survives_reopen(tmp_path):
+    store = ImageStore(tmp_path)
+    store.put_bytes("https://x/a.jpg", b"a")
+    with store.manifest_path.open("a", encoding="utf-8") as f:
+        f.write('{"url": "https://x/b.jpg", "sha')  # torn by a crash
+
+    store = ImageStore(tmp_path)
+    assert len(store) == 1
+    path = store.put_bytes("https://x/c.jpg", b"c")
+
+    store = ImageStore(tmp_path)
+    assert store.path_for_url("https://x/c.jpg") == path
+    assert path.read_bytes() == b"c"
+    assert "https://x/b.jpg" not in store
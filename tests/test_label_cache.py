@@ -0,0 +1,93 @@
+"""LabelCache keys, eviction, prompt-version purging and in-flight dedupe."""
+from __future__ import annotations
+
+import itertools
+import threading
+
+import pytest
+
+pytest.importorskip("openai")
+
+from src import label_cache
+from src.label_cache import LabelCache
+
+LABEL = {"label": "false", "justification": "j", "sources": []}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = itertools.count(1)
+    monkeypatch.setattr(label_cache.time, "time", lambda: float(next(ticks)))
+
+
+def test_key_ignores_cosmetic_differences(tmp_path):
+    cache = LabelCache(tmp_path / "labels.sqlite")
+    key = cache.make_key("الخل  يشفي\nالسكري", "نص")
+    assert key == cache.make_key(" الخل يشفي السكري ", "نص ")
+    assert key == LabelCache(tmp_path / "other.sqlite").make_key("الخل يشفي السكري", "نص")
+    assert key != cache.make_key("الخل يشفي السكري", "")
+    assert key != cache.make_key("الخل يشفي السكري", "نص", model="other-model")
+    assert key != LabelCache(tmp_path / "v2.sqlite", prompt_version="v2").make_key("الخل يشفي السكري", "نص")
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = LabelCache(tmp_path / "labels.sqlite", max_bytes=10**6)
+    size = len(label_cache.json.dumps(LABEL))
+    cache.max_bytes = 3 * size
+    for name in "abc":
+        cache.put(name, LABEL)
+    assert cache.get("a") == LABEL  # "b", then "c", are now the least recently used
+
+    # Over budget: evicts down to 90% of it, least recently used first.
+    cache.put("d", LABEL)
+    assert cache.get("b") is None and cache.get("c") is None
+    assert cache.get("a") == LABEL and cache.get("d") == LABEL
+
+
+def test_invalidate_prompt_versions(tmp_path):
+    path = tmp_path / "labels.sqlite"
+    old = LabelCache(path, prompt_version="old")
+    old.put("k-old", LABEL)
+    old.close()
+
+    cache = LabelCache(path, prompt_version="new", purge_stale=False)
+    cache.put("k-new", LABEL)
+    assert cache.get("k-old") == LABEL
+    assert cache.invalidate_prompt_versions() == 1
+    assert cache.get("k-old") is None and cache.get("k-new") == LABEL
+    assert LabelCache(path, prompt_version="newer").get("k-new") is None  # purged on open
+
+
+def test_concurrent_misses_compute_once(tmp_path):
+    cache = LabelCache(tmp_path / "labels.sqlite")
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return LABEL
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == [LABEL] * 4
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_failed_compute_is_not_cached(tmp_path):
+    cache = LabelCache(tmp_path / "labels.sqlite")
+
+    def fail():
+        raise RuntimeError("api down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("k", fail)
+    assert cache.get_or_compute("k", lambda: LABEL) == LABEL
@@ -0,0 +1,54 @@
+"""Packed labeling: grouping posts into requests and parsing the answers."""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+pytest.importorskip("openai")
+
+from src.labeler import estimate_packed_tokens, parse_packed_response, plan_packs
+
+
+def _items(n, text="منشور قصير"):
+    return [{"tweet_id": str(i), "text": text, "ocr_text": ""} for i in range(n)]
+
+
+def test_plan_packs_respects_pack_size():
+    packs = plan_packs(_items(10), pack_size=4, token_budget=10**6)
+    assert [len(p) for p in packs] == [4, 4, 2]
+    assert [item["tweet_id"] for p in packs for item in p] == [str(i) for i in range(10)]
+
+
+def test_plan_packs_respects_token_budget():
+    items = _items(6)
+    budget = estimate_packed_tokens(items[:2])
+    packs = plan_packs(items, pack_size=10, token_budget=budget)
+    assert [len(p) for p in packs] == [2, 2, 2]
+    assert all(estimate_packed_tokens(p) <= budget for p in packs)
+
+
+def test_plan_packs_gives_an_oversized_item_its_own_pack():
+    items = _items(1) + _items(1, text="نص طويل " * 2000) + _items(1)
+    packs = plan_packs(items, pack_size=10, token_budget=estimate_packed_tokens(items[:2]) // 10)
+    assert [len(p) for p in packs] == [1, 1, 1]
+
+
+def test_parse_packed_response_keeps_valid_items():
+    content = json.dumps({"results": [
+        {"tweet_id": 1, "label": "false", "justification": "j", "sources": ["s"]},
+        {"tweet_id": "2", "label": "true", "justification": "j"},
+        {"tweet_id": "3", "label": "maybe", "justification": "j"},
+        {"tweet_id": "4", "label": "true"},
+        {"label": "true", "justification": "j"},
+        "not an object",
+    ]})
+    assert parse_packed_response(content) == {
+        "1": {"label": "false", "justification": "j", "sources": ["s"]},
+        "2": {"label": "true", "justification": "j", "sources": []},
+    }
+
+
+@pytest.mark.parametrize("content", [None, "", "not json", "[1, 2]", '{"results": {}}', '{"other": []}'])
+def test_parse_packed_response_rejects_malformed_answers(content):
+    assert parse_packed_response(content) == {}
@@ -0,0 +1,52 @@
+"""Near-duplicate recall of the OCR cache for every supported similarity."""
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from src.ocr_cache import HASH_BITS, MAX_BANDS, OcrCache
+
+
+def _flip(value: int, n_bits: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(HASH_BITS), n_bits):
+        value ^= 1 << bit
+    return value
+
+
+@pytest.mark.parametrize("max_distance", [1, 3, 6, 10, MAX_BANDS - 1])
+def test_finds_every_hash_within_max_distance(tmp_path, max_distance):
+    rng = random.Random(max_distance)
+    cache = OcrCache(tmp_path / "ocr.sqlite", similarity=1 - max_distance / HASH_BITS)
+    assert cache.max_distance == max_distance
+
+    for i in range(50):
+        dhash = rng.getrandbits(HASH_BITS)
+        cache.store(f"sha{i}", dhash, "ara", "", f"text {i}")
+        near = _flip(dhash, max_distance, rng)
+        assert cache.lookup("other", near, "ara") == (f"text {i}", "near")
+        assert cache.lookup("other", _flip(dhash, max_distance, rng), "eng") is None
+    cache.close()
+
+
+def test_rejects_unsupported_similarity(tmp_path):
+    with pytest.raises(ValueError):
+        OcrCache(tmp_path / "ocr.sqlite", similarity=1 - MAX_BANDS / HASH_BITS)
+
+
+def test_reopening_with_another_similarity_bands_old_entries(tmp_path):
+    path = tmp_path / "ocr.sqlite"
+    rng = random.Random(0)
+    dhash = rng.getrandbits(HASH_BITS)
+    OcrCache(path, similarity=1 - 3 / HASH_BITS).store("sha", dhash, "ara", "", "text")
+
+    cache = OcrCache(path, similarity=1 - 8 / HASH_BITS)
+    assert cache.lookup("other", _flip(dhash, 8, rng), "ara") == ("text", "near")
+
+
+
+def test_settings_key_separates_ocr_backends():
+    from src.ocr_step import ocr_settings_key
+
+    for steps in ((), ("gray", "threshold")):
+        assert ocr_settings_key(steps, "tesserocr") != ocr_settings_key(steps, "pytesseract")
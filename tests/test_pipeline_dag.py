@@ -0,0 +1,144 @@
+"""
+Run the pipeline graph (build -> ocr -> label, build -> download, both ->
+assemble) with tiny channels and stand-in stage modules, to check that the
+scheduling cannot deadlock when one branch holds its records back.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import types
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import pytest
+
+from src import run_pipeline
+from src.records import merge_records, read_records, tap_records, write_records
+
+N_TWEETS = 200
+RUN_TIMEOUT = 30
+
+
+def _source(path: Path, records: Optional[Iterable[Dict[str, Any]]]) -> Iterable[Dict[str, Any]]:
+    return read_records(path) if records is None else records
+
+
+def _fake_modules(label_backend: str) -> Dict[str, types.ModuleType]:
+    def build_image_tweet_dataset(raw_path, output_path, records=None, on_record=None):
+        rows = ({"tweet_id": str(i), "text": f"tweet {i}"} for i in range(N_TWEETS))
+        write_records(Path(output_path), tap_records(rows, on_record))
+
+    def add_ocr_to_dataset(input_path, output_path, workers=1, records=None, on_record=None):
+        def rows():
+            for rec in _source(input_path, records):
+                rec["ocr_text"] = f"ocr {rec['tweet_id']}"
+                yield rec
+        write_records(output_path, tap_records(rows(), on_record))
+
+    def add_labels_to_dataset(input_path, output_path, backend="sync", records=None,
+                              on_record=None, **kwargs):
+        rows = _source(input_path, records)
+        if backend == "batch":
+            # Like a batch job: nothing comes out before the input is complete.
+            rows = list(rows)
+
+        def labeled():
+            for rec in rows:
+                rec["label"] = "true"
+                yield rec
+        write_records(output_path, tap_records(labeled(), on_record))
+
+    def download_images_for_dataset(input_path, output_path, index_csv_path=None,
+                                    records=None, on_record=None):
+        def rows():
+            for rec in _source(input_path, records):
+                rec["local_image_paths"] = [f"images/{rec['tweet_id']}.jpg"]
+                yield rec
+        write_records(output_path, tap_records(rows(), on_record))
+
+    def attach_local_images(labeled_path, images_path, output_path, labeled=None, images=None):
+        rows = merge_records(
+            _source(labeled_path, labeled), _source(images_path, images), ["local_image_paths"]
+        )
+        write_records(output_path, rows)
+
+    def module(name: str, **attrs: Any) -> types.ModuleType:
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        return mod
+
+    return {
+        "src.build_dataset": module(
+            "src.build_dataset", build_image_tweet_dataset=build_image_tweet_dataset),
+        "src.add_ocr_to_dataset": module(
+            "src.add_ocr_to_dataset", OCR_WORKERS=1, add_ocr_to_dataset=add_ocr_to_dataset),
+        "src.add_labels_to_dataset": module(
+            "src.add_labels_to_dataset", LABEL_BACKEND=label_backend, LABEL_CONCURRENCY=1,
+            LABEL_PACK_SIZE=1, add_labels_to_dataset=add_labels_to_dataset),
+        "src.download_images": module(
+            "src.download_images", download_images_for_dataset=download_images_for_dataset,
+            attach_local_images=attach_local_images),
+    }
+
+
+@pytest.mark.parametrize("label_backend", ["sync", "batch"])
+def test_dag_completes_with_small_channels(tmp_path, monkeypatch, label_backend):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(run_pipeline, "CHANNEL_SIZE", 4)
+    for name, mod in _fake_modules(label_backend).items():
+        monkeypatch.setitem(sys.modules, name, mod)
+
+    to_run = ["build", "ocr", "label", "download", "assemble"]
+    errors = []
+
+    def run() -> None:
+        try:
+            run_pipeline.execute(run_pipeline.STAGES, to_run)
+        except BaseException as e:
+            errors.append(e)
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(RUN_TIMEOUT)
+    assert not runner.is_alive(), "pipeline deadlocked"
+    assert not errors
+
+    final = list(read_records(run_pipeline.FINAL_PATH))
+    assert [rec["tweet_id"] for rec in final] == [str(i) for i in range(N_TWEETS)]
+    assert all(rec["label"] == "true" and rec["local_image_paths"] for rec in final)
+
+
+def test_unchanged_always_stage_does_not_invalidate_downstream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw, built = Path("raw.jsonl"), Path("built.jsonl")
+    noop = lambda inputs, on_record: None
+    stages = [
+        run_pipeline.Stage("collect", raw, [], ["records"], noop, always=True),
+        run_pipeline.Stage("build", built, ["collect"], ["records"], noop),
+    ]
+    by_name = {s.name: s for s in stages}
+    write_records(raw, [{"tweet_id": "1"}])
+    write_records(built, [{"tweet_id": "1"}])
+    state = {s.name: run_pipeline.stage_fingerprint(s, by_name) for s in stages}
+
+    # Before the refresh only the always-stage is scheduled.
+    assert run_pipeline.plan(stages, state) == {"collect": run_pipeline.REFRESH}
+    # It ran without changing its output: nothing else is stale.
+    assert run_pipeline.plan(stages, state, refreshed=["collect"]) == {}
+    # It appended tweets: its dependents rerun.
+    write_records(raw, [{"tweet_id": "1"}, {"tweet_id": "2"}])
+    assert list(run_pipeline.plan(stages, state, refreshed=["collect"])) == ["build"]
+    # Forcing it still reruns everything downstream.
+    assert list(run_pipeline.plan(stages, state, force=["collect"])) == ["collect", "build"]
+
+
+def test_stage_code_version_follows_imports():
+    by_name = {stage.name: stage for stage in run_pipeline.STAGES}
+    deps = {name: set(run_pipeline.module_dependencies(stage.modules)) for name, stage in by_name.items()}
+
+    assert {"checkpoint", "records", "concurrency", "ocr_cache", "image_store"} <= deps["ocr"]
+    assert {"checkpoint", "records", "label_cache", "batch_labeler"} <= deps["label"]
+    assert {"image_store", "fetcher", "records", "concurrency"} <= deps["download"] == deps["assemble"]
+    assert {"embedding_store", "text_preprocessing"} <= deps["features"]
+    assert "ocr_step" not in deps["label"]
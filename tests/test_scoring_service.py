@@ -0,0 +1,94 @@
+"""Micro-batching and latency metrics of the scoring service."""
+from __future__ import annotations
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.scoring_service import MicroBatcher, ScoringMetrics
+
+FAR = 3600.0
+
+
+def _deadline(seconds: float = FAR) -> float:
+    return time.perf_counter() + seconds
+
+
+def _double(items):
+    return np.asarray(items, dtype=np.float32)[:, None] * 2
+
+
+def test_batches_are_capped_at_max_batch():
+    sizes = []
+    metrics = ScoringMetrics(slo=1.0)
+
+    def fn(items):
+        sizes.append(len(items))
+        return _double(items)
+
+    batcher = MicroBatcher("enc", fn, max_batch=4, max_wait=FAR, metrics=metrics)
+    futures = [batcher.submit(i, _deadline()) for i in range(10)]
+    batcher.close()
+
+    assert sizes == [4, 4, 2]
+    assert [f.result(timeout=5)[0] for f in futures] == [2.0 * i for i in range(10)]
+    assert metrics.snapshot()["batches"]["enc"] == {"count": 3, "mean_size": 3.33}
+
+
+def test_batch_starts_early_for_an_urgent_deadline():
+    batcher = MicroBatcher("enc", _double, max_batch=32, max_wait=FAR)
+    started = time.perf_counter()
+    future = batcher.submit(1, _deadline(0.05))
+    assert future.result(timeout=5)[0] == 2.0
+    assert time.perf_counter() - started < 1.0
+    batcher.close()
+
+
+def test_short_encoder_result_fails_every_item():
+    batcher = MicroBatcher("enc", lambda items: _double(items)[:-1], max_batch=3, max_wait=FAR)
+    futures = [batcher.submit(i, _deadline()) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="returned 2 rows for 3 items"):
+            future.result(timeout=5)
+    batcher.close()
+
+
+def test_cancelled_item_is_dropped():
+    calls = []
+    running = threading.Event()
+    release = threading.Event()
+
+    def fn(items):
+        calls.append(list(items))
+        running.set()
+        release.wait(5)
+        return np.zeros((len(items), 1), dtype=np.float32)
+
+    batcher = MicroBatcher("enc", fn, max_batch=8, max_wait=0.0)
+    first = batcher.submit("a", _deadline())
+    assert running.wait(5)
+    given_up = batcher.submit("b", _deadline())
+    kept = batcher.submit("c", _deadline())
+    assert given_up.cancel()
+    release.set()
+    batcher.close()
+
+    assert calls == [["a"], ["c"]]
+    assert first.result(timeout=5).shape == kept.result(timeout=5).shape == (1,)
+    assert given_up.cancelled()
+
+
+def test_snapshot_percentiles():
+    metrics = ScoringMetrics(slo=0.1, window=100)
+    for ms in range(1, 101):
+        metrics.request(ms / 1e3)
+    metrics.request(0.5)  # pushes the 1 ms sample out of the window
+
+    snap = metrics.snapshot()
+    total = snap["latency_ms"]["total"]
+    assert total["n"] == 100
+    assert (total["p50"], total["p99"]) == (52.0, 500.0)
+    assert snap["requests"] == 101 and snap["slo_missed"] == 1
+    assert snap["slo_met_ratio"] == round(100 / 101, 4)
@@ -0,0 +1,46 @@
+"""SeenIdIndex against a plain Python set, across merges, batches and reloads."""
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from src.seen_index import SeenIdIndex
+
+
+def test_matches_a_set(tmp_path):
+    rng = random.Random(3)
+    path = tmp_path / "seen.idx"
+    ref = set()
+    seen = SeenIdIndex(path, merge_every=50)
+
+    for _ in range(3000):
+        r = rng.random()
+        if r < 0.6:
+            x = rng.randrange(5000)
+            assert seen.add(x) == (x not in ref)
+            ref.add(x)
+        elif r < 0.7:
+            batch = [rng.randrange(5000) for _ in range(rng.randrange(120))]
+            assert seen.update(batch) == len(set(batch) - ref)
+            ref.update(batch)
+        elif r < 0.9:
+            x = rng.randrange(5000)
+            assert (x in seen) == (x in ref)
+        elif r < 0.97:
+            batch = [rng.randrange(5000) for _ in range(30)]
+            assert list(seen.contains_many(batch)) == [x in ref for x in batch]
+        else:
+            seen.close()
+            seen = SeenIdIndex(path, merge_every=50)
+        assert len(seen) == len(ref)
+
+    assert list(seen) == sorted(ref)
+
+
+def test_rejects_ids_outside_uint64():
+    seen = SeenIdIndex()
+    with pytest.raises(ValueError):
+        seen.add(-1)
+    with pytest.raises(ValueError):
+        seen.update([1 << 64])